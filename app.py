@@ -1,25 +1,135 @@
-from flask import Flask, request, jsonify, render_template
+import time
+_import_start = time.perf_counter()
+from flask import Flask, Response, g, request, jsonify, render_template, send_file, stream_with_context
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import os
 from werkzeug.utils import secure_filename
 import json
-from models.speech_recognition import recognize_speech
-from models.intent_recognition import extract_intent, preprocess_text
-from models.voice_biometrics import authenticate_voice, enroll_user_voice
-from services.banking_service import process_banking_request
-from services.user_service import get_user_by_id, authenticate_user, create_user, update_user_language
+import secrets
+from models.voice_biometrics import enroll_user_voice
+from services.banking_service import process_bulk_transfers, get_account_store, export_transactions
+from services.voice_pipeline import process_voice_file
+from services.job_queue import get_job_queue
+from services.admission import Overloaded, STAGES, admit
+from services import logs, metrics, profiling, startup
+from services.user_service import get_user_by_id, authenticate_user, create_user, update_user_language, PasswordHashBusy
+from services.session_service import issue_session_token, session_key, verify_session_token
+from services.pcm_audio import PCM_FORMAT, read_pcm
+from services.voice_stream import VoiceStream, user_stream_slot
 from datetime import datetime
 
+# Log records are written by a background thread, as JSON by default
+logs.configure_logging()
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads/audio'
+# Maximum number of transfers accepted in one bulk request
+app.config['BULK_TRANSFER_LIMIT'] = int(os.environ.get('BULK_TRANSFER_LIMIT', 10000))
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Seconds a voice stream may stay silent (no frames or messages) before it is closed
+app.config['STREAM_IDLE_TIMEOUT'] = float(os.environ.get('STREAM_IDLE_TIMEOUT', 10))
+sock = Sock(app)
 
 # Ensure data directory exists
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
 os.makedirs(data_dir, exist_ok=True)
 
+# Models load lazily in the stage that uses them; fail now if a required one
+# is missing rather than in (or downloading from) the first request
+startup.record_import_time('app', time.perf_counter() - _import_start)
+startup.check_startup()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    # Tags this request's log records; a caller's X-Request-ID is kept
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or secrets.token_hex(8)
+    g.request_id_token = logs.bind_request_id(g.request_id)
+
+@app.after_request
+def record_request_latency(response):
+    if 'request_start' in g:
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_start,
+                        endpoint=request.endpoint or 'unknown', status=response.status_code)
+    if 'request_id' in g:
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
+@app.teardown_request
+def clear_request_id(error=None):
+    if 'request_id_token' in g:
+        logs.reset_request_id(g.request_id_token)
+
+def session_user(user_id=None, token=None, require_token=False):
+    """
+    Find the user a request acts for. Returns (user, error message, status).
+
+    A bearer session token from /api/login is checked by its signature alone,
+    with no user database access. Clients without a token still name the
+    user by user_id, unless require_token is set (endpoints that move money
+    or return account history without a voice check). WebSocket clients,
+    which cannot set headers, pass the token explicitly. A verified token's
+    session_key is kept in g.session_key, None without a token.
+    """
+    auth_header = request.headers.get('Authorization', '')
+    if token is None and auth_header.startswith('Bearer '):
+        token = auth_header[len('Bearer '):].strip()
+    g.session_key = None
+    if not token and require_token:
+        return None, 'A session token is required, please log in', 401
+    if token:
+        user = verify_session_token(token)
+        if user is None:
+            return None, 'Session expired or invalid, please log in again', 401
+        if user_id and str(user_id) != str(user['id']):
+            return None, 'User ID does not match the session', 403
+        g.session_key = session_key(token)
+        return user, None, None
+    if not user_id:
+        return None, 'User ID is required', 400
+    with metrics.span('user_lookup'):
+        user = get_user_by_id(user_id)
+    if not user:
+        return None, 'User not found', 404
+    return user, None, None
+
 @app.route('/')
 def index():
-    return render_template('index.html)
+    return render_template('index.html')
+
+def wants_async():
+    """Job mode: the client sent async=1 or the header 'Prefer: respond-async'."""
+    return (request.form.get('async', '').lower() in ('1', 'true')
+            or 'respond-async' in request.headers.get('Prefer', ''))
+
+def wants_timings():
+    """Per-stage timing breakdown requested with timings=1."""
+    return request.values.get('timings', '').lower() in ('1', 'true')
+
+def idempotency_key():
+    """
+    The client's Idempotency-Key header (or idempotency_key field). A retried
+    request with the same key does not repeat a transfer; without one the
+    hash of the audio serves as the key.
+    """
+    return request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or None
+
+def uploaded_pcm(audio_file):
+    """
+    The raw PCM fast path: with audio_format=pcm_s16le and sample_rate (and
+    optionally channels) the upload holds bare samples that are used without
+    decoding. Returns (PCMAudio or None for a regular audio file, error message).
+    """
+    audio_format = request.form.get('audio_format')
+    if not audio_format:
+        return None, None
+    if audio_format != PCM_FORMAT:
+        return None, f'Unsupported audio_format {audio_format!r}, only {PCM_FORMAT} is accepted'
+    try:
+        return read_pcm(audio_file.read(), request.form.get('sample_rate'), request.form.get('channels', 1)), None
+    except ValueError as e:
+        return None, str(e)
 
 @app.route('/api/process-voice', methods=['POST'])
 def process_voice():
@@ -30,62 +140,221 @@ def process_voice():
     if not audio_file or not audio_file.filename:
         return jsonify({'error': 'Invalid audio file'}), 400
         
-    user_id = request.form.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'User ID is required'}), 400
+    user, error, status = session_user(request.form.get('user_id'))
+    if error:
+        return jsonify({'error': error}), status
         
     language = request.form.get('language', 'en-US')  # Default to English
     
+    pcm_audio, error = uploaded_pcm(audio_file)
+    if error:
+        return jsonify({'error': error}), 400
+    
     # Save audio file temporarily with a unique name to avoid conflicts
     original_filename = secure_filename(audio_file.filename)
     filename = f"{os.path.splitext(original_filename)[0]}_{os.urandom(4).hex()}{os.path.splitext(original_filename)[1]}"
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    queued = False
     
     try:
-        audio_file.save(filepath)
-        
-        if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
-            return jsonify({'error': 'Failed to save audio file or file is empty'}), 500
-        
-        # Step 1: Authenticate voice
-        auth_result = authenticate_voice(filepath, user_id)
-        if not auth_result['authenticated']:
-            return jsonify({'error': 'Voice authentication failed'}), 401
-        
-        # Step 2: Speech recognition
-        text = recognize_speech(filepath, language)
+        if pcm_audio is None:
+            audio_file.save(filepath)
+            
+            if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+                return jsonify({'error': 'Failed to save audio file or file is empty'}), 500
         
-        # Check if there was a speech recognition error
-        if text and text.startswith('Error processing speech:'):
-            return jsonify({'error': text}), 500
-        
-        # Preprocess text for display
-        preprocessed_text = preprocess_text(text)
-        
-        # Step 3: Intent recognition
-        intent_data = extract_intent(text, language)
-        
-        # Step 4: Process banking request
-        user = get_user_by_id(user_id)
-        response = process_banking_request(intent_data, user)
+        if wants_async():
+            # The job worker processes and then deletes the file
+            payload = {'audio_path': os.path.abspath(filepath), 'user': user, 'language': language,
+                       'timings': wants_timings(), 'profile': profiling.should_profile(request.headers),
+                       'idempotency_key': idempotency_key(), 'request_id': g.request_id,
+                       'session': g.session_key}
+            if pcm_audio is not None:
+                with open(filepath, 'wb') as f:
+                    f.write(pcm_audio.pcm)
+                payload.update(audio_format=PCM_FORMAT, sample_rate=pcm_audio.sample_rate)
+            job_id = get_job_queue().submit(payload, owner_id=str(user['id']))
+            queued = True
+            status_url = f'/api/jobs/{job_id}'
+            return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url,
+                            'events_url': f'{status_url}/events'}), 202, {'Location': status_url}
         
-        return jsonify({
-            'recognized_text': text,
-            'preprocessed_text': preprocessed_text,
-            'intent': intent_data,
-            'response': response
-        })
+        with profiling.maybe_profile(profiling.should_profile(request.headers), 'process-voice') as profile_id:
+            # Raw PCM never touches the disk on the synchronous path
+            body, status = process_voice_file(pcm_audio or filepath, user, language, timings=wants_timings(),
+                                              idempotency_key=idempotency_key(), session=g.session_key)
+        if profile_id:
+            body['profile_id'] = profile_id
+        return jsonify(body), status
+    
+    except Overloaded as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
     finally:
         # Clean up the temporary file
-        if os.path.exists(filepath):
+        if not queued and os.path.exists(filepath):
             try:
                 os.remove(filepath)
             except Exception as e:
-                app.logger.error(f"Failed to remove temporary file {filepath}: {str(e)}")
+                app.logger.error("Failed to remove temporary file %s: %s", filepath, e)
+
+@sock.route('/api/stream-voice')
+def stream_voice(ws):
+    """
+    Streaming voice requests over a WebSocket (see services/voice_stream.py).
+
+    The client first sends {"type": "start", "user_id", "token", "language",
+    "sample_rate", "timings", "idempotency_key"}, then binary frames of pcm_s16le mono samples,
+    and finally {"type": "end", "drop_samples": N} once the user stops
+    talking. The server sends {"type": "partial", "text", "intent", "parameters"} while
+    the audio is recognized and one {"type": "result", "status", ...} with
+    the body /api/process-voice would have returned, then closes. When the
+    process already has its STREAM_CONCURRENCY streams open the result is a
+    503 with "retry_after"; a user with STREAM_PER_USER streams open gets 429.
+    """
+    def send(event):
+        ws.send(json.dumps(event, default=str))
+
+    try:
+        with admit('stream'):
+            start_stream(ws, send)
+    except Overloaded as e:
+        send({'type': 'result', 'status': 503, 'error': str(e), 'retry_after': e.retry_after})
+
+def start_stream(ws, send):
+    """Read the start message, authorize the user and run the stream in one of their slots."""
+    idle_timeout = app.config['STREAM_IDLE_TIMEOUT']
+    try:
+        start = json.loads(ws.receive(timeout=idle_timeout) or 'null')
+    except (TypeError, ValueError):
+        start = None
+    if not isinstance(start, dict) or start.get('type') != 'start':
+        send({'type': 'result', 'status': 400, 'error': 'Expected a start message'})
+        return
+    user, error, status = session_user(start.get('user_id'), start.get('token'))
+    if error:
+        send({'type': 'result', 'status': status, 'error': error})
+        return
+    with user_stream_slot(user['id']) as admitted:
+        if not admitted:
+            send({'type': 'result', 'status': 429, 'error': 'Too many voice streams open, please finish one first'})
+            return
+        run_stream(ws, send, user, start)
+
+def run_stream(ws, send, user, start):
+    """Feed the client's frames to a VoiceStream and send its events and result."""
+    idle_timeout = app.config['STREAM_IDLE_TIMEOUT']
+    try:
+        stream = VoiceStream(user, start.get('language', 'en-US'), start.get('sample_rate', 16000),
+                             timings=bool(start.get('timings')),
+                             idempotency_key=start.get('idempotency_key') or None,
+                             session=g.session_key).start()
+    except ValueError as e:
+        send({'type': 'result', 'status': 400, 'error': str(e)})
+        return
+
+    try:
+        idle_since = time.monotonic()
+        while not stream.done:
+            message = ws.receive(timeout=0.05)
+            for event in stream.events():
+                send(event)
+            if message is None:
+                if time.monotonic() - idle_since > idle_timeout:
+                    stream.cancel()
+                    send({'type': 'result', 'status': 408, 'error': 'No audio received in time'})
+                    return
+                continue
+            idle_since = time.monotonic()
+            if isinstance(message, (bytes, bytearray)):
+                try:
+                    stream.feed(message)
+                except ValueError as e:
+                    stream.cancel()
+                    send({'type': 'result', 'status': 400, 'error': str(e)})
+                    return
+                continue
+            try:
+                control = json.loads(message)
+            except ValueError:
+                control = None
+            if isinstance(control, dict) and control.get('type') == 'end':
+                try:
+                    stream.finish(control.get('drop_samples', 0))
+                except ValueError:
+                    stream.finish()
+            elif isinstance(control, dict) and control.get('type') == 'cancel':
+                stream.cancel()
+                return
+        # Finished, or ended early by an error
+        for event in stream.events():
+            send(event)
+        body, status = stream.result
+        send(dict(body, type='result', status=status))
+    except ConnectionClosed:
+        stream.cancel()
+
+def find_job(job_id):
+    """
+    Look up a voice job. The id itself grants access; a session token, when
+    sent, must belong to the job's owner. Returns (queue, error response).
+    """
+    queue = get_job_queue()
+    owner_id = queue.owner(job_id)
+    if owner_id is None:
+        return None, (jsonify({'error': 'Job not found'}), 404)
+    if request.headers.get('Authorization'):
+        user, error, status = session_user()
+        if error or str(user['id']) != owner_id:
+            return None, (jsonify({'error': 'Job not found'}), 404)
+    return queue, None
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Status of a voice job. Finished jobs include 'result' (the body
+    /api/process-voice would have returned) and its 'status_code'.
+    Pass wait=N to hold the request up to N seconds (max 30) while the job is unfinished.
+    """
+    queue, error = find_job(job_id)
+    if error:
+        return error
+    job = queue.get(job_id)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 30)
+    if wait and job and job['status'] != 'done':
+        job = queue.wait(job_id, after=job['status'], timeout=wait)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: a 'status' event per state change and a final 'result' event."""
+    queue, error = find_job(job_id)
+    if error:
+        return error
+    
+    def events():
+        status = None
+        while True:
+            job = queue.wait(job_id, after=status, timeout=15)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            if job['status'] == status:
+                yield ': keep-alive\n\n'
+                continue
+            status = job['status']
+            event = 'result' if status == 'done' else 'status'
+            yield f"event: {event}\ndata: {json.dumps(job)}\n\n"
+            if status == 'done':
+                return
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # New routes for user authentication and management
 @app.route('/api/login', methods=['POST'])
@@ -97,12 +366,16 @@ def login():
     if not username or not password:
         return jsonify({'success': False, 'message': 'Username and password required'}), 400
     
-    user = authenticate_user(username, password)
+    try:
+        user = authenticate_user(username, password)
+    except PasswordHashBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
     
     if user:
         # Remove password hash before sending to client
         user_data = {k: v for k, v in user.items() if k != 'password_hash'}
-        return jsonify({'success': True, 'user': user_data})
+        token, expires_at = issue_session_token(user)
+        return jsonify({'success': True, 'user': user_data, 'token': token, 'expires_at': expires_at})
     else:
         return jsonify({'success': False, 'message': 'Invalid username or password'}), 401
 
@@ -119,7 +392,10 @@ def register():
     if not all([username, password, name, email, phone]):
         return jsonify({'success': False, 'message': 'All fields are required'}), 400
     
-    result = create_user(username, password, name, email, phone, language)
+    try:
+        result = create_user(username, password, name, email, phone, language)
+    except PasswordHashBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': '1'}
     
     if result['success']:
         return jsonify({'success': True, 'user_id': result['user_id']})
@@ -136,6 +412,11 @@ def update_language():
         return jsonify({'success': False, 'message': 'User ID and language required'}), 400
     
     result = update_user_language(user_id, language)
+    # The session carries the profile, so hand out one with the new language
+    if result['success'] and request.headers.get('Authorization'):
+        user, error, _ = session_user(user_id)
+        if not error:
+            result['token'], result['expires_at'] = issue_session_token(dict(user, language=language))
     return jsonify(result)
 
 @app.route('/api/enroll-voice', methods=['POST'])
@@ -149,6 +430,15 @@ def enroll_voice():
     if not user_id:
         return jsonify({'success': False, 'message': 'User ID required'}), 400
     
+    pcm_audio, error = uploaded_pcm(audio_file)
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+    if pcm_audio is not None:
+        try:
+            return jsonify(enroll_user_voice(pcm_audio, user_id))
+        except Exception as e:
+            return jsonify({'success': False, 'message': str(e)}), 500
+    
     # Save audio file temporarily
     filename = secure_filename(audio_file.filename)
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -164,6 +454,118 @@ def enroll_voice():
         if os.path.exists(filepath):
             os.remove(filepath)
 
+@app.route('/api/bulk-transfer', methods=['POST'])
+def bulk_transfer():
+    """
+    Post many transfers at once (payroll, bill-pay).
+    Body: {"transfers": [{"recipient": ..., "amount": ...}], "atomic": true}.
+    Requires a session token (Authorization: Bearer ...); a user_id in the
+    body must match it.
+    """
+    data = request.json or {}
+    transfers = data.get('transfers')
+    atomic = bool(data.get('atomic', True))
+    
+    if not isinstance(transfers, list) or not transfers:
+        return jsonify({'success': False, 'message': 'A non-empty list of transfers is required'}), 400
+    if len(transfers) > app.config['BULK_TRANSFER_LIMIT']:
+        return jsonify({'success': False, 'message': f"At most {app.config['BULK_TRANSFER_LIMIT']} transfers per request"}), 400
+    if not all(isinstance(t, dict) for t in transfers):
+        return jsonify({'success': False, 'message': 'Each transfer must be an object with recipient and amount'}), 400
+    
+    # No voice check here, so a bare user_id is not enough
+    user, error, status = session_user(data.get('user_id'), require_token=True)
+    if error:
+        return jsonify({'success': False, 'message': error}), status
+    
+    result = process_bulk_transfers(user, transfers, atomic=atomic)
+    if 'error' in result:
+        return jsonify(result), 400
+    return jsonify(result)
+
+def parse_date_range(args):
+    """Read optional since/until (YYYY-MM-DD) query parameters; raises ValueError if malformed."""
+    since = args.get('since') or None
+    until = args.get('until') or None
+    for value in (since, until):
+        if value:
+            datetime.strptime(value, '%Y-%m-%d')
+    return since, until
+
+@app.route('/api/transactions', methods=['GET'])
+def transactions():
+    """
+    Page through the session user's transactions, newest first. Requires a session token.
+    Query: limit (default 20, max 200), before (cursor from the previous page), since, until.
+    """
+    user, error, status = session_user(request.args.get('user_id'), require_token=True)
+    if error:
+        return jsonify({'success': False, 'message': error}), status
+    user_id = str(user['id'])
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 200)
+        since, until = parse_date_range(request.args)
+        page, next_cursor = get_account_store().transaction_page(
+            user_id, limit=limit, before=request.args.get('before'), since=since, until=until)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid limit, cursor or date'}), 400
+    
+    return jsonify({'success': True, 'transactions': page, 'next_cursor': next_cursor})
+
+@app.route('/api/transactions/export', methods=['GET'])
+def export_statement():
+    """
+    Stream the session user's statement as CSV (default) or JSON Lines.
+    Requires a session token. Query: format, since, until.
+    """
+    user, error, status = session_user(request.args.get('user_id'), require_token=True)
+    if error:
+        return jsonify({'success': False, 'message': error}), status
+    user_id = str(user['id'])
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'success': False, 'message': 'Format must be csv or jsonl'}), 400
+    try:
+        since, until = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"statement_{secure_filename(user_id)}.{fmt}"
+    return Response(stream_with_context(export_transactions(user_id, fmt, since, until)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage latency histograms, cache and model-load counters in Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiles', methods=['GET'])
+def profiles():
+    """List stored request profiles, newest first. Requires the X-Profile-Token admin header."""
+    if not profiling.is_admin(request.headers):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'profiles': profiling.list_profiles()})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """
+    Download a profile: the pstats file (default) or, with format=json, its
+    metadata, stage timings and top-functions summary. Requires X-Profile-Token.
+    """
+    if not profiling.is_admin(request.headers):
+        return jsonify({'error': 'Not found'}), 404
+    as_json = request.args.get('format') == 'json'
+    path = profiling.profile_path(profile_id, 'json' if as_json else 'prof')
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    if as_json:
+        return send_file(os.path.abspath(path), mimetype='application/json')
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f'{profile_id}.prof')
+
 # Add a health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -174,7 +576,8 @@ def health_check():
         'services': {
             'voice_recognition': True,
             'database': os.path.exists(os.path.join(os.path.dirname(__file__), 'data'))
-        }
+        },
+        'model_stages': {name: limiter.stats() for name, limiter in STAGES.items()}
     }
     return jsonify(status)
 
@@ -0,0 +1,376 @@
+"""
+Accuracy and speed benchmark for intent recognition (extract_intent)
+
+This script expands templated banking phrases (the kinds used in test.py and
+test_hindi_numbers.py) with amounts, payee names and spending periods into a
+labeled corpus for en-US, hi-IN and ta-IN, runs extract_intent over it and
+reports:
+    - intent accuracy per language and per intent, with the misclassified phrases
+    - slot accuracy (amount, recipient, period) per language
+    - calls/second overall and by the stage that matched: 'flexible'
+      (word-overlap match, non-English only), 'pattern' (regex from
+      config/intent_patterns.json), 'keyword' (spaCy token fallback) or 'none'
+    - time per call spent in the spaCy parse (the intent.nlp span)
+
+Use it to gate edits to config/intent_patterns.json: save a baseline before the
+change and compare after it.
+
+Without the spaCy models installed the keyword fallback never runs and every
+call pays for a failed model load.
+
+Usage:
+    python benchmark_intents.py [--languages en-US,hi-IN,ta-IN] [--repeat 3]
+                                [--show-errors 10] [--save-baseline intents.json]
+                                [--compare intents.json --max-accuracy-drop 0 --max-slowdown 20]
+
+Prerequisites:
+    - All dependencies installed (pip install -r requirements.txt)
+    - spaCy models (en_core_web_sm, xx_ent_wiki_sm) for the keyword stage
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+# Must be set before transformers is imported
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+STAGES = ('flexible', 'pattern', 'keyword', 'none')
+
+# Slot values per language
+NAMES = {
+    'en-US': ['jane', 'john', 'alice', 'bob', 'maria'],
+    'hi-IN': ['जॉन', 'राम', 'सीता', 'अनिल', 'मोहन', 'राधा'],
+    'ta-IN': ['ராஜா', 'மீனா', 'குமார்'],
+}
+# (spoken form, value)
+AMOUNTS = {
+    'en-US': [('50', 50), ('100', 100), ('250', 250), ('1200', 1200), ('75.5', 75.5)],
+    'hi-IN': [('100', 100), ('सौ', 100), ('दो सौ', 200), ('पचास', 50), ('पांच सौ', 500),
+              ('एक हजार', 1000), ('दो हजार पांच सौ', 2500), ('एक सौ बीस', 120)],
+    'ta-IN': [('100', 100), ('500', 500), ('2000', 2000)],
+}
+# (spoken form, expected spending period)
+PERIODS = {
+    'en-US': [('last month', 'last_month'), ('last week', 'last_week'), ('today', 'today'),
+              ('this month', 'this_month'), ('', 'this_month')],
+    'hi-IN': [('पिछले महीने', 'last_month'), ('पिछले हफ्ते', 'last_week'), ('आज', 'today'),
+              ('इस महीने', 'this_month'), ('', 'this_month')],
+    'ta-IN': [('கடந்த மாதம்', 'last_month'), ('கடந்த வாரம்', 'last_week'), ('இன்று', 'today'),
+              ('இந்த மாதம்', 'this_month'), ('', 'this_month')],
+}
+
+# language -> [(template, intent, fixed expected parameters)]
+# {name}, {amount} and {period} are expanded with every value above and add
+# the recipient, amount and period slots to the expected parameters.
+TEMPLATES = {
+    'en-US': [
+        ("What is my account balance?", 'check_balance', {}),
+        ("what's my balance", 'check_balance', {}),
+        ("How much money do I have", 'check_balance', {}),
+        ("check my bank balance", 'check_balance', {}),
+        ("show me my balance", 'check_balance', {}),
+        ("tell me my balance please", 'check_balance', {}),
+        ("Transfer {amount} dollars to {name}", 'transfer_money', {}),
+        ("send {amount} dollars to {name}", 'transfer_money', {}),
+        ("pay {amount} to {name}", 'transfer_money', {}),
+        ("I want to send {amount} rupees to {name}", 'transfer_money', {}),
+        ("please transfer {amount} to {name} now", 'transfer_money', {}),
+        ("Show my recent transactions", 'transaction_history', {'period': 'recent'}),
+        ("show me my transactions", 'transaction_history', {'period': 'recent'}),
+        ("view my transaction history", 'transaction_history', {'period': 'recent'}),
+        ("what are my recent transactions", 'transaction_history', {'period': 'recent'}),
+        ("show my transactions from last month", 'transaction_history', {'period': 'last_month'}),
+        ("show my transactions from last week", 'transaction_history', {'period': 'last_week'}),
+        ("How much did I spend {period}", 'spending_summary', {}),
+        ("what did I spend {period}", 'spending_summary', {}),
+        ("show me my spending {period}", 'spending_summary', {}),
+        ("spending summary {period}", 'spending_summary', {}),
+    ],
+    'hi-IN': [
+        ("मेरा बैलेंस क्या है", 'check_balance', {}),
+        ("मेरे खाते में कितना पैसा है", 'check_balance', {}),
+        ("बैलेंस दिखाओ", 'check_balance', {}),
+        ("मुझे मेरा बैलेंस बताओ", 'check_balance', {}),
+        ("मेरा बैंक बैलेंस क्या है", 'check_balance', {}),
+        ("{name} को {amount} रुपये भेजिए", 'transfer_money', {}),
+        ("{name} को {amount} रुपये भेजें", 'transfer_money', {}),
+        ("{name} को {amount} रुपया भेजें", 'transfer_money', {}),
+        ("{name} को {amount} रुपये ट्रांसफर करें", 'transfer_money', {}),
+        ("{name} को {amount} भेजें", 'transfer_money', {}),
+        ("{name} को {amount} रुपये भेज दो", 'transfer_money', {}),
+        ("मुझे {name} को {amount} रुपये ट्रांसफर करना है", 'transfer_money', {}),
+        ("मेरे हाल के लेनदेन दिखाएं", 'transaction_history', {}),
+        ("मेरा लेनदेन इतिहास दिखाएं", 'transaction_history', {}),
+        ("मेरे हालिया लेनदेन क्या हैं", 'transaction_history', {}),
+        ("पिछले महीने के लेनदेन दिखाएं", 'transaction_history', {'period': 'last_month'}),
+        ("{period} मैंने कितना खर्च किया", 'spending_summary', {}),
+        ("{period} कितना खर्च हुआ", 'spending_summary', {}),
+        ("मेरे खर्च का सारांश दिखाएं", 'spending_summary', {'period': 'this_month'}),
+    ],
+    'ta-IN': [
+        ("என் இருப்பு என்ன", 'check_balance', {}),
+        ("என் கணக்கு இருப்பு காட்டு", 'check_balance', {}),
+        ("என் பணம் எவ்வளவு உள்ளது", 'check_balance', {}),
+        ("கணக்கு இருப்பு என்ன", 'check_balance', {}),
+        ("{name} க்கு {amount} ரூபாய் அனுப்பு", 'transfer_money', {}),
+        ("{name} க்கு {amount} ரூபாய் பரிமாற்றம் செய்", 'transfer_money', {}),
+        ("நான் {name} க்கு {amount} ரூபாய் அனுப்ப வேண்டும்", 'transfer_money', {}),
+        ("என் சமீபத்திய பரிவர்த்தனைகளைக் காட்டு", 'transaction_history', {}),
+        ("என் பரிவர்த்தனை வரலாற்றைக் காட்டு", 'transaction_history', {}),
+        ("சமீபத்திய பரிவர்த்தனைகள்", 'transaction_history', {}),
+        ("{period} நான் எவ்வளவு செலவு செய்தேன்", 'spending_summary', {}),
+        ("என் செலவு சுருக்கம்", 'spending_summary', {'period': 'this_month'}),
+    ],
+}
+
+def build_corpus(languages):
+    """Expand the templates into a list of labeled examples."""
+    corpus = []
+    for language in languages:
+        for template, intent, fixed in TEMPLATES[language]:
+            names = [(name, name) for name in NAMES[language]] if '{name}' in template else [(None, None)]
+            amounts = AMOUNTS[language] if '{amount}' in template else [(None, None)]
+            periods = PERIODS[language] if '{period}' in template else [(None, None)]
+            for (name, recipient), (spoken, amount), (when, period) in itertools.product(names, amounts, periods):
+                expected = dict(fixed)
+                if name is not None:
+                    # Recipients are only extracted for English and Hindi
+                    if language in ('en-US', 'hi-IN'):
+                        expected['recipient'] = recipient
+                if spoken is not None:
+                    expected['amount'] = amount
+                if when is not None:
+                    expected['period'] = period
+                text = template.format(name=name, amount=spoken, period=when)
+                corpus.append({
+                    'language': language,
+                    'text': ' '.join(text.split()),
+                    'intent': intent,
+                    'parameters': expected,
+                })
+    return corpus
+
+def slot_matches(expected, actual):
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return abs(expected - actual) < 1e-6
+    return expected == actual
+
+def percentiles(values):
+    if not values:
+        return {f'p{p}': None for p in PERCENTILES}
+    return {f'p{p}': round(float(np.percentile(values, p)), 1) for p in PERCENTILES}
+
+def evaluate(extract_intent, corpus):
+    """One pass for correctness: returns per-example outcomes."""
+    outcomes = []
+    for example in corpus:
+        result = extract_intent(example['text'], example['language'])
+        parameters = result.get('parameters', {})
+        slots = {slot: slot_matches(value, parameters.get(slot))
+                 for slot, value in example['parameters'].items()}
+        outcomes.append({
+            'example': example,
+            'predicted': result['intent_type'],
+            'parameters': parameters,
+            'matched_by': result.get('matched_by') or 'none',
+            'correct': result['intent_type'] == example['intent'],
+            'slots': slots,
+        })
+    return outcomes
+
+def measure(extract_intent, corpus, repeat):
+    """Time every call `repeat` times; returns per-stage latencies and the spaCy parse time."""
+    from services.metrics import collect_timings
+    latencies = {stage: [] for stage in STAGES}
+    nlp_seconds = 0.0
+    calls = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for example in corpus:
+            with collect_timings() as timings:
+                call_start = time.perf_counter()
+                result = extract_intent(example['text'], example['language'])
+                elapsed = time.perf_counter() - call_start
+            latencies[result.get('matched_by') or 'none'].append(elapsed)
+            nlp_seconds += timings.get('intent.nlp', 0.0)
+            calls += 1
+    wall = time.perf_counter() - start
+    return latencies, nlp_seconds, calls, wall
+
+def summarize(outcomes, latencies, nlp_seconds, calls, wall):
+    languages = {}
+    for outcome in outcomes:
+        language = outcome['example']['language']
+        summary = languages.setdefault(language, {
+            'examples': 0, 'correct': 0, 'slots': 0, 'slots_correct': 0,
+            'by_slot': {}, 'by_intent': {}, 'by_stage': {}})
+        summary['examples'] += 1
+        summary['correct'] += outcome['correct']
+        intent = summary['by_intent'].setdefault(outcome['example']['intent'], {'examples': 0, 'correct': 0})
+        intent['examples'] += 1
+        intent['correct'] += outcome['correct']
+        summary['by_stage'][outcome['matched_by']] = summary['by_stage'].get(outcome['matched_by'], 0) + 1
+        for slot, ok in outcome['slots'].items():
+            summary['slots'] += 1
+            summary['slots_correct'] += ok
+            counts = summary['by_slot'].setdefault(slot, {'expected': 0, 'correct': 0})
+            counts['expected'] += 1
+            counts['correct'] += ok
+
+    def rate(correct, total):
+        return round(correct / total * 100, 2) if total else None
+
+    for summary in languages.values():
+        summary['accuracy'] = rate(summary['correct'], summary['examples'])
+        summary['slot_accuracy'] = rate(summary['slots_correct'], summary['slots'])
+        for counts in summary['by_intent'].values():
+            counts['accuracy'] = rate(counts['correct'], counts['examples'])
+        for counts in summary['by_slot'].values():
+            counts['accuracy'] = rate(counts['correct'], counts['expected'])
+
+    stages = {}
+    for stage, values in latencies.items():
+        if not values:
+            continue
+        stages[stage] = {
+            'calls': len(values),
+            'share': round(len(values) / calls * 100, 2),
+            'calls_per_sec': round(len(values) / sum(values), 1),
+            'latency_us': percentiles([v * 1e6 for v in values]),
+        }
+    return {
+        'languages': languages,
+        'stages': stages,
+        'calls': calls,
+        'calls_per_sec': round(calls / wall, 1),
+        'nlp_share': round(nlp_seconds / wall * 100, 2),
+    }
+
+def print_report(results, outcomes, show_errors):
+    print("\n--- Accuracy by language ---")
+    for language, summary in results['languages'].items():
+        print(f"{language}: intent {summary['accuracy']}% of {summary['examples']}, "
+              f"slots {summary['slot_accuracy']}% of {summary['slots']}, "
+              f"stages {summary['by_stage']}")
+        for intent, counts in summary['by_intent'].items():
+            print(f"    {intent:<20} {counts['accuracy']:>6}% ({counts['correct']}/{counts['examples']})")
+        for slot, counts in summary['by_slot'].items():
+            print(f"    slot {slot:<15} {counts['accuracy']:>6}% ({counts['correct']}/{counts['expected']})")
+
+    print("\n--- Speed by matching stage ---")
+    print(f"{results['calls']} calls, {results['calls_per_sec']} calls/sec, "
+          f"{results['nlp_share']}% of the time in the spaCy parse")
+    for stage, summary in results['stages'].items():
+        latency = summary['latency_us']
+        print(f"{stage:<9} {summary['share']:>6}% of calls  {summary['calls_per_sec']:>9} calls/sec  "
+              f"p50 {latency['p50']} us  p95 {latency['p95']} us  p99 {latency['p99']} us")
+    if 'keyword' not in results['stages']:
+        print("(no keyword matches; the keyword fallback needs the spaCy models)")
+
+    if show_errors:
+        print("\n--- Errors ---")
+        for language in results['languages']:
+            errors = [o for o in outcomes if o['example']['language'] == language
+                      and (not o['correct'] or not all(o['slots'].values()))]
+            for outcome in errors[:show_errors]:
+                example = outcome['example']
+                print(f"{language} \"{example['text']}\": expected {example['intent']} "
+                      f"{json.dumps(example['parameters'], ensure_ascii=False)}, got {outcome['predicted']} "
+                      f"{json.dumps(outcome['parameters'], ensure_ascii=False)} via {outcome['matched_by']}")
+            if len(errors) > show_errors:
+                print(f"{language}: {len(errors) - show_errors} more")
+
+def compare(results, baseline, max_accuracy_drop, max_slowdown):
+    """Print changes against a baseline; returns True if accuracy or speed regressed too much."""
+    print("\n--- Comparison with baseline ---")
+    regressed = False
+    before = baseline.get('results', {})
+    for language, summary in results['languages'].items():
+        old = before.get('languages', {}).get(language)
+        if not old:
+            print(f"{language}: not in baseline")
+            continue
+        for key in ('accuracy', 'slot_accuracy'):
+            if old.get(key) is None or summary[key] is None:
+                continue
+            change = summary[key] - old[key]
+            flag = ''
+            if change < -max_accuracy_drop:
+                flag = '  REGRESSION'
+                regressed = True
+            print(f"{language:<6} {key:<14} {old[key]:>7}% -> {summary[key]:>7}% ({change:+.2f} pts){flag}")
+    if before.get('calls_per_sec'):
+        change = (results['calls_per_sec'] - before['calls_per_sec']) / before['calls_per_sec'] * 100
+        flag = ''
+        if change < -max_slowdown:
+            flag = '  REGRESSION'
+            regressed = True
+        print(f"calls/sec {before['calls_per_sec']} -> {results['calls_per_sec']} ({change:+.1f}%){flag}")
+    return regressed
+
+def main():
+    """Main function to run the intent recognition benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmark extract_intent accuracy and speed')
+    parser.add_argument('--languages', default='en-US,hi-IN,ta-IN', help='Comma-separated languages')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed passes over the corpus')
+    parser.add_argument('--show-errors', type=int, default=10, help='Misclassified examples to print per language')
+    parser.add_argument('--verbose', action='store_true', help='Keep the intent recognizer\'s log output')
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with a baseline JSON file')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.0,
+                        help='Fail if intent or slot accuracy drops by more than this many points')
+    parser.add_argument('--max-slowdown', type=float, default=20.0,
+                        help='Fail if calls/sec drops by more than this percentage')
+    args = parser.parse_args()
+
+    languages = [l.strip() for l in args.languages.split(',') if l.strip() in TEMPLATES]
+    if not languages:
+        print(f"Error: no supported languages (choose from {', '.join(TEMPLATES)})")
+        return 1
+
+    from models.intent_recognition import extract_intent
+    if not args.verbose:
+        logging.getLogger('models.intent_recognition').setLevel(logging.CRITICAL)
+
+    corpus = build_corpus(languages)
+    print(f"Corpus: {len(corpus)} examples in {', '.join(languages)}")
+
+    # The correctness pass doubles as warmup (model loads, regex cache)
+    outcomes = evaluate(extract_intent, corpus)
+    latencies, nlp_seconds, calls, wall = measure(extract_intent, corpus, max(args.repeat, 1))
+    results = summarize(outcomes, latencies, nlp_seconds, calls, wall)
+    print_report(results, outcomes, args.show_errors)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'languages': languages,
+            'examples': len(corpus),
+            'repeat': args.repeat,
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nSaved results to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_accuracy_drop, args.max_slowdown):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+"""
+Benchmark for the voice pipeline (/api/process-voice)
+
+This script generates deterministic synthetic speech-like audio in several
+containers (WAV, raw PCM, WebM/Opus, MP3), sends it through /api/process-voice at a
+configurable concurrency and reports throughput plus p50/p95/p99 latency,
+end to end and for every pipeline stage (from the timings=1 breakdown).
+
+It runs fully offline:
+    - Google speech recognition is stubbed with a fixed set of phrases
+      (add simulated network latency with --google-latency)
+    - models are never downloaded; local Wav2Vec2 languages (hi-IN, ta-IN)
+      only work if their models are already cached
+    - users, banking data, voiceprints and uploads live in a temporary
+      directory, so the real data/ directory is never touched
+
+Two modes drive the same app: the Flask test client ("client") and a real
+threaded HTTP server on localhost ("server").
+
+Usage:
+    python benchmark_voice.py [--requests 50] [--concurrency 4] [--formats wav,pcm,webm,mp3]
+                              [--mode client,server] [--save-baseline bench.json]
+                              [--compare bench.json --max-regression 20]
+
+Prerequisites:
+    - All dependencies installed (pip install -r requirements.txt)
+    - ffmpeg on the PATH for the webm and mp3 fixtures (skipped otherwise)
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+# Must be set before transformers is imported
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+# Run without the spaCy models too (the keyword fallback is then skipped)
+os.environ.setdefault('REQUIRED_MODELS', 'none')
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FORMATS = {
+    # name: (file extension, MIME type, pydub export arguments)
+    'wav': ('wav', 'audio/wav', None),
+    # The web client's raw PCM fast path (no decoding on the server)
+    'pcm': ('pcm', 'application/octet-stream', None),
+    'webm': ('webm', 'audio/webm', {'format': 'webm', 'codec': 'libopus'}),
+    'mp3': ('mp3', 'audio/mpeg', {'format': 'mp3'}),
+}
+# What the stubbed Google recognizer "hears", in turn
+BENCH_PHRASES = [
+    "What is my account balance?",
+    "Show my recent transactions",
+    "How much did I spend last month?",
+]
+TRANSFER_PHRASE = "Transfer 10 dollars to Jane"
+PERCENTILES = (50, 95, 99)
+# Form fields that mark an upload as raw PCM
+PCM_FIELDS = {'audio_format': 'pcm_s16le', 'sample_rate': str(SAMPLE_RATE)}
+
+def synth_utterance(seed, seconds=2.5):
+    """Deterministic speech-like signal: a gliding harmonic voice with syllable envelope and noise."""
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.5 * t + rng.uniform(0, 2 * np.pi))
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voiced = sum((0.6 / k) * np.sin(k * phase) for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, 2 * np.pi)), 0, None) ** 0.5
+    signal = voiced * syllables + 0.02 * rng.randn(len(t))
+    return (signal / np.max(np.abs(signal)) * 0.8 * 32767).astype(np.int16)
+
+def encode(pcm, fmt):
+    """Encode 16 kHz mono int16 PCM into a container. Returns bytes, or None if unavailable."""
+    if fmt == 'pcm':
+        return pcm.astype('<i2').tobytes()
+    if fmt == 'wav':
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(SAMPLE_RATE)
+            wav.writeframes(pcm.tobytes())
+        return buffer.getvalue()
+    try:
+        from pydub import AudioSegment
+        segment = AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=SAMPLE_RATE, channels=1)
+        buffer = io.BytesIO()
+        segment.export(buffer, **FORMATS[fmt][2])
+        return buffer.getvalue()
+    except Exception as e:
+        print(f"Skipping {fmt} fixtures: {str(e)}")
+        return None
+
+def make_fixtures(formats, count):
+    """{format: [audio bytes, ...]} with `count` distinct utterances per format."""
+    utterances = [synth_utterance(seed) for seed in range(count)]
+    fixtures = {}
+    for fmt in formats:
+        encoded = []
+        for pcm in utterances:
+            data = encode(pcm, fmt)
+            if data is None:
+                break
+            encoded.append(data)
+        else:
+            fixtures[fmt] = encoded
+    return fixtures
+
+def install_offline_stubs(phrases, google_latency):
+    """Replace network-bound calls with local stand-ins."""
+    import speech_recognition as sr
+
+    cycle = itertools.cycle(phrases)
+    cycle_lock = threading.Lock()
+
+    def recognize_google(self, audio_data, language='en-US', **kwargs):
+        time.sleep(google_latency)
+        with cycle_lock:
+            return next(cycle)
+
+    sr.Recognizer.recognize_google = recognize_google
+
+def isolate_data(data_dir):
+    """Point the stores, voiceprints and uploads at a scratch directory."""
+    import models.voice_biometrics as voice_biometrics
+    import services.banking_service as banking_service
+    import services.user_service as user_service
+
+    os.makedirs(os.path.join(data_dir, 'voice_prints'), exist_ok=True)
+    voice_biometrics.VOICE_PRINTS_DIR = os.path.join(data_dir, 'voice_prints')
+    banking_service._account_store = banking_service.AccountStore(
+        db_path=os.path.join(data_dir, 'mock_db.json'),
+        journal_path=os.path.join(data_dir, 'mock_db.journal'),
+        lock_path=os.path.join(data_dir, 'mock_db.lock'),
+        fsync=False)
+    user_service._user_repository = user_service.UserRepository(
+        os.path.join(data_dir, 'users.json'), os.path.join(data_dir, 'users.json.lock'))
+
+class ClientDriver:
+    """Flask test client; one client per thread."""
+
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, fields, audio, filename, mime):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        data = dict(fields, audio=(io.BytesIO(audio), filename, mime))
+        response = client.post(path, data=data, content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True) or {}
+
+    def close(self):
+        pass
+
+class ServerDriver:
+    """Threaded werkzeug server on a free localhost port, driven over HTTP."""
+
+    name = 'server'
+
+    def __init__(self, app):
+        import requests
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, path, fields, audio, filename, mime):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(self.base_url + path, data=fields,
+                                files={'audio': (filename, audio, mime)}, timeout=120)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def close(self):
+        self.server.shutdown()
+
+def percentiles(values):
+    if not values:
+        return {f'p{p}': None for p in PERCENTILES}
+    return {f'p{p}': round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+
+def run_scenario(driver, fixtures, fmt, args):
+    """Send args.requests requests with args.concurrency in flight; returns the scenario summary."""
+    ext, mime, _ = FORMATS[fmt]
+    audio = fixtures[fmt]
+    fields = {'user_id': args.user_id, 'language': args.language, 'timings': '1'}
+    if fmt == 'pcm':
+        fields.update(PCM_FIELDS)
+
+    def one(i):
+        start = time.perf_counter()
+        status, body = driver.post('/api/process-voice', fields, audio[i % len(audio)], f'bench.{ext}', mime)
+        return status, (time.perf_counter() - start) * 1000, body.get('timings', {})
+
+    for i in range(args.warmup):
+        one(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - started
+
+    status_counts = {}
+    stages = {}
+    for status, _, timings in results:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+        for stage, ms in timings.items():
+            stages.setdefault(stage, []).append(ms)
+    ok = [ms for status, ms, _ in results if status == 200]
+    return {
+        'requests': len(results),
+        'status_counts': status_counts,
+        'throughput_rps': round(len(ok) / wall, 2) if wall else None,
+        'latency_ms': percentiles(ok),
+        'stages': {stage: percentiles(values) for stage, values in sorted(stages.items())},
+    }
+
+def print_scenario(name, summary):
+    latency = summary['latency_ms']
+    print(f"\n{name}: {summary['requests']} requests, statuses {summary['status_counts']}, "
+          f"{summary['throughput_rps']} req/s")
+    print(f"  {'end to end':<28} p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms")
+    for stage, values in summary['stages'].items():
+        print(f"  {stage:<28} p50 {values['p50']} ms  p95 {values['p95']} ms  p99 {values['p99']} ms")
+
+def compare(results, baseline, max_regression):
+    """Print p95 changes against a baseline; returns True if any end-to-end p95 regressed too much."""
+    print("\n--- Comparison with baseline (p95) ---")
+    regressed = False
+    for name, summary in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            print(f"{name}: not in baseline")
+            continue
+        rows = [('end to end', before['latency_ms'], summary['latency_ms'])]
+        rows += [(stage, before['stages'].get(stage), values) for stage, values in summary['stages'].items()]
+        for label, old, new in rows:
+            if not old or not old.get('p95') or new.get('p95') is None:
+                continue
+            change = (new['p95'] - old['p95']) / old['p95'] * 100
+            flag = ''
+            if label == 'end to end' and change > max_regression:
+                flag = '  REGRESSION'
+                regressed = True
+            print(f"{name:<14} {label:<28} {old['p95']:>9} -> {new['p95']:>9} ms ({change:+.1f}%){flag}")
+    return regressed
+
+def main():
+    """Main function to run the voice pipeline benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmark /api/process-voice offline')
+    parser.add_argument('--requests', type=int, default=50, help='Measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Requests in flight')
+    parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per scenario')
+    parser.add_argument('--formats', default='wav,pcm,webm,mp3', help='Comma-separated containers')
+    parser.add_argument('--mode', default='client,server', help='client, server or both (comma-separated)')
+    parser.add_argument('--language', default='en-US', help='Recognition language')
+    parser.add_argument('--user-id', default='1', help='Benchmark user (from the scratch users database)')
+    parser.add_argument('--fixtures', type=int, default=5, help='Distinct utterances per format')
+    parser.add_argument('--google-latency', type=float, default=0.0,
+                        help='Simulated Google recognition latency in milliseconds')
+    parser.add_argument('--include-transfers', action='store_true',
+                        help='Also "hear" a transfer phrase (writes to the scratch banking data)')
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with a baseline JSON file')
+    parser.add_argument('--max-regression', type=float, default=20.0,
+                        help='Fail if end-to-end p95 grows by more than this percentage')
+    args = parser.parse_args()
+
+    phrases = BENCH_PHRASES + ([TRANSFER_PHRASE] if args.include_transfers else [])
+    install_offline_stubs(phrases, args.google_latency / 1000)
+
+    with tempfile.TemporaryDirectory(prefix='voicebench_') as data_dir:
+        isolate_data(data_dir)
+        from app import app
+        app.config['UPLOAD_FOLDER'] = os.path.join(data_dir, 'uploads')
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+        print("Generating fixtures...")
+        fixtures = make_fixtures([f.strip() for f in args.formats.split(',') if f.strip() in FORMATS],
+                                 args.fixtures)
+        if not fixtures:
+            print("Error: no fixtures could be generated")
+            return 1
+
+        drivers = {'client': ClientDriver, 'server': ServerDriver}
+        results = {}
+        for mode in [m.strip() for m in args.mode.split(',') if m.strip() in drivers]:
+            driver = drivers[mode](app)
+            try:
+                # Enroll the benchmark voice once so requests measure authentication, not enrollment
+                fmt = next(iter(fixtures))
+                status, body = driver.post('/api/enroll-voice', {'user_id': args.user_id},
+                                           fixtures[fmt][0], f'enroll.{FORMATS[fmt][0]}', FORMATS[fmt][1])
+                if status != 200:
+                    print(f"Warning: voice enrollment returned {status}: {body}")
+                for fmt in fixtures:
+                    name = f'{mode}/{fmt}'
+                    results[name] = run_scenario(driver, fixtures, fmt, args)
+                    print_scenario(name, results[name])
+            finally:
+                driver.close()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'language': args.language,
+            'google_latency_ms': args.google_latency,
+            'python': sys.version.split()[0],
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
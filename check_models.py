@@ -0,0 +1,106 @@
+"""
+This script checks the models behind the voice pipeline stages, downloads
+the missing ones on request and measures how long importing the web app takes.
+
+The web app never downloads models while serving requests, and it refuses to
+start when a model of a stage in REQUIRED_MODELS is missing. Run this once
+after installing the dependencies, and in CI to keep imports fast.
+
+Usage:
+    python check_models.py [--stages intent,asr,biometrics] [--download]
+                           [--import-budget 1.0]
+
+Prerequisites:
+    - All dependencies installed (pip install -r requirements.txt)
+    - Network access for --download
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from services.model_store import export_model
+from services.startup import ASR_LANGUAGES, IMPORT_BUDGET, check_intent_patterns, model_status
+
+# Run in a fresh interpreter so nothing is imported already
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+from services.startup import heavy_modules_loaded
+print(json.dumps({'seconds': seconds, 'heavy': heavy_modules_loaded()}))
+"""
+
+def download(item):
+    """Download one missing model."""
+    if item['stage'] == 'intent':
+        import spacy.cli
+        spacy.cli.download(item['model'])
+    elif item['stage'] == 'asr':
+        # Downloads into the Hugging Face cache and converts into the model store
+        export_model(item['model'], overwrite=True)
+    else:
+        raise RuntimeError(f"{item['model']} is a Python package: {item['install']}")
+
+def measure_import():
+    """Import time of app.py in a fresh interpreter, with the startup checks off."""
+    env = dict(os.environ, REQUIRED_MODELS='none', PRELOAD_MODELS='0')
+    result = subprocess.run([sys.executable, '-c', IMPORT_PROBE], capture_output=True, text=True,
+                            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    """Main function to check, download and time the models."""
+    parser = argparse.ArgumentParser(description='Check the models of the voice pipeline')
+    parser.add_argument('--stages', default='intent,asr,biometrics',
+                        help='Comma-separated stages to check (intent, asr, biometrics)')
+    parser.add_argument('--download', action='store_true', help='Download missing models')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                        help='Fail if importing app.py takes longer than this many seconds')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    ok = True
+
+    print(f"--- Models (speech languages: {', '.join(ASR_LANGUAGES)}) ---")
+    for item in model_status(stages):
+        state = 'installed' if item['installed'] else 'MISSING'
+        if not item['installed'] and args.download:
+            try:
+                download(item)
+                state = 'downloaded'
+            except Exception as e:
+                state = f'download failed: {e}'
+        print(f"{item['stage']:<11} {item['model']:<55} {state}")
+        if state not in ('installed', 'downloaded'):
+            ok = False
+            print(f"{'':<11} install with: {item['install']}")
+
+    if 'intent' in stages:
+        problems = check_intent_patterns()
+        for problem in problems:
+            print(f"intent      {problem}")
+        ok = ok and not problems
+
+    print("\n--- Import time ---")
+    try:
+        probe = measure_import()
+    except RuntimeError as e:
+        print(f"Error: importing app.py failed: {e}")
+        return 1
+    print(f"import app: {probe['seconds']:.3f}s (budget {args.import_budget:.2f}s)")
+    if probe['seconds'] > args.import_budget:
+        print("Over the import budget")
+        ok = False
+    if probe['heavy']:
+        print(f"Heavy modules imported eagerly: {', '.join(probe['heavy'])}")
+        ok = False
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+This script converts the Wav2Vec2 speech models into the local model store
+(MODEL_STORE_DIR, default data/models), from which the app memory-maps them
+at startup without network access or a Hugging Face cache.
+
+Each model becomes a directory with a single model.safetensors file, its
+config and processor files, and a manifest.json with the size and SHA-256
+of every file. Export once on a machine with network access, then copy the
+store to the nodes that serve requests.
+
+Usage:
+    python export_models.py [--models hi-IN,ta-IN | --all] [--store DIR] [--force]
+    python export_models.py --verify [--store DIR]
+
+Prerequisites:
+    - All dependencies installed (pip install -r requirements.txt)
+    - Network access, unless the models are already in the Hugging Face cache
+"""
+
+import argparse
+import sys
+from models.speech_recognition import LANGUAGE_MODELS
+from services.model_store import MODEL_STORE_DIR, artifact_dir, export_model, read_manifest, verify
+from services.startup import ASR_LANGUAGES
+
+def selected_models(args):
+    """Model names for --all, --models (languages or model names) or ASR_LANGUAGES."""
+    if args.all:
+        keys = list(LANGUAGE_MODELS)
+    elif args.models:
+        keys = [key.strip() for key in args.models.split(',') if key.strip()]
+    else:
+        keys = ASR_LANGUAGES
+    names = []
+    for key in keys:
+        name = LANGUAGE_MODELS.get(key, key)
+        if name not in names:
+            names.append(name)
+    return names
+
+def main():
+    """Main function to export or verify the speech models."""
+    parser = argparse.ArgumentParser(description='Export speech models into the local model store')
+    parser.add_argument('--models', help='Comma-separated languages or model names (default: ASR_LANGUAGES)')
+    parser.add_argument('--all', action='store_true', help='Export every model in LANGUAGE_MODELS')
+    parser.add_argument('--store', default=MODEL_STORE_DIR, help='Model store directory')
+    parser.add_argument('--force', action='store_true', help='Replace models that are already exported')
+    parser.add_argument('--verify', action='store_true', help='Check the exported files against their checksums')
+    args = parser.parse_args()
+
+    ok = True
+    for name in selected_models(args):
+        if args.verify:
+            problems = verify(name, checksums=True, store_dir=args.store)
+            print(f"{name:<55} {'ok' if not problems else '; '.join(problems)}")
+            ok = ok and not problems
+            continue
+        if read_manifest(name, args.store) is not None and not args.force:
+            print(f"{name:<55} already exported (--force to replace)")
+            continue
+        try:
+            manifest = export_model(name, store_dir=args.store, overwrite=True)
+        except Exception as e:
+            print(f"{name:<55} failed: {e}")
+            ok = False
+            continue
+        size = sum(item['size'] for item in manifest['files'].values())
+        print(f"{name:<55} exported to {artifact_dir(name, args.store)} ({size / 1e6:.1f} MB)")
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+This script generates a large synthetic bank (users, accounts and transactions)
+for load and capacity testing, and writes it in the storage format the
+services read:
+    - json: data/mock_db.json (an adopted snapshot with an empty journal)
+      and data/users.json
+    - sqlite: data/bank.db (use with BANKING_STORAGE=sqlite)
+
+Users are generated in chunks with vectorized NumPy sampling and streamed to
+the output, so memory stays bounded by the chunk size:
+    - 1 to 3 accounts per user (every user has savings), log-normal balances
+    - transactions per user from a negative binomial (a few very active users),
+      types with realistic weights, log-normal amounts per type, dates spread
+      over the last --days days and stored oldest first
+    - transfers name other generated users as counterparties
+    - logins user<id> with one shared password (hashed once)
+
+The same --seed and --chunk-size always produce the same data.
+Stop the web app first: existing data files are replaced (with --force).
+
+Usage:
+    python generate_bank_data.py --users 1000000 [--transactions-per-user 40] [--days 365]
+                                 [--storage json|sqlite] [--data-dir data] [--seed 42] [--force]
+
+Prerequisites:
+    - numpy installed (pip install -r requirements.txt)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+import numpy as np
+from werkzeug.security import generate_password_hash
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+FIRST_NAMES = [
+    'John', 'Jane', 'Jacob', 'Emma', 'Liam', 'Olivia', 'Noah', 'Ava', 'James', 'Sophia',
+    'Michael', 'Mia', 'David', 'Sarah', 'Daniel', 'Grace', 'Aarav', 'Vivaan', 'Aditya', 'Ananya',
+    'Diya', 'Ishaan', 'Priya', 'Rahul', 'Ravi', 'Sita', 'Anil', 'Radha', 'Mohan', 'Sanjay',
+    'Vikas', 'Kavya', 'Arjun', 'Meena', 'Kumar', 'Lakshmi', 'Karthik', 'Divya', 'Suresh', 'Anjali',
+]
+LAST_NAMES = [
+    'Smith', 'Doe', 'Brown', 'Johnson', 'Williams', 'Jones', 'Garcia', 'Miller', 'Davis', 'Wilson',
+    'Taylor', 'Clark', 'Lewis', 'Walker', 'Hall', 'Young', 'Sharma', 'Verma', 'Gupta', 'Singh',
+    'Kumar', 'Patel', 'Reddy', 'Iyer', 'Nair', 'Rao', 'Mehta', 'Joshi', 'Das', 'Pillai',
+]
+LANGUAGES = ['en-US', 'hi-IN', 'ta-IN']
+LANGUAGE_WEIGHTS = [0.6, 0.3, 0.1]
+# (account type, id prefix, share of users who have one)
+ACCOUNT_TYPES = [('savings', 'SAV', 1.0), ('checking', 'CHK', 0.6), ('investment', 'INV', 0.15)]
+# Median balance and log-normal spread
+BALANCE_MEDIAN = 3000.0
+BALANCE_SIGMA = 1.2
+TRANSACTION_TYPES = ['deposit', 'withdrawal', 'transfer_in', 'transfer_out', 'payment']
+TRANSACTION_WEIGHTS = [0.15, 0.2, 0.15, 0.15, 0.35]
+# Median amount and log-normal spread per transaction type
+AMOUNT_MEDIANS = np.array([700.0, 90.0, 150.0, 150.0, 45.0])
+AMOUNT_SIGMAS = np.array([0.8, 0.9, 1.0, 1.0, 1.0])
+TRANSFER_TYPES = (TRANSACTION_TYPES.index('transfer_in'), TRANSACTION_TYPES.index('transfer_out'))
+# Shape of the negative binomial of transactions per user (smaller = more skewed)
+ACTIVITY_SHAPE = 2.0
+DESCRIPTIONS = [t.replace('_', ' ').title() for t in TRANSACTION_TYPES]
+
+def names_for(ids):
+    """Deterministic full names for user ids, so counterparties match the users' own names."""
+    mixed = (ids.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)
+    first = np.array(FIRST_NAMES)[(mixed % np.uint64(len(FIRST_NAMES))).astype(np.int64)]
+    last = np.array(LAST_NAMES)[((mixed // np.uint64(len(FIRST_NAMES))) % np.uint64(len(LAST_NAMES))).astype(np.int64)]
+    return np.char.add(np.char.add(first, ' '), last)
+
+def generate_chunk(rng, first_id, count, total_users, tx_per_user, days, today):
+    """Sample `count` users starting at first_id. Returns (banking users, profiles) as lists of dicts."""
+    ids = np.arange(first_id, first_id + count)
+    names = names_for(ids).tolist()
+    languages = rng.choice(len(LANGUAGES), size=count, p=LANGUAGE_WEIGHTS)
+
+    has_account = rng.random((count, len(ACCOUNT_TYPES))) < np.array([share for _, _, share in ACCOUNT_TYPES])
+    has_account[:, 0] = True
+    balances = rng.lognormal(np.log(BALANCE_MEDIAN), BALANCE_SIGMA, size=(count, len(ACCOUNT_TYPES))).round(2)
+
+    tx_counts = rng.negative_binomial(ACTIVITY_SHAPE, ACTIVITY_SHAPE / (ACTIVITY_SHAPE + tx_per_user), size=count)
+    total = int(tx_counts.sum())
+    owners = np.repeat(np.arange(count), tx_counts)
+    types = rng.choice(len(TRANSACTION_TYPES), size=total, p=TRANSACTION_WEIGHTS)
+    amounts = np.maximum(rng.lognormal(np.log(AMOUNT_MEDIANS[types]), AMOUNT_SIGMAS[types]), 1.0).round(2)
+    days_ago = rng.integers(0, days, size=total)
+    # Per user, oldest first (the account store's append order)
+    order = np.lexsort((-days_ago, owners))
+    types, amounts, days_ago = types[order], amounts[order], days_ago[order]
+    dates = (np.datetime64(today, 'D') - days_ago).astype(str).tolist()
+
+    is_transfer = np.isin(types, TRANSFER_TYPES)
+    counterparty_ids = rng.integers(1, total_users + 1, size=int(is_transfer.sum()))
+    counterparties = np.full(total, None, dtype=object)
+    counterparties[is_transfer] = names_for(counterparty_ids).tolist()
+
+    types, amounts, counterparties = types.tolist(), amounts.tolist(), counterparties.tolist()
+    offsets = np.concatenate(([0], np.cumsum(tx_counts))).tolist()
+
+    users, profiles = [], {}
+    for i, user_id in enumerate(ids.tolist()):
+        uid = str(user_id)
+        accounts = {}
+        for j, (acc_type, prefix, _) in enumerate(ACCOUNT_TYPES):
+            if has_account[i, j]:
+                accounts[acc_type] = {'account_id': f'{prefix}{user_id:09d}', 'balance': float(balances[i, j]),
+                                      'currency': 'USD'}
+        transactions = []
+        for seq, k in enumerate(range(offsets[i], offsets[i + 1])):
+            tx = {
+                'transaction_id': f'T{uid}-{seq}',
+                'type': TRANSACTION_TYPES[types[k]],
+                'amount': amounts[k],
+                'date': dates[k],
+                'description': f'{DESCRIPTIONS[types[k]]} of ${amounts[k]}'
+            }
+            if counterparties[k] is not None:
+                tx['counterparty'] = counterparties[k]
+            transactions.append(tx)
+        users.append({'id': uid, 'name': names[i], 'accounts': accounts, 'transactions': transactions})
+        profiles[uid] = {
+            'id': uid,
+            'username': f'user{uid}',
+            'name': names[i],
+            'email': f'user{uid}@example.com',
+            'phone': f'+1{user_id:010d}',
+            'language': LANGUAGES[languages[i]]
+        }
+    return users, profiles
+
+class JSONWriter:
+    """Streams users into mock_db.json and users.json through temporary files."""
+
+    def __init__(self, data_dir, password_hash):
+        from services.banking_service import DB_PATH, JOURNAL_PATH
+        from services.user_service import USERS_DB_PATH
+        self.password_hash = password_hash
+        self.snapshot_id = os.urandom(8).hex()
+        self.paths = {
+            'db': os.path.join(data_dir, os.path.basename(DB_PATH)),
+            'journal': os.path.join(data_dir, os.path.basename(JOURNAL_PATH)),
+            'users': os.path.join(data_dir, os.path.basename(USERS_DB_PATH)),
+        }
+        self._files = {}
+        self._first = True
+
+    def existing(self):
+        return [path for path in self.paths.values() if os.path.exists(path)]
+
+    def open(self, force):
+        for path in self.existing():
+            if not force:
+                raise FileExistsError(path)
+        for key in ('db', 'users'):
+            self._files[key] = open(f"{self.paths[key]}.{os.getpid()}.tmp", 'w', encoding='utf-8')
+        # A snapshot with an id and the matching journal header is used as is,
+        # without the store rewriting it on first start
+        self._files['db'].write(json.dumps({'snapshot_id': self.snapshot_id, 'transaction_order': 'append'})[:-1]
+                                + ', "users": {')
+        self._files['users'].write('{')
+
+    def write(self, users, profiles):
+        separator = '' if self._first else ','
+        self._first = False
+        self._files['db'].write(separator + ','.join(
+            f'{json.dumps(user["id"])}:{json.dumps(user, separators=(",", ":"))}' for user in users))
+        self._files['users'].write(separator + ','.join(
+            f'{json.dumps(uid)}:{json.dumps(dict(profile, password_hash=self.password_hash), separators=(",", ":"))}'
+            for uid, profile in profiles.items()))
+
+    def close(self):
+        self._files['db'].write('}}')
+        self._files['users'].write('}')
+        for key, f in self._files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(f.name, self.paths[key])
+        with open(self.paths['journal'], 'w') as f:
+            f.write(json.dumps({'snapshot_id': self.snapshot_id}) + '\n')
+        return [self.paths['db'], self.paths['users']]
+
+class SQLiteWriter:
+    """Bulk-loads users into a fresh SQLite database."""
+
+    def __init__(self, path, password_hash):
+        self.path = path
+        self.password_hash = password_hash
+        self.store = None
+
+    def existing(self):
+        return [path for path in (self.path, f'{self.path}-wal', f'{self.path}-shm') if os.path.exists(path)]
+
+    def open(self, force):
+        from services.storage import SQLiteStore
+        for path in self.existing():
+            if not force:
+                raise FileExistsError(path)
+            os.remove(path)
+        self.store = SQLiteStore(self.path)
+
+    def write(self, users, profiles):
+        for profile in profiles.values():
+            profile['password_hash'] = self.password_hash
+        self.store.bulk_import(users, profiles)
+
+    def close(self):
+        print("Building spending rollups...")
+        self.store.rebuild_rollups()
+        return [self.path]
+
+def main():
+    """Main function to generate the synthetic bank."""
+    parser = argparse.ArgumentParser(description='Generate a large synthetic bank for load testing')
+    parser.add_argument('--users', type=int, default=100000, help='Number of users')
+    parser.add_argument('--transactions-per-user', type=float, default=40, help='Mean transactions per user')
+    parser.add_argument('--days', type=int, default=365, help='Spread transactions over this many past days')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default=os.environ.get('BANKING_STORAGE', 'json'),
+                        help='Output format (default: BANKING_STORAGE or json)')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Directory for the JSON files')
+    parser.add_argument('--db', help='Path of the SQLite database (default: BANKING_SQLITE_PATH or data/bank.db)')
+    parser.add_argument('--password', default='password123', help='Password of every generated login')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Users generated and written at a time')
+    parser.add_argument('--force', action='store_true', help='Replace existing data files')
+    args = parser.parse_args()
+
+    if args.users < 1 or args.chunk_size < 1 or args.days < 1:
+        print("Error: --users, --chunk-size and --days must be positive")
+        return 1
+
+    # One hash for everyone: hashing millions of passwords would take days
+    password_hash = generate_password_hash(args.password)
+    if args.storage == 'sqlite':
+        from services.storage import SQLITE_PATH
+        writer = SQLiteWriter(args.db or SQLITE_PATH, password_hash)
+    else:
+        os.makedirs(args.data_dir, exist_ok=True)
+        writer = JSONWriter(args.data_dir, password_hash)
+
+    try:
+        writer.open(args.force)
+    except FileExistsError as e:
+        print(f"Error: {e} exists, pass --force to replace it")
+        return 1
+
+    today = date.today().isoformat()
+    start = time.time()
+    transactions = 0
+    try:
+        for chunk, first_id in enumerate(range(1, args.users + 1, args.chunk_size)):
+            count = min(args.chunk_size, args.users + 1 - first_id)
+            rng = np.random.default_rng([args.seed, chunk])
+            users, profiles = generate_chunk(rng, first_id, count, args.users, args.transactions_per_user,
+                                             args.days, today)
+            writer.write(users, profiles)
+            transactions += sum(len(user['transactions']) for user in users)
+            done = first_id + count - 1
+            print(f"{done}/{args.users} users, {transactions} transactions "
+                  f"({done / (time.time() - start):.0f} users/sec)")
+        paths = writer.close()
+    except Exception as e:
+        print(f"Error generating data: {str(e)}")
+        return 1
+
+    print(f"Generated {args.users} users and {transactions} transactions in {time.time() - start:.1f}s")
+    for path in paths:
+        print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    print(f"Log in as user1 .. user{args.users} with password {args.password!r}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+This script imports the JSON databases (data/users.json and the journaled
+data/mock_db.json) into the SQLite database used when BANKING_STORAGE=sqlite.
+It can be re-run; existing users are replaced with the JSON version.
+
+Usage:
+    python migrate_to_sqlite.py [--db PATH]
+"""
+
+import argparse
+import os
+import sys
+from services.banking_service import AccountStore
+from services.storage import SQLiteStore, SQLITE_PATH
+from services.user_service import USERS_DB_PATH, load_users_db
+
+def migrate_banking_data(store):
+    """Copy banking users, accounts and transactions (including journaled transfers)."""
+    account_store = AccountStore()
+    try:
+        users = account_store.iter_users()
+        for _, user in users:
+            # AccountStore keeps transactions oldest first, the order SQLite appends them in
+            store.import_banking_user(user, user['transactions'])
+            print(f"Imported banking data for {user['name']} ({len(user['transactions'])} transactions)")
+    finally:
+        account_store.close()
+    return len(users)
+
+def migrate_users(store):
+    """Copy login profiles."""
+    if not os.path.exists(USERS_DB_PATH):
+        print(f"No users database at {USERS_DB_PATH}, skipping login profiles")
+        return 0
+    users = load_users_db()
+    for user in users.values():
+        store.create_profile(user)
+        print(f"Imported login profile for {user['username']}")
+    return len(users)
+
+def main():
+    """Main function to migrate all JSON data into SQLite."""
+    parser = argparse.ArgumentParser(description='Import the JSON databases into SQLite')
+    parser.add_argument('--db', default=SQLITE_PATH, help='Path of the SQLite database to write')
+    args = parser.parse_args()
+
+    try:
+        print(f"Migrating JSON data into {args.db}...")
+        store = SQLiteStore(args.db)
+
+        # Banking users first so login profiles attach to the same rows
+        banking_count = migrate_banking_data(store)
+        user_count = migrate_users(store)
+
+        print(f"Migration completed: {banking_count} banking users, {user_count} login profiles")
+        print("Set BANKING_STORAGE=sqlite to use the new database.")
+
+    except Exception as e:
+        print(f"Error migrating databases: {str(e)}")
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+CTC prefix beam search for the Wav2Vec2 models, with hotword biasing.
+
+Greedy decoding (argmax per frame) keeps only the single most likely
+character at each step, which garbles payee names and number words that
+the model is unsure about. The beam search keeps the CTC_BEAM_WIDTH best
+prefixes and sums the probability of all alignments of each, so a word
+that wins over the whole utterance survives a few uncertain frames.
+
+Hotwords (intent keywords, number words, the user's payees) bias the
+search: a prefix gets CTC_HOTWORD_WEIGHT (log probability) per character
+while its current word follows a hotword's spelling, and keeps the bonus
+when the word is completed. A word that leaves the hotword's spelling
+loses the bonus again, so partial matches are not rewarded in the output.
+
+The per-frame scoring of every beam against every candidate character is
+done on NumPy arrays. Characters far below the frame's best
+(CTC_PRUNE_LOGP) are not tried, and near-certain blank frames only extend
+with blank. Each utterance gets CTC_DECODE_BUDGET seconds; past that, the
+rest is decoded greedily from the best prefix so far.
+"""
+
+import math
+import os
+import time
+import numpy as np
+from services.metrics import incr
+
+CTC_BEAM_WIDTH = int(os.environ.get('CTC_BEAM_WIDTH', 16))
+CTC_DECODE_BUDGET = float(os.environ.get('CTC_DECODE_BUDGET', 0.25))
+CTC_HOTWORD_WEIGHT = float(os.environ.get('CTC_HOTWORD_WEIGHT', 1.0))
+# Characters whose log probability is this far below the frame's best are not tried
+CTC_PRUNE_LOGP = float(os.environ.get('CTC_PRUNE_LOGP', 8.0))
+# Frames at least this sure of blank only extend the beams with blank
+BLANK_SKIP_LOGP = math.log(0.999)
+
+class HotwordTrie:
+    """Token-id spellings of the hotwords as a trie; node 0 is the root, -1 means off the trie."""
+
+    def __init__(self, spellings):
+        self.children = [{}]
+        self.depth = [0]
+        self.terminal = [False]
+        for tokens in spellings:
+            node = 0
+            for token in tokens:
+                child = self.children[node].get(token)
+                if child is None:
+                    child = self.children[node][token] = len(self.children)
+                    self.children.append({})
+                    self.depth.append(self.depth[node] + 1)
+                    self.terminal.append(False)
+                node = child
+            self.terminal[node] = True
+
+class CTCDecoder:
+    """Prefix beam search over a CTC model's vocabulary."""
+
+    def __init__(self, vocab, blank_id, word_delimiter_id, skip_ids=()):
+        """
+        vocab: token string -> id. The blank token doubles as padding in
+        Wav2Vec2 tokenizers; skip_ids (e.g. <s>, </s>, <unk>) are left out
+        of the text.
+        """
+        self.tokens = [''] * (max(vocab.values()) + 1)
+        for token, token_id in vocab.items():
+            self.tokens[token_id] = token
+        self.vocab = vocab
+        self.blank_id = blank_id
+        self.word_delimiter_id = word_delimiter_id
+        self.skip_ids = set(skip_ids) | {blank_id}
+
+    def spell(self, word):
+        """Token ids of a word, trying each character's case variants; None if it cannot be spelled."""
+        tokens = []
+        for ch in word:
+            token_id = next((self.vocab[c] for c in (ch, ch.lower(), ch.upper()) if c in self.vocab), None)
+            if token_id is None or token_id == self.word_delimiter_id:
+                return None
+            tokens.append(token_id)
+        return tokens or None
+
+    def hotword_trie(self, hotwords):
+        spellings = (self.spell(word) for phrase in hotwords for word in phrase.split())
+        return HotwordTrie(s for s in spellings if s)
+
+    def text(self, token_ids):
+        words = ''.join(' ' if t == self.word_delimiter_id else self.tokens[t]
+                        for t in token_ids if t not in self.skip_ids)
+        return ' '.join(words.split())
+
+    def decode(self, logits, hotwords=(), beam_width=CTC_BEAM_WIDTH, budget=CTC_DECODE_BUDGET,
+               hotword_weight=CTC_HOTWORD_WEIGHT):
+        """Most likely transcript of one utterance's (frames, vocab) logits."""
+        logits = np.asarray(logits, dtype=np.float64)
+        peak = logits.max(axis=1, keepdims=True)
+        log_probs = logits - peak - np.log(np.exp(logits - peak).sum(axis=1, keepdims=True))
+        trie = self.hotword_trie(hotwords)
+        children, depth = trie.children, np.array(trie.depth, dtype=np.float64)
+        terminal = np.array(trie.terminal)
+        blank, delimiter = self.blank_id, self.word_delimiter_id
+        deadline = time.monotonic() + budget
+
+        # Beam state: prefixes (token id tuples), their blank- and
+        # non-blank-ending log probabilities, last token, the characters of
+        # completed hotwords, and the trie node of the current word
+        prefixes = [()]
+        p_b = np.zeros(1)
+        p_nb = np.full(1, -np.inf)
+        last = np.full(1, -1)
+        completed = np.zeros(1)
+        node = np.zeros(1, dtype=int)
+
+        for lp in log_probs:
+            if beam_width > 1 and time.monotonic() > deadline:
+                incr('asr_decode_budget_exceeded_total')
+                beam_width = 1
+            total = np.logaddexp(p_b, p_nb)
+            if lp[blank] > BLANK_SKIP_LOGP:
+                p_b, p_nb = total + lp[blank], np.full(len(prefixes), -np.inf)
+                continue
+
+            chars = np.flatnonzero(lp >= lp.max() - CTC_PRUNE_LOGP)
+            chars = chars[chars != blank]
+            if len(chars) > beam_width:
+                chars = chars[np.argpartition(-lp[chars], beam_width - 1)[:beam_width]]
+            column = {int(c): k for k, c in enumerate(chars)}
+
+            # Staying on the same prefix: a blank, or a repeat of the last token
+            stay_b = total + lp[blank]
+            stay_nb = np.where(last >= 0, p_nb + lp[np.maximum(last, 0)], -np.inf)
+            # Extending by each candidate: a repeated token needs a blank in between
+            ext = np.where(last[:, None] == chars[None, :], p_b[:, None], total[:, None]) + lp[chars][None, :]
+
+            # An extension that equals another beam is the same prefix: merge it
+            index = {prefix: i for i, prefix in enumerate(prefixes)}
+            for j, prefix in enumerate(prefixes):
+                if prefix:
+                    i, k = index.get(prefix[:-1]), column.get(prefix[-1])
+                    if i is not None and k is not None:
+                        stay_nb[j] = np.logaddexp(stay_nb[j], ext[i, k])
+                        ext[i, k] = -np.inf
+
+            # Hotword bonus of each candidate, and the trie node it leads to
+            on_trie = node >= 0
+            current = completed + np.where(on_trie, depth[np.maximum(node, 0)], 0)
+            ext_node = np.full(ext.shape, -1)
+            ext_bias = np.repeat(completed[:, None], len(chars), axis=1)
+            for i in np.flatnonzero(on_trie):
+                for token, child in children[node[i]].items():
+                    k = column.get(token)
+                    if k is not None:
+                        ext_node[i, k] = child
+                        ext_bias[i, k] += depth[child]
+            ext_completed = np.repeat(completed[:, None], len(chars), axis=1)
+            k = column.get(delimiter)
+            if k is not None:
+                word_done = on_trie & terminal[np.maximum(node, 0)]
+                ext_completed[:, k] += np.where(word_done, depth[np.maximum(node, 0)], 0)
+                ext_bias[:, k] = ext_completed[:, k]
+                ext_node[:, k] = 0
+
+            scores = np.concatenate([np.logaddexp(stay_b, stay_nb) + hotword_weight * current,
+                                     (ext + hotword_weight * ext_bias).ravel()])
+            keep = min(beam_width, int(np.isfinite(scores).sum()) or 1)
+            best = np.argpartition(-scores, keep - 1)[:keep]
+
+            new_prefixes = []
+            beams = len(prefixes)
+            stays = best[best < beams]
+            i, k = np.divmod(best[best >= beams] - beams, len(chars))
+            for j in stays:
+                new_prefixes.append(prefixes[j])
+            for a, b in zip(i, k):
+                new_prefixes.append(prefixes[a] + (int(chars[b]),))
+            p_b = np.concatenate([stay_b[stays], np.full(len(i), -np.inf)])
+            p_nb = np.concatenate([stay_nb[stays], ext[i, k]])
+            last = np.concatenate([last[stays], chars[k]])
+            completed = np.concatenate([completed[stays], ext_completed[i, k]])
+            node = np.concatenate([node[stays], ext_node[i, k]])
+            prefixes = new_prefixes
+
+        # Unfinished words only count if they are whole hotwords
+        on_trie = node >= 0
+        final_bias = completed + np.where(on_trie & terminal[np.maximum(node, 0)],
+                                          depth[np.maximum(node, 0)], 0)
+        best = int(np.argmax(np.logaddexp(p_b, p_nb) + hotword_weight * final_bias))
+        return self.text(prefixes[best])
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer):
+        """A decoder for a Wav2Vec2CTCTokenizer's vocabulary."""
+        vocab = tokenizer.get_vocab()
+        skip = {vocab[t] for t in (tokenizer.bos_token, tokenizer.eos_token, tokenizer.unk_token)
+                if t in vocab}
+        return cls(vocab, tokenizer.pad_token_id, vocab.get(tokenizer.word_delimiter_token, -1), skip)
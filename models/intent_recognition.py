@@ -1,19 +1,25 @@
 import re
 import json
-from transformers import pipeline, AutoModelForSequenceClassification, AutoTokenizer
 import os
-import spacy
 import logging
+from services.metrics import span, incr
+from services.startup import ModelUnavailable
+from services.logs import sensitive
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Handlers and formats are set up by services.logs.configure_logging()
 logger = logging.getLogger(__name__)
 
-# Load intent configuration
+# Intent configuration, read on first use
 INTENT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), '../config/intent_patterns.json')
+_intent_patterns = None
 
-with open(INTENT_CONFIG_PATH, 'r', encoding='utf-8') as f:
-    INTENT_PATTERNS = json.load(f)
+def get_intent_patterns():
+    """The intent patterns per language from config/intent_patterns.json."""
+    global _intent_patterns
+    if _intent_patterns is None:
+        with open(INTENT_CONFIG_PATH, 'r', encoding='utf-8') as f:
+            _intent_patterns = json.load(f)
+    return _intent_patterns
 
 # Supported languages with their models
 LANGUAGE_MODELS = {
@@ -33,6 +39,51 @@ HINDI_NUMBER_WORDS = {
     'सौ': 100, 'हजार': 1000, 'लाख': 100000, 'करोड़': 10000000
 }
 
+# Keywords per intent, used when no pattern matches
+INTENT_KEYWORDS = {
+    'en-US': {
+        'check_balance': ['balance', 'money', 'account', 'bank', 'have', 'much'],
+        'transfer_money': ['transfer', 'send', 'pay', 'give'],
+        'transaction_history': ['transaction', 'history', 'recent', 'activity'],
+        'spending_summary': ['spend', 'spent', 'spending', 'expenses']
+    },
+    'hi-IN': {
+        'check_balance': ['बैलेंस', 'पैसा', 'खाता', 'बैंक', 'शेष', 'बताओ', 'दिखाओ', 'कितना'],
+        'transfer_money': ['भेजो', 'ट्रांसफर', 'भुगतान', 'दो', 'भेजें', 'भेजिए', 'रुपया', 'रुपये', 'को'],
+        'transaction_history': ['लेनदेन', 'इतिहास', 'हाल', 'गतिविधि'],
+        'spending_summary': ['खर्च', 'खर्चा']
+    },
+    'ta-IN': {
+        'check_balance': ['இருப்பு', 'பணம்', 'கணக்கு', 'வங்கி', 'காட்டு'],
+        'transfer_money': ['அனுப்பு', 'பரிமாற்றம்', 'செலுத்து'],
+        'transaction_history': ['பரிவர்த்தனை', 'வரலாறு', 'சமீபத்திய'],
+        'spending_summary': ['செலவு']
+    }
+}
+
+# Phrases selecting the period of a spending summary, checked in order
+SPENDING_PERIODS = [
+    ('last_month', ['last month', 'पिछले महीने', 'पिछला महीना', 'கடந்த மாதம்']),
+    ('last_week', ['last week', 'past week', 'this week', 'पिछले हफ्ते', 'पिछले सप्ताह', 'கடந்த வாரம்']),
+    ('today', ['today', 'आज', 'இன்று']),
+    ('this_month', ['this month', 'इस महीने', 'இந்த மாதம்'])
+]
+
+def intent_hotwords(language):
+    """Words speech recognition should favour for a language: intent keywords and number words."""
+    words = set()
+    for keywords in INTENT_KEYWORDS.get(language, INTENT_KEYWORDS['en-US']).values():
+        words.update(keywords)
+    if language == 'hi-IN':
+        words.update(HINDI_NUMBER_WORDS)
+    return words
+
+def metric_language(language):
+    """The language as a metric label; languages without models or patterns count as 'other'."""
+    if language in LANGUAGE_MODELS or language in get_intent_patterns():
+        return language
+    return 'other'
+
 def preprocess_text(text):
     """
     Preprocess text to remove any special formatting 
@@ -45,15 +96,23 @@ def preprocess_text(text):
     return text
 
 def load_nlp_model(language):
-    """Load the appropriate NLP model for the language if not already loaded."""
+    """
+    Load the appropriate NLP model for the language if not already loaded.
+    Raises ModelUnavailable if the spaCy model is not installed; models are
+    never downloaded while serving a request.
+    """
     if language not in nlp_models:
+        incr('cache_events_total', cache='nlp_model', result='miss')
         model_name = LANGUAGE_MODELS.get(language, LANGUAGE_MODELS.get('en-US'))
-        try:
-            nlp_models[language] = spacy.load(model_name)
-        except OSError:
-            # If model isn't available, download it (not recommended in production)
-            spacy.cli.download(model_name)
-            nlp_models[language] = spacy.load(model_name)
+        with span('intent.model_load'):
+            import spacy
+            try:
+                nlp_models[language] = spacy.load(model_name)
+            except OSError as e:
+                raise ModelUnavailable(model_name, f'python -m spacy download {model_name}') from e
+        incr('model_loads_total', model=model_name)
+    else:
+        incr('cache_events_total', cache='nlp_model', result='hit')
     return nlp_models[language]
 
 def extract_intent(text, language='en-US'):
@@ -71,28 +130,31 @@ def extract_intent(text, language='en-US'):
     # Normalize text - lowercase and remove extra spaces
     normalized_text = ' '.join(text.lower().split())
     
-    logger.info(f"Preprocessed text for intent matching: '{normalized_text}'")
+    logger.debug("Preprocessed text for intent matching: %s", sensitive(normalized_text))
     
     # Load the appropriate NLP model
-    try:
-        nlp = load_nlp_model(language)
-        
-        # Process the text
-        doc = nlp(normalized_text)
-    except Exception as e:
-        logger.error(f"Error processing text with NLP model: {str(e)}")
-        doc = None
+    with span('intent.nlp'):
+        try:
+            nlp = load_nlp_model(language)
+            
+            # Process the text
+            doc = nlp(normalized_text)
+        except Exception as e:
+            logger.error("Error processing text with NLP model: %s", e)
+            doc = None
     
-    # Initialize intent data
+    # Initialize intent data; matched_by records the matching stage
+    # ('flexible', 'pattern' or 'keyword'), None if nothing matched
     intent_data = {
         'intent_type': 'unknown',
-        'parameters': {}
+        'parameters': {},
+        'matched_by': None
     }
     
     # Check for patterns in the text based on the language
-    language_patterns = INTENT_PATTERNS.get(language, INTENT_PATTERNS.get('en-US'))
+    intent_patterns = get_intent_patterns()
+    language_patterns = intent_patterns.get(language, intent_patterns.get('en-US'))
     
-    logger.info(f"Matching intent for: '{normalized_text}'")
     
     # Try pattern matching first
     for intent, patterns in language_patterns.items():
@@ -106,8 +168,9 @@ def extract_intent(text, language='en-US'):
                 
                 # If more than 50% of pattern words are in the text, consider it a match
                 if len(common_words) >= len(pattern_words) * 0.5:
-                    logger.info(f"Flexible match for pattern '{pattern}' in language {language}")
+                    logger.debug("Flexible match for pattern %r in language %s", pattern, language)
                     intent_data['intent_type'] = intent
+                    intent_data['matched_by'] = 'flexible'
                     
                     # Extract parameters like amounts, accounts, etc.
                     if intent == 'transfer_money':
@@ -120,12 +183,17 @@ def extract_intent(text, language='en-US'):
                         if language == 'hi-IN':
                             extract_hindi_parameters(normalized_text, intent_data)
                     
+                    elif intent == 'spending_summary':
+                        extract_spending_period(normalized_text, intent_data)
+                    
+                    incr('intent_matches_total', stage='flexible', language=metric_language(language))
                     return intent_data
                     
             # Traditional regex pattern matching as fallback
             if re.search(pattern, normalized_text):
-                logger.info(f"Matched pattern '{pattern}' for intent '{intent}'")
+                logger.debug("Matched pattern %r for intent %s", pattern, intent)
                 intent_data['intent_type'] = intent
+                intent_data['matched_by'] = 'pattern'
                 
                 # Extract parameters like amounts, accounts, etc.
                 if intent == 'check_balance':
@@ -157,31 +225,16 @@ def extract_intent(text, language='en-US'):
                     else:
                         intent_data['parameters']['period'] = 'recent'
                 
+                elif intent == 'spending_summary':
+                    extract_spending_period(normalized_text, intent_data)
+                
+                incr('intent_matches_total', stage='pattern', language=metric_language(language))
                 return intent_data
     
     # If no pattern matched, try keyword matching as fallback
     if intent_data['intent_type'] == 'unknown' and doc is not None:
-        # Define keywords for different languages
-        keywords = {
-            'en-US': {
-                'check_balance': ['balance', 'money', 'account', 'bank', 'have', 'much'],
-                'transfer_money': ['transfer', 'send', 'pay', 'give'],
-                'transaction_history': ['transaction', 'history', 'recent', 'activity']
-            },
-            'hi-IN': {
-                'check_balance': ['बैलेंस', 'पैसा', 'खाता', 'बैंक', 'शेष', 'बताओ', 'दिखाओ', 'कितना'],
-                'transfer_money': ['भेजो', 'ट्रांसफर', 'भुगतान', 'दो', 'भेजें', 'भेजिए', 'रुपया', 'रुपये', 'को'],
-                'transaction_history': ['लेनदेन', 'इतिहास', 'हाल', 'गतिविधि']
-            },
-            'ta-IN': {
-                'check_balance': ['இருப்பு', 'பணம்', 'கணக்கு', 'வங்கி', 'காட்டு'],
-                'transfer_money': ['அனுப்பு', 'பரிமாற்றம்', 'செலுத்து'],
-                'transaction_history': ['பரிவர்த்தனை', 'வரலாறு', 'சமீபத்திய']
-            }
-        }
-        
         # Use the appropriate language keywords or default to English
-        lang_keywords = keywords.get(language, keywords['en-US'])
+        lang_keywords = INTENT_KEYWORDS.get(language, INTENT_KEYWORDS['en-US'])
         text_tokens = [token.text for token in doc]
         
         # Count keyword occurrences
@@ -193,18 +246,21 @@ def extract_intent(text, language='en-US'):
         if any(intent_scores.values()):  # Only if we found any keywords
             max_intent = max(intent_scores, key=intent_scores.get)
             if intent_scores[max_intent] > 0:
-                logger.info(f"Matched intent '{max_intent}' via keyword count: {intent_scores}")
+                logger.debug("Matched intent %s via keyword count: %s", max_intent, intent_scores)
                 intent_data['intent_type'] = max_intent
+                intent_data['matched_by'] = 'keyword'
                 
                 # For transfer_money intent, try to extract parameters
                 if max_intent == 'transfer_money':
                     # Extract Hindi parameters if in Hindi
                     if language == 'hi-IN':
                         extract_hindi_parameters(normalized_text, intent_data)
+                elif max_intent == 'spending_summary':
+                    extract_spending_period(normalized_text, intent_data)
     
-    logger.info(f"Final detected intent: {intent_data['intent_type']}")
-    if 'parameters' in intent_data:
-        logger.info(f"Extracted parameters: {intent_data['parameters']}")
+    incr('intent_matches_total', stage=intent_data['matched_by'] or 'none', language=metric_language(language))
+    logger.info("Detected intent %s (matched by %s), parameters: %s", intent_data['intent_type'],
+                intent_data['matched_by'], sensitive(dict(intent_data['parameters'])))
     return intent_data
 
 def extract_hindi_parameters(text, intent_data):
@@ -213,7 +269,7 @@ def extract_hindi_parameters(text, intent_data):
     ko_matches = re.findall(r'([\u0900-\u097F\w]+)\s+को', text)
     if ko_matches:
         intent_data['parameters']['recipient'] = ko_matches[0]
-        logger.info(f"Found Hindi recipient: {ko_matches[0]}")
+        logger.debug("Found Hindi recipient: %s", sensitive(ko_matches[0]))
     
     # Extract Hindi number words for amount - check for compound numbers
     # First scan the text for all Hindi number words
@@ -228,7 +284,7 @@ def extract_hindi_parameters(text, intent_data):
         if len(found_numbers) == 1:
             # Single number word
             intent_data['parameters']['amount'] = float(found_numbers[0][2])
-            logger.info(f"Found Hindi number word: {found_numbers[0][1]} = {found_numbers[0][2]}")
+            logger.debug("Found Hindi number word: %s = %s", found_numbers[0][1], found_numbers[0][2])
         else:
             # Check for compound numbers like "दो सौ" (two hundred)
             found_numbers.sort(key=lambda x: x[0])  # Sort by position in text
@@ -257,11 +313,37 @@ def extract_hindi_parameters(text, intent_data):
                 
             intent_data['parameters']['amount'] = float(total)
             number_words = ' '.join(word for _, word, _ in found_numbers)
-            logger.info(f"Found compound Hindi number: {number_words} = {total}")
+            logger.debug("Found compound Hindi number: %s = %s", number_words, total)
     
     # If we couldn't extract the amount from number words, try digits
     if 'amount' not in intent_data['parameters']:
         amount_matches = re.findall(r'(\d+(?:\.\d+)?)', text)
         if amount_matches:
             intent_data['parameters']['amount'] = float(amount_matches[0])
-            logger.info(f"Found numeric amount: {amount_matches[0]}")
+            logger.debug("Found numeric amount: %s", amount_matches[0])
+
+def extract_transfer_slots(text, language='en-US'):
+    """
+    Amount and recipient stated in a transfer request or in a short
+    follow-up such as "to Jane", "500" or "जेन को".
+    """
+    normalized_text = ' '.join(preprocess_text(text).lower().split())
+    intent_data = {'parameters': {}}
+    amount_matches = re.findall(r'(\d+(?:\.\d+)?)', normalized_text)
+    if amount_matches:
+        intent_data['parameters']['amount'] = float(amount_matches[0])
+    if language == 'hi-IN':
+        extract_hindi_parameters(normalized_text, intent_data)
+    else:
+        recipient_matches = re.findall(r'\bto\s+(\w+)', normalized_text)
+        if recipient_matches:
+            intent_data['parameters']['recipient'] = recipient_matches[0]
+    return intent_data['parameters']
+
+def extract_spending_period(text, intent_data):
+    """Extract the period of a spending summary (defaults to this month)"""
+    for period, phrases in SPENDING_PERIODS:
+        if any(phrase in text for phrase in phrases):
+            intent_data['parameters']['period'] = period
+            return
+    intent_data['parameters']['period'] = 'this_month'
@@ -1,15 +1,16 @@
-import speech_recognition as sr
-from pydub import AudioSegment
 import os
-import torch
-import librosa
-import numpy as np
-from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 import logging
 import tempfile
+from services.metrics import span, incr
+from services.startup import ModelUnavailable
+from services.model_store import EXPORT_COMMAND, load_model, read_manifest
+from services.pcm_audio import PCMAudio
+from models.ctc_decoder import CTCDecoder
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# speech_recognition, pydub, librosa, torch and transformers are imported by the
+# functions that use them, so importing this module (and the web app) stays fast
+
+# Handlers and formats are set up by services.logs.configure_logging()
 logger = logging.getLogger(__name__)
 
 # Dictionary mapping language codes to pretrained models
@@ -20,14 +21,34 @@ LANGUAGE_MODELS = {
     'default': 'facebook/wav2vec2-large-xlsr-53'  # Multilingual model as fallback
 }
 
+# Returned when Google's API cannot be reached
+SERVICE_UNAVAILABLE = "Could not request results from speech recognition service"
+
 # Cache for loaded models to avoid reloading
 _model_cache = {}
+_decoders = {}
+
+# 'beam': CTC prefix beam search with hotwords (models/ctc_decoder.py); 'greedy': argmax per frame
+ASR_DECODER = os.environ.get('ASR_DECODER', 'beam').lower()
+
+# Intra-op threads for model inference in this process. Several web workers
+# on one machine should split the cores between them (workers x threads <= cores),
+# which is the default when WEB_CONCURRENCY tells us the worker count.
+# Applied when the first model is loaded.
+TORCH_THREADS = int(os.environ.get('TORCH_THREADS', 0)) or max(
+    1, (os.cpu_count() or 1) // max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1))
+
+def uses_local_model(language):
+    """Whether a language is recognized by a local Wav2Vec2 model rather than Google's API."""
+    return not (language == 'en-US' or language not in LANGUAGE_MODELS)
 
 def convert_audio_format(audio_path):
     """
     Convert audio to WAV format if needed.
     Returns the path to a WAV file or raises an exception if conversion fails.
     """
+    import speech_recognition as sr
+    from pydub import AudioSegment
     try:
         # Check if file exists and has content
         if not os.path.isfile(audio_path):
@@ -41,9 +62,10 @@ def convert_audio_format(audio_path):
                 with sr.AudioFile(audio_path) as source:
                     # This will raise an exception if the file is not a valid WAV
                     sr.Recognizer().record(source)
+                incr('audio_conversions_total', method='none')
                 return audio_path
             except Exception as e:
-                logger.warning(f"Existing WAV file is not valid, will try to convert: {str(e)}")
+                logger.warning("Existing WAV file is not valid, will try to convert: %s", e)
                 # Continue to conversion
         
         # Create a unique filename in the same directory for the converted file
@@ -59,19 +81,21 @@ def convert_audio_format(audio_path):
                 try:
                     audio = AudioSegment.from_file(audio_path, format=file_ext)
                     audio.export(wav_path, format='wav')
-                    logger.info(f"Successfully converted audio using pydub with format {file_ext}")
+                    logger.info("Successfully converted audio using pydub with format %s", file_ext)
+                    incr('audio_conversions_total', method='pydub')
                     return wav_path
                 except Exception as e1:
-                    logger.warning(f"Failed to convert with explicit format {file_ext}: {str(e1)}")
+                    logger.warning("Failed to convert with explicit format %s: %s", file_ext, e1)
             
             # Method 2: Let pydub guess the format
             try:
                 audio = AudioSegment.from_file(audio_path)
                 audio.export(wav_path, format='wav')
                 logger.info("Successfully converted audio using pydub auto-detection")
+                incr('audio_conversions_total', method='pydub_autodetect')
                 return wav_path
             except Exception as e2:
-                logger.warning(f"Failed to convert with pydub auto-detection: {str(e2)}")
+                logger.warning("Failed to convert with pydub auto-detection: %s", e2)
             
             # Method 3: Try using ffmpeg directly if available
             try:
@@ -83,21 +107,24 @@ def convert_audio_format(audio_path):
                 )
                 if os.path.exists(wav_path) and os.path.getsize(wav_path) > 0:
                     logger.info("Successfully converted audio using ffmpeg")
+                    incr('audio_conversions_total', method='ffmpeg')
                     return wav_path
                 else:
-                    logger.warning(f"FFMPEG conversion failed: {result.stderr}")
+                    logger.warning("FFMPEG conversion failed: %s", result.stderr)
             except Exception as e3:
-                logger.warning(f"Failed to convert with ffmpeg: {str(e3)}")
+                logger.warning("Failed to convert with ffmpeg: %s", e3)
             
             # Method 4: Try using librosa
             try:
+                import librosa
                 y, sr = librosa.load(audio_path, sr=None)
                 import soundfile as sf
                 sf.write(wav_path, y, sr)
                 logger.info("Successfully converted audio using librosa")
+                incr('audio_conversions_total', method='librosa')
                 return wav_path
             except Exception as e4:
-                logger.warning(f"Failed to convert with librosa: {str(e4)}")
+                logger.warning("Failed to convert with librosa: %s", e4)
                 
             # All methods failed
             raise Exception("All conversion methods failed. Cannot process this audio format.")
@@ -112,70 +139,127 @@ def convert_audio_format(audio_path):
             raise e
             
     except Exception as e:
-        logger.error(f"Error in audio conversion: {str(e)}")
+        logger.error("Error in audio conversion: %s", e)
         raise Exception(f"Audio conversion failed: {str(e)}")
 
 def get_model_and_processor(language):
-    """Get or load the model and processor for the specified language."""
+    """
+    Get or load the model and processor for the specified language.
+    Models exported to the local model store (`python export_models.py`)
+    are memory-mapped from it; others are only read from the Hugging Face
+    cache. A missing model raises ModelUnavailable.
+    """
     model_name = LANGUAGE_MODELS.get(language, LANGUAGE_MODELS['default'])
     
     if model_name == 'default':
         return None, None
         
     if model_name in _model_cache:
+        incr('cache_events_total', cache='asr_model', result='hit')
         return _model_cache[model_name]
     
-    logger.info(f"Loading model {model_name} for language {language}")
-    processor = Wav2Vec2Processor.from_pretrained(model_name)
-    model = Wav2Vec2ForCTC.from_pretrained(model_name)
+    incr('cache_events_total', cache='asr_model', result='miss')
+    logger.info("Loading model %s for language %s", model_name, language)
+    with span('asr.model_load'):
+        import torch
+        torch.set_num_threads(TORCH_THREADS)
+        if read_manifest(model_name) is not None:
+            processor, model = load_model(model_name)
+            source = 'store'
+        else:
+            from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+            try:
+                processor = Wav2Vec2Processor.from_pretrained(model_name, local_files_only=True)
+                model = Wav2Vec2ForCTC.from_pretrained(model_name, local_files_only=True)
+            except OSError as e:
+                raise ModelUnavailable(model_name, EXPORT_COMMAND) from e
+            source = 'hf_cache'
+    incr('model_loads_total', model=model_name, source=source)
     
     # Cache the loaded model
     _model_cache[model_name] = (processor, model)
     return processor, model
 
-def recognize_speech(audio_path, language='en-US'):
+def get_decoder(language, processor):
+    """The beam search decoder for a language's model vocabulary."""
+    model_name = LANGUAGE_MODELS.get(language, LANGUAGE_MODELS['default'])
+    decoder = _decoders.get(model_name)
+    if decoder is None:
+        decoder = _decoders[model_name] = CTCDecoder.from_tokenizer(processor.tokenizer)
+    return decoder
+
+def transcribe_samples(speech_array, language, hotwords=()):
     """
-    Recognize speech from audio file using appropriate model for the language.
+    Run the local Wav2Vec2 model of a language on 16 kHz float samples.
+    Streaming requests call this once per chunk of audio. hotwords bias
+    the beam search towards words the request is likely to contain.
     """
+    processor, model = get_model_and_processor(language)
+    import torch
+    
+    with span('asr.features'):
+        inputs = processor(speech_array, sampling_rate=16000, return_tensors="pt", padding=True)
+    
+    with span('asr.forward'), torch.no_grad():
+        logits = model(inputs.input_values).logits
+    
+    with span('asr.decode'):
+        if ASR_DECODER == 'beam':
+            return get_decoder(language, processor).decode(logits[0].numpy(), hotwords)
+        # Get predicted ids and convert to text
+        predicted_ids = torch.argmax(logits, dim=-1)
+        transcription = processor.batch_decode(predicted_ids)
+    
+    return transcription[0]
+
+def recognize_speech(audio, language='en-US', hotwords=()):
+    """
+    Recognize speech from an audio file (or PCMAudio) using appropriate model for the language.
+    Raw PCM skips the conversion and decoding steps. hotwords only apply
+    to the local models.
+    """
+    is_pcm = isinstance(audio, PCMAudio)
+    wav_path = None
     try:
-        wav_path = convert_audio_format(audio_path)
+        if not is_pcm:
+            with span('asr.convert'):
+                wav_path = convert_audio_format(audio)
         
         # For English and other well-supported languages, use SpeechRecognition
-        if language == 'en-US' or language not in LANGUAGE_MODELS:
+        if not uses_local_model(language):
+            import speech_recognition as sr
             recognizer = sr.Recognizer()
-            with sr.AudioFile(wav_path) as source:
-                audio_data = recognizer.record(source)
-                try:
+            if is_pcm:
+                audio_data = sr.AudioData(audio.pcm, audio.sample_rate, 2)
+            else:
+                with sr.AudioFile(wav_path) as source:
+                    audio_data = recognizer.record(source)
+            try:
+                with span('asr.google'):
                     text = recognizer.recognize_google(audio_data, language=language)
-                    return text
-                except sr.UnknownValueError:
-                    return "Speech recognition could not understand audio"
-                except sr.RequestError:
-                    return "Could not request results from speech recognition service"
+                return text
+            except sr.UnknownValueError:
+                return "Speech recognition could not understand audio"
+            except sr.RequestError:
+                return SERVICE_UNAVAILABLE
         
         # For low-resource languages, use specialized models
         else:
-            processor, model = get_model_and_processor(language)
-            
             # Load and preprocess the audio
-            speech_array, sampling_rate = librosa.load(wav_path, sr=16000)
-            inputs = processor(speech_array, sampling_rate=16000, return_tensors="pt", padding=True)
-            
-            with torch.no_grad():
-                logits = model(inputs.input_values).logits
-            
-            # Get predicted ids and convert to text
-            predicted_ids = torch.argmax(logits, dim=-1)
-            transcription = processor.batch_decode(predicted_ids)
-            
-            return transcription[0]
+            with span('asr.load_audio'):
+                if is_pcm:
+                    speech_array = audio.samples(16000)
+                else:
+                    import librosa
+                    speech_array, sampling_rate = librosa.load(wav_path, sr=16000)
+            return transcribe_samples(speech_array, language, hotwords)
     
     except Exception as e:
-        logger.error(f"Error in speech recognition: {str(e)}")
+        logger.error("Error in speech recognition: %s", e)
         return f"Error processing speech: {str(e)}"
     finally:
         # Clean up temporary converted file if it's different from the original
-        if 'wav_path' in locals() and wav_path != audio_path and os.path.exists(wav_path):
+        if wav_path and wav_path != audio and os.path.exists(wav_path):
             try:
                 os.remove(wav_path)
             except:
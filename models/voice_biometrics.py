@@ -1,21 +1,35 @@
-import librosa
 import numpy as np
-from sklearn.mixture import GaussianMixture
 import os
 import pickle
+import io
 import json
 from services.user_service import get_user_by_id
+from services.metrics import span
+from services import shared_cache
+from services.pcm_audio import PCMAudio
+from services.result_cache import TTLCache
 
 # Path to store voice prints
 VOICE_PRINTS_DIR = os.path.join(os.path.dirname(__file__), '../data/voice_prints')
 os.makedirs(VOICE_PRINTS_DIR, exist_ok=True)
+# Audio is analysed at one rate, so voice prints match whatever the recording's rate
+FEATURE_SAMPLE_RATE = 16000
+# Decoded voiceprints kept per process in front of the shared cache
+VOICEPRINT_CACHE_SIZE = int(os.environ.get('VOICEPRINT_CACHE_SIZE', 64))
 
-def extract_voice_features(audio_path):
+_voiceprints = TTLCache('voiceprint', max_entries=VOICEPRINT_CACHE_SIZE, ttl=3600)
+
+def extract_voice_features(audio):
     """
-    Extract MFCC features from an audio file for voice biometrics.
+    Extract MFCC features from an audio file (or PCMAudio) for voice biometrics.
     """
-    # Load the audio file
-    y, sr = librosa.load(audio_path, sr=None)
+    import librosa
+    
+    # Load the audio file; raw PCM uploads are used as they are
+    if isinstance(audio, PCMAudio):
+        y, sr = audio.samples(FEATURE_SAMPLE_RATE), FEATURE_SAMPLE_RATE
+    else:
+        y, sr = librosa.load(audio, sr=FEATURE_SAMPLE_RATE)
     
     # Extract MFCCs (Mel-Frequency Cepstral Coefficients)
     mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
@@ -29,24 +43,62 @@ def get_voice_print_path(user_id):
     """Get the path to a user's voice print file."""
     return os.path.join(VOICE_PRINTS_DIR, f"user_{user_id}_voiceprint.pkl")
 
-def enroll_user_voice(audio_path, user_id):
+def _encode_voiceprint(gmm):
+    """The fitted GMM's parameter arrays and constructor arguments as .npz bytes."""
+    arrays = {name: np.asarray(value) for name, value in vars(gmm).items()
+              if name.endswith('_') and not name.startswith('_')}
+    buffer = io.BytesIO()
+    np.savez(buffer, __params__=np.array(json.dumps(gmm.get_params())), **arrays)
+    return buffer.getvalue()
+
+def _decode_voiceprint(data):
+    from sklearn.mixture import GaussianMixture
+    with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+        gmm = GaussianMixture(**json.loads(arrays['__params__'].item()))
+        for name in arrays.files:
+            if name != '__params__':
+                value = arrays[name]
+                setattr(gmm, name, value.item() if value.ndim == 0 else value)
+    return gmm
+
+def load_voiceprint(user_id):
+    """
+    A user's fitted GMM. The parameter arrays come from the node's shared
+    cache when another worker already loaded this version of the file, and
+    the decoded model is kept in this process until the file changes.
+    """
+    path = get_voice_print_path(user_id)
+    st = os.stat(path)
+
+    def load():
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    return shared_cache.read_through('voiceprint', user_id, f'{st.st_mtime_ns}:{st.st_size}', load,
+                                     _encode_voiceprint, _decode_voiceprint, local=_voiceprints)
+
+def enroll_user_voice(audio, user_id):
     """
     Enroll a new user by creating a voice print from their audio sample.
     In a real system, multiple samples would be used.
     """
-    features = extract_voice_features(audio_path)
+    with span('biometrics.features'):
+        features = extract_voice_features(audio)
     
     # Train a Gaussian Mixture Model on the user's voice
-    gmm = GaussianMixture(n_components=16, covariance_type='diag', max_iter=200)
-    gmm.fit(features)
+    with span('biometrics.enroll'):
+        from sklearn.mixture import GaussianMixture
+        gmm = GaussianMixture(n_components=16, covariance_type='diag', max_iter=200)
+        gmm.fit(features)
     
     # Save the model
     with open(get_voice_print_path(user_id), 'wb') as f:
         pickle.dump(gmm, f)
+    shared_cache.invalidate('voiceprint', user_id)
     
     return {'success': True, 'message': 'Voice enrolled successfully'}
 
-def authenticate_voice(audio_path, user_id, threshold=None):
+def authenticate_voice(audio, user_id, threshold=None):
     """
     Authenticate a user based on their voice.
     Returns True if authenticated, False otherwise.
@@ -63,13 +115,13 @@ def authenticate_voice(audio_path, user_id, threshold=None):
     if not os.path.exists(voice_print_path):
         # For demo purposes, if no voice print exists, create one
         # In a real system, this would return an error
-        return enroll_user_voice(audio_path, user_id)
+        return enroll_user_voice(audio, user_id)
     
     # Load the user's voice model
     try:
-        with open(voice_print_path, 'rb') as f:
-            gmm = pickle.load(f)
-    except (pickle.PickleError, IOError) as e:
+        with span('biometrics.load_voiceprint'):
+            gmm = load_voiceprint(user_id)
+    except (pickle.PickleError, IOError, ValueError) as e:
         return {
             'authenticated': False,
             'error': f"Error loading voice model: {str(e)}",
@@ -78,7 +130,8 @@ def authenticate_voice(audio_path, user_id, threshold=None):
     
     # Extract features from the provided audio
     try:
-        features = extract_voice_features(audio_path)
+        with span('biometrics.features'):
+            features = extract_voice_features(audio)
     except Exception as e:
         return {
             'authenticated': False,
@@ -87,7 +140,8 @@ def authenticate_voice(audio_path, user_id, threshold=None):
         }
     
     # Calculate log likelihood
-    score = gmm.score(features)
+    with span('biometrics.score'):
+        score = gmm.score(features)
     
     # Use adaptive thresholding - for demo we're setting a very permissive threshold
     if threshold is None:
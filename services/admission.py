@@ -0,0 +1,135 @@
+"""
+Admission control for the model-backed pipeline stages.
+
+Each stage (local speech recognition, voice biometrics) runs at most
+`concurrency` inferences at a time per process, with a bounded number of
+requests waiting behind them. A request is turned away with Overloaded,
+which the web app answers with 503 and Retry-After, when:
+
+- the stage's wait queue is full, or
+- the predicted wait (requests ahead x average inference time) is longer
+  than the stage deadline, or
+- it waited in the queue longer than the deadline.
+
+Background jobs pass block=True: they wait for a slot instead, since the
+job queue already bounds how many of them exist.
+
+Open voice streams (/api/stream-voice) are a stage too: each holds a server
+thread for as long as the client keeps it open, so at most
+STREAM_CONCURRENCY are open and nobody waits for a slot. The suggested
+Retry-After is then the average stream's duration.
+
+Limits are per process. Settings: <STAGE>_CONCURRENCY, <STAGE>_QUEUE and
+<STAGE>_DEADLINE (seconds), e.g. ASR_CONCURRENCY=1.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from services import metrics
+
+# Assumed inference time before a stage has been measured
+DEFAULT_SERVICE_TIME = 1.0
+# Weight of the newest measurement in the moving average of inference time
+SMOOTHING = 0.2
+
+class Overloaded(Exception):
+    """Raised when a stage cannot take more work; retry_after is in whole seconds."""
+
+    def __init__(self, stage, retry_after):
+        super().__init__(f'The {stage} service is busy, please retry in {retry_after} seconds')
+        self.stage = stage
+        self.retry_after = retry_after
+
+class StageLimiter:
+    """Concurrency limit plus a bounded, deadline-aware wait queue for one stage."""
+
+    def __init__(self, name, concurrency, queue_size, deadline):
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._service_time = None
+
+    def predicted_wait(self):
+        """Seconds a request arriving now would wait for a slot."""
+        ahead = self._running + self._waiting - self.concurrency + 1
+        if ahead <= 0:
+            return 0.0
+        return ahead / self.concurrency * (self._service_time or DEFAULT_SERVICE_TIME)
+
+    def stats(self):
+        with self._cond:
+            return {'running': self._running, 'waiting': self._waiting,
+                    'service_time': self._service_time}
+
+    def _overloaded(self, wait):
+        metrics.incr('admission_rejections_total', stage=self.name)
+        return Overloaded(self.name, max(1, math.ceil(wait)))
+
+    def _publish(self):
+        metrics.set_gauge('stage_in_flight', self._running, stage=self.name)
+        metrics.set_gauge('stage_queue_depth', self._waiting, stage=self.name)
+
+    @contextmanager
+    def admit(self, block=False):
+        """Run the block in a stage slot; raises Overloaded unless block=True."""
+        with self._cond:
+            if not block:
+                if self._running >= self.concurrency and self._waiting >= self.queue_size:
+                    raise self._overloaded(self.predicted_wait())
+                wait = self.predicted_wait()
+                if wait > self.deadline:
+                    raise self._overloaded(wait)
+            self._waiting += 1
+            self._publish()
+            queued_at = time.perf_counter()
+            try:
+                admitted = self._cond.wait_for(lambda: self._running < self.concurrency,
+                                               None if block else self.deadline)
+            finally:
+                self._waiting -= 1
+            if admitted:
+                self._running += 1
+            self._publish()
+            if not admitted:
+                raise self._overloaded(self.predicted_wait())
+
+        start = time.perf_counter()
+        metrics.record_stage(f'{self.name}.queue', start - queued_at)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                self._running -= 1
+                self._publish()
+                if self._service_time is None:
+                    self._service_time = elapsed
+                else:
+                    self._service_time += SMOOTHING * (elapsed - self._service_time)
+                self._cond.notify()
+
+def _stage_limiter(name, concurrency, queue_size, deadline):
+    prefix = name.upper()
+    return StageLimiter(name,
+                        int(os.environ.get(f'{prefix}_CONCURRENCY', concurrency)),
+                        int(os.environ.get(f'{prefix}_QUEUE', queue_size)),
+                        float(os.environ.get(f'{prefix}_DEADLINE', deadline)))
+
+STAGES = {
+    # Local Wav2Vec2 inference; Google recognition is network-bound and not limited
+    'asr': _stage_limiter('asr', concurrency=1, queue_size=4, deadline=10),
+    'biometrics': _stage_limiter('biometrics', concurrency=2, queue_size=8, deadline=5),
+    # Below the web worker's threads (gunicorn --threads 8), so other requests still get one
+    'stream': _stage_limiter('stream', concurrency=4, queue_size=0, deadline=0),
+}
+
+def admit(stage, block=False):
+    """Context manager that runs a block under the named stage's limiter."""
+    return STAGES[stage].admit(block)
@@ -1,16 +1,46 @@
+import csv
+import hashlib
+import io
 import json
 import os
 import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from services.metrics import span
+from services.recipient_directory import get_recipient_directory
+from services.spending_rollups import SpendingRollups, period_range
+
+try:
+    import fcntl
+except ImportError:  # Windows: the store then only locks within one process
+    fcntl = None
 
 # Path to mock database
 DB_PATH = os.path.join(os.path.dirname(__file__), '../data/mock_db.json')
+# Append-only journal of changes since the last snapshot of DB_PATH
+JOURNAL_PATH = os.path.join(os.path.dirname(__file__), '../data/mock_db.journal')
+LOCK_PATH = os.path.join(os.path.dirname(__file__), '../data/mock_db.lock')
+
+# Columns of exported statements
+STATEMENT_FIELDS = ['transaction_id', 'date', 'type', 'amount', 'counterparty', 'description']
 
-def load_mock_db():
+# Number of per-account lock stripes (accounts hashing to the same stripe share a lock)
+LOCK_STRIPES = int(os.environ.get('BANKING_LOCK_STRIPES', '1024'))
+# Write a compacted snapshot after this many journal entries
+SNAPSHOT_EVERY = int(os.environ.get('BANKING_SNAPSHOT_EVERY', '1000'))
+# Set BANKING_JOURNAL_FSYNC=0 to skip fsync (e.g. local demos on slow disks)
+JOURNAL_FSYNC = os.environ.get('BANKING_JOURNAL_FSYNC', '1') != '0'
+# Seconds a transfer's idempotency key is remembered
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 86400))
+
+def load_mock_db(path=DB_PATH):
     """Load mock database or create if it doesn't exist."""
-    if not os.path.exists(DB_PATH):
+    if not os.path.exists(path):
         # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         
         # Create a mock database with sample data
         mock_db = {
@@ -47,16 +77,18 @@ def load_mock_db():
             }
         }
         
-        with open(DB_PATH, 'w') as f:
+        with open(path, 'w') as f:
             json.dump(mock_db, f, indent=2)
     
-    with open(DB_PATH, 'r') as f:
+    with open(path, 'r') as f:
         return json.load(f)
 
-def save_mock_db(db):
-    """Save changes to mock database."""
-    with open(DB_PATH, 'w') as f:
-        json.dump(db, f, indent=2)
+def save_mock_db(db, path=DB_PATH):
+    """
+    Save a whole database over the snapshot.
+    The account store treats this as a new base and discards its journal.
+    """
+    _atomic_write(path, json.dumps(db, indent=2).encode('utf-8'))
 
 def generate_mock_transactions(user_id, count=10):
     """Generate mock transaction history for demo purposes."""
@@ -83,17 +115,801 @@ def generate_mock_transactions(user_id, count=10):
     
     return sorted(transactions, key=lambda x: x['date'], reverse=True)
 
-def process_banking_request(intent_data, user):
+class TransferError(Exception):
+    """Raised when a transfer cannot be applied to the account store."""
+
+class AccountLocks:
+    """
+    Per-account locks shared by the threads of this process and by every
+    process that opens the same lock file.
+
+    Account ids hash onto LOCK_STRIPES stripes. A stripe is a threading lock
+    plus an fcntl lock on byte (stripe + 1) of the lock file, so transfers on
+    unrelated accounts never wait for each other, even across gunicorn
+    workers. Byte 0 is a shared/exclusive lock on the whole store: transfers
+    hold it shared, compaction and snapshot reloads hold it exclusively.
+    """
+
+    def __init__(self, path, stripes=None):
+        self.stripes = stripes or LOCK_STRIPES
+        self._file = open(path, 'a+b')
+        self._stripe_locks = [threading.Lock() for _ in range(self.stripes)]
+        # fcntl locks belong to the process, so threads share one store-lock
+        # acquisition and count themselves in `_readers`
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def stripe(self, account_id):
+        """Stable across processes, unlike hash()."""
+        return zlib.crc32(str(account_id).encode('utf-8')) % self.stripes
+
+    @contextmanager
+    def accounts(self, *account_ids):
+        """Lock the given accounts, always in stripe order so two transfers cannot deadlock."""
+        stripes = sorted({self.stripe(account_id) for account_id in account_ids})
+        self._acquire_shared()
+        acquired = []
+        try:
+            for stripe in stripes:
+                self._stripe_locks[stripe].acquire()
+                acquired.append(stripe)
+                self._lockf(fcntl.LOCK_EX if fcntl else None, stripe + 1)
+            yield
+        finally:
+            for stripe in reversed(acquired):
+                self._lockf(fcntl.LOCK_UN if fcntl else None, stripe + 1)
+                self._stripe_locks[stripe].release()
+            self._release_shared()
+
+    @contextmanager
+    def exclusive(self):
+        """Lock the whole store; waits until no transfer holds any account."""
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+            self._lockf(fcntl.LOCK_EX if fcntl else None, 0)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._lockf(fcntl.LOCK_UN if fcntl else None, 0)
+                self._writer = False
+                self._cond.notify_all()
+
+    def close(self):
+        self._file.close()
+
+    def _acquire_shared(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            if self._readers == 0:
+                self._lockf(fcntl.LOCK_SH if fcntl else None, 0)
+            self._readers += 1
+
+    def _release_shared(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._lockf(fcntl.LOCK_UN if fcntl else None, 0)
+                self._cond.notify_all()
+
+    def _lockf(self, operation, offset):
+        if fcntl is not None:
+            fcntl.lockf(self._file.fileno(), operation, 1, offset)
+
+class AccountStore:
+    """
+    In-memory account store backed by the mock_db.json snapshot and an
+    append-only journal of mutations.
+
+    Reads are served from memory. Each transfer is appended to the journal as
+    one JSON line and fsynced before it is acknowledged; concurrent writers
+    share a single fsync (group commit). Every SNAPSHOT_EVERY entries the
+    state is written out as a new snapshot and the journal starts over.
+
+    Several gunicorn workers can share the same files. A transfer locks only
+    the two accounts involved (see AccountLocks), and every call first
+    replays the journal entries other processes wrote since the previous one.
+    Each account carries a version counter so balances can be read without
+    blocking transfers, and spending rollups are updated as transactions are
+    recorded. Transactions are kept in append (oldest first) order,
+    in memory and in compacted snapshots; snapshots in the newest-first
+    layout of the original mock database are still read.
+
+    A transfer may carry an idempotency key. The key is journaled with the
+    transfer (and kept in snapshots for IDEMPOTENCY_TTL seconds), so every
+    process sees it: a repeat with the same key is not applied again but
+    returns the first transfer's new balance with 'replayed': True.
+    """
+
+    def __init__(self, db_path=DB_PATH, journal_path=JOURNAL_PATH, lock_path=LOCK_PATH,
+                 snapshot_every=SNAPSHOT_EVERY, fsync=JOURNAL_FSYNC):
+        self.db_path = db_path
+        self.journal_path = journal_path
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+
+        # Guards the in-memory state and the journal position. Never held
+        # while waiting for account locks.
+        self._lock = threading.RLock()
+        self._sync_cond = threading.Condition()
+        self._syncing = False
+        self._written_seq = 0
+        self._synced_seq = 0
+
+        self._users = {}
+        self._versions = {}
+        self._rollups = SpendingRollups()
+        # Idempotency key -> [time applied, sender's new balance]
+        self._idempotency = {}
+        self._users_version = 0
+        self._snapshot_id = None
+        self._snapshot_identity = None
+        self._needs_adoption = False
+        self._journal = None
+        self._journal_identity = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        self._locks = AccountLocks(lock_path)
+
+        with self._lock:
+            self._recover()
+        self._adopt_snapshot()
+
+    def get_user(self, user_id):
+        """Return the banking record for a user, or None. Treat it as read-only."""
+        self._refresh()
+        return self._users.get(str(user_id))
+
+    def get_accounts(self, user_id):
+        """
+        Return a consistent copy of a user's accounts without taking any lock.
+        A writer makes an account's version odd before changing it and even
+        again afterwards, so the copy is retried while any version is odd or
+        a version changed while copying.
+        """
+        self._refresh()
+        user = self._users.get(str(user_id))
+        if not user:
+            return None
+        while True:
+            before = [self._versions.get(acc['account_id'], 0) for acc in user['accounts'].values()]
+            if any(version % 2 for version in before):
+                # A transfer is changing one of these balances
+                time.sleep(0)
+                continue
+            accounts = {acc_type: dict(acc) for acc_type, acc in user['accounts'].items()}
+            after = [self._versions.get(acc['account_id'], 0) for acc in user['accounts'].values()]
+            if before == after:
+                return accounts
+
+    def iter_users(self):
+        """Return a list of (user_id, user record) pairs."""
+        self._refresh()
+        return list(self._users.items())
+
+    def iter_payees(self):
+        """Return (owner_id, alias, payee_id) for every payee users have saved."""
+        self._refresh()
+        return [(uid, alias, str(payee_id))
+                for uid, user in list(self._users.items())
+                for alias, payee_id in user.get('payees', {}).items()]
+
+    def directory_version(self):
+        """Changes whenever the set of users or payees may have changed."""
+        self._refresh()
+        return self._users_version
+
+    def transaction_page(self, user_id, limit=20, before=None, since=None, until=None):
+        """
+        Return (transactions newest first, cursor for the next older page or None).
+
+        `before` is a cursor from a previous page; since/until are inclusive
+        YYYY-MM-DD bounds. Cost depends on the page size, not on how many
+        transactions the user has.
+        """
+        self._refresh()
+        user = self._users.get(str(user_id))
+        if not user:
+            return [], None
+        # Append-only and in date order: indices are stable cursors and
+        # dates can be binary searched
+        transactions = user['transactions']
+        end = len(transactions)
+        if before is not None:
+            end = min(end, int(before))
+        if until is not None:
+            end = min(end, _first_after_date(transactions, until, end))
+
+        page = []
+        i = end - 1
+        while i >= 0 and len(page) <= limit:
+            if since is not None and transactions[i]['date'] < since:
+                break
+            page.append(transactions[i])
+            i -= 1
+        if len(page) > limit:
+            return page[:limit], str(i + 2)
+        return page, None
+
+    def spending_summary(self, user_id, start, end):
+        """Spending totals for start..end (inclusive YYYY-MM-DD) from the rollups."""
+        self._refresh()
+        with self._lock:
+            return self._rollups.summary(user_id, start, end)
+
+    def transfer(self, sender_id, recipient_id, amount, sender_record, recipient_record, idempotency_key=None):
+        """
+        Move `amount` from the sender's first account to the recipient's first
+        account and record both transaction entries, locking only those two
+        accounts. Returns the sender's new balance once the journal entry is durable.
+        """
+        result = self.transfer_batch([{
+            'sender_id': sender_id,
+            'recipient_id': recipient_id,
+            'amount': amount,
+            'sender_record': sender_record,
+            'recipient_record': recipient_record,
+            'idempotency_key': idempotency_key
+        }])[0]
+        if not result['success']:
+            raise TransferError(result['error'])
+        return result['new_balance']
+
+    def transfer_batch(self, transfers, atomic=True):
+        """
+        Apply a list of transfers (dicts with the arguments of transfer()) in order.
+
+        With atomic=True either every transfer is applied or none is; otherwise
+        each one that passes validation is applied. All accepted transfers are
+        journaled as one entry and made durable with a single fsync.
+        Returns one result per transfer: {'success': True, 'new_balance': ...}
+        or {'success': False, 'error': ...}. A transfer whose 'idempotency_key'
+        was already applied is skipped and reported with 'replayed': True.
+        """
+        entries = [{
+            'op': 'transfer',
+            'from': str(t['sender_id']),
+            'to': str(t['recipient_id']),
+            'amount': t['amount'],
+            'records': [t['sender_record'], t['recipient_record']]
+        } for t in transfers]
+        now = time.time()
+        for entry, t in zip(entries, transfers):
+            if t.get('idempotency_key'):
+                entry.update(key=t['idempotency_key'], at=now)
+
+        self._adopt_snapshot()
+        self._refresh()
+        account_ids = set()
+        for entry in entries:
+            try:
+                account_ids.update(_first_account(user)['account_id']
+                                   for user in self._transfer_users(entry))
+            except TransferError:
+                pass  # reported by _validate_batch
+
+        seq = None
+        with self._locks.accounts(*account_ids):
+            with self._lock:
+                # Other processes may have changed these accounts before we locked them
+                self._catch_up()
+                if self._needs_adoption:
+                    raise TransferError('Banking data is being reloaded, please try again')
+                results, accepted = self._validate_batch(entries, account_ids, atomic)
+                if accepted:
+                    if len(accepted) == 1:
+                        seq = self._append(accepted[0])
+                    else:
+                        seq = self._append({'op': 'batch', 'transfers': accepted})
+                    # Replaying applies our entry and anything other processes appended before it
+                    self._replay()
+                compact = self._journal_entries >= self.snapshot_every
+
+        if seq is not None:
+            self._sync(seq)
+        if compact:
+            self.compact(only_if_due=True)
+        return results
+
+    def compact(self, only_if_due=False):
+        """Write the current state as a new snapshot and start an empty journal."""
+        with self._locks.exclusive(), self._lock:
+            self._catch_up()
+            if self._needs_adoption or (only_if_due and self._journal_entries < self.snapshot_every):
+                return
+            self._compact()
+
+    def close(self):
+        """Flush and close the journal."""
+        with self._lock:
+            self._close_journal()
+            self._locks.close()
+
+    def _refresh(self):
+        """Catch up with other processes, skipping the lock when nothing changed."""
+        if (_file_identity(self.db_path) == self._snapshot_identity
+                and _file_identity(self.journal_path, with_mtime=False) == self._journal_identity
+                and _file_size(self.journal_path) == self._journal_offset):
+            return
+        with self._lock:
+            self._catch_up()
+        if self._needs_adoption:
+            self._adopt_snapshot()
+
+    def _adopt_snapshot(self):
+        """
+        Take ownership of a snapshot written outside the store (first run or
+        update_user_data.py): give it a snapshot id and start a fresh journal.
+        """
+        if not self._needs_adoption:
+            return
+        with self._locks.exclusive(), self._lock:
+            self._catch_up()
+            if not self._needs_adoption:
+                return
+            db = load_mock_db(self.db_path)
+            db['snapshot_id'] = os.urandom(8).hex()
+            self._write_snapshot(db)
+            self._write_journal_header(db['snapshot_id'])
+            self._recover()
+
+    def _recover(self):
+        """Load the snapshot and replay the journal on top of it."""
+        with span('db.load_snapshot'):
+            db = load_mock_db(self.db_path)
+
+        self._users = {}
+        self._versions = {}
+        self._rollups = SpendingRollups()
+        self._idempotency = dict(db.get('idempotency', {}))
+        for uid, user in db['users'].items():
+            if db.get('transaction_order') != 'append':
+                # The original mock database lists transactions newest first
+                user['transactions'] = list(reversed(user.get('transactions', [])))
+            self._users[uid] = user
+            for tx in user['transactions']:
+                self._rollups.record(uid, tx)
+        self._users_version += 1
+        self._snapshot_id = db.get('snapshot_id')
+        self._snapshot_identity = _file_identity(self.db_path)
+
+        # Without a snapshot id or journal the files must be adopted before
+        # the first write; until then any existing journal is ignored
+        self._needs_adoption = not self._snapshot_id or not os.path.exists(self.journal_path)
+        if self._needs_adoption:
+            self._close_journal()
+            self._journal_identity = None
+            self._journal_offset = None
+            return
+
+        self._open_journal()
+        header, offset = self._read_header()
+        if header is None or header.get('snapshot_id') != self._snapshot_id:
+            # A compaction replaced the snapshot but has not swapped the journal
+            # (still running in another process, or it crashed in between). The
+            # snapshot already contains everything in this journal, but entries
+            # appended after the stale header would be skipped on the next
+            # start: readopt the snapshot, under the exclusive lock, before
+            # any write. A compaction still in progress finishes first.
+            self._close_journal()
+            self._journal_identity = None
+            self._journal_offset = None
+            self._needs_adoption = True
+            return
+        self._journal_offset = offset
+        self._replay()
+
+    def _catch_up(self):
+        """Apply journal entries written by other processes since the last call."""
+        if (_file_identity(self.db_path) != self._snapshot_identity
+                or _file_identity(self.journal_path, with_mtime=False) != self._journal_identity):
+            self._recover()
+        elif not self._needs_adoption:
+            self._replay()
+
+    def _replay(self):
+        """Apply every complete journal line after the current offset."""
+        self._journal.seek(self._journal_offset)
+        data = self._journal.read()
+        # A last line without a newline is a write still in progress (or torn by a crash)
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        for line in data[:end].split(b'\n'):
+            self._apply(json.loads(line))
+            self._journal_entries += 1
+        self._journal_offset += end + 1
+
+    def _read_header(self):
+        """Read the first journal line. Returns (header, offset after it)."""
+        self._journal.seek(0)
+        data = b''
+        while True:
+            chunk = self._journal.read(4096)
+            if not chunk:
+                return None, 0
+            data += chunk
+            end = data.find(b'\n')
+            if end >= 0:
+                return json.loads(data[:end]), end + 1
+
+    def _append(self, entry):
+        """Append one entry with a single write, which O_APPEND keeps whole across processes."""
+        self._journal.write((json.dumps(entry) + '\n').encode('utf-8'))
+        with self._sync_cond:
+            self._written_seq += 1
+            return self._written_seq
+
+    def _sync(self, seq):
+        """Wait until journal write `seq` is on disk, fsyncing on behalf of other waiters too."""
+        if not self.fsync:
+            return
+        with self._sync_cond:
+            while self._synced_seq < seq:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written_seq
+                fileno = self._journal.fileno()
+                self._sync_cond.release()
+                try:
+                    with span('db.journal_fsync'):
+                        os.fsync(fileno)
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._sync_cond.notify_all()
+                self._synced_seq = max(self._synced_seq, target)
+
+    def _open_journal(self):
+        self._close_journal()
+        # Unbuffered append mode: writes always go to the end, reads can seek
+        self._journal = open(self.journal_path, 'a+b', buffering=0)
+        self._journal_identity = _file_identity(self.journal_path, with_mtime=False)
+        self._journal_entries = 0
+
+    def _close_journal(self):
+        """Close the current journal after making every pending write durable."""
+        if self._journal is None:
+            return
+        with self._sync_cond:
+            while self._syncing:
+                self._sync_cond.wait()
+            if self.fsync and self._synced_seq < self._written_seq:
+                os.fsync(self._journal.fileno())
+            self._synced_seq = self._written_seq
+            self._journal.close()
+            self._journal = None
+            self._sync_cond.notify_all()
+
+    def _compact(self):
+        """Write a new snapshot and an empty journal. Caller holds the exclusive store lock."""
+        snapshot_id = os.urandom(8).hex()
+        with span('db.compact'):
+            cutoff = time.time() - IDEMPOTENCY_TTL
+            self._idempotency = {key: applied for key, applied in self._idempotency.items() if applied[0] >= cutoff}
+            self._write_snapshot({'snapshot_id': snapshot_id, 'transaction_order': 'append', 'users': self._users,
+                                  'idempotency': self._idempotency})
+            self._write_journal_header(snapshot_id)
+
+        self._snapshot_id = snapshot_id
+        self._snapshot_identity = _file_identity(self.db_path)
+        self._open_journal()
+        self._journal_offset = self._journal.seek(0, os.SEEK_END)
+
+    def _write_snapshot(self, db):
+        _atomic_write(self.db_path, json.dumps(db).encode('utf-8'), self.fsync)
+
+    def _write_journal_header(self, snapshot_id):
+        header = json.dumps({'snapshot_id': snapshot_id}) + '\n'
+        _atomic_write(self.journal_path, header.encode('utf-8'), self.fsync)
+
+    def _transfer_users(self, entry):
+        sender = self._users.get(entry['from'])
+        recipient = self._users.get(entry['to'])
+        if not sender or not recipient:
+            raise TransferError('User not found')
+        if not sender['accounts'] or not recipient['accounts']:
+            raise TransferError('No account available for transfer')
+        return sender, recipient
+
+    def _validate_batch(self, entries, locked_account_ids, atomic):
+        """
+        Check each transfer against the balances left by the ones before it.
+        Returns (results, accepted entries).
+        """
+        balances = {}
+        results = []
+        accepted = []
+        keys = {}
+        for entry in entries:
+            applied = self._applied(entry.get('key'))
+            if applied is None and entry.get('key') in keys:
+                applied = keys[entry['key']]
+            if applied is not None:
+                # A repeat of a transfer that already moved the money
+                results.append({'success': True, 'new_balance': applied[1], 'replayed': True})
+                continue
+            try:
+                sender, recipient = self._transfer_users(entry)
+                source = _first_account(sender)
+                target = _first_account(recipient)
+                if not {source['account_id'], target['account_id']} <= locked_account_ids:
+                    # The users were reloaded after we chose which accounts to lock
+                    raise TransferError('Account changed during transfer, please try again')
+                balance = balances.get(source['account_id'], source['balance'])
+                if balance < entry['amount']:
+                    raise TransferError('Insufficient funds')
+            except TransferError as e:
+                results.append({'success': False, 'error': str(e)})
+                continue
+            balances[source['account_id']] = balance - entry['amount']
+            balances[target['account_id']] = balances.get(target['account_id'], target['balance']) + entry['amount']
+            results.append({'success': True, 'new_balance': balances[source['account_id']]})
+            accepted.append(entry)
+            if entry.get('key'):
+                keys[entry['key']] = [entry['at'], balances[source['account_id']]]
+
+        if atomic and any(not r['success'] for r in results):
+            # Replayed transfers were applied by an earlier request and stay reported as such
+            results = [r if not r['success'] or r.get('replayed') else {'success': False, 'error': 'Batch rolled back'}
+                       for r in results]
+            accepted = []
+        return results, accepted
+
+    def _apply(self, entry):
+        if entry['op'] == 'batch':
+            for transfer in entry['transfers']:
+                self._apply(transfer)
+        elif entry['op'] == 'transfer':
+            sender = self._users[entry['from']]
+            recipient = self._users[entry['to']]
+            source = _first_account(sender)
+            target = _first_account(recipient)
+            # Versions are odd while the balances change, so optimistic readers retry
+            self._bump_version(source, target)
+            source['balance'] -= entry['amount']
+            target['balance'] += entry['amount']
+            self._bump_version(source, target)
+            sender_record, recipient_record = entry['records']
+            sender['transactions'].append(sender_record)
+            recipient['transactions'].append(recipient_record)
+            self._rollups.record(entry['from'], sender_record)
+            self._rollups.record(entry['to'], recipient_record)
+            if entry.get('key'):
+                self._idempotency[entry['key']] = [entry['at'], source['balance']]
+
+    def _applied(self, key):
+        """[time, sender's new balance] of the transfer applied with `key` within IDEMPOTENCY_TTL, or None."""
+        applied = self._idempotency.get(key) if key else None
+        if applied is not None and applied[0] >= time.time() - IDEMPOTENCY_TTL:
+            return applied
+        return None
+
+    def _bump_version(self, *accounts):
+        for account in accounts:
+            self._versions[account['account_id']] = self._versions.get(account['account_id'], 0) + 1
+
+def _first_account(user):
+    """Transfers use the first account a user has, as in the original POC."""
+    return next(iter(user['accounts'].values()))
+
+def _file_identity(path, with_mtime=True):
+    """Identify a file version by inode (and mtime, to catch in-place rewrites)."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if with_mtime:
+        return (st.st_dev, st.st_ino, st.st_mtime_ns)
+    return (st.st_dev, st.st_ino)
+
+def _first_after_date(transactions, date, hi):
+    """Index of the first transaction in transactions[:hi] dated after `date` (binary search)."""
+    lo = 0
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if transactions[mid]['date'] <= date:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return None
+
+def _atomic_write(path, data, fsync=True):
+    """Write a file through a temporary file and rename so readers never see it half-written."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+_account_store = None
+_account_store_lock = threading.Lock()
+
+def get_account_store():
+    """Get the process-wide account store for the configured storage backend."""
+    global _account_store
+    if _account_store is None:
+        with _account_store_lock:
+            if _account_store is None:
+                from services.storage import STORAGE_BACKEND, get_sqlite_store
+                if STORAGE_BACKEND == 'sqlite':
+                    _account_store = get_sqlite_store()
+                else:
+                    _account_store = AccountStore()
+    return _account_store
+
+def new_transaction_id():
+    """Transaction reference shared by the sender's and recipient's records."""
+    timestamp = datetime.now().strftime('%Y%m%d')
+    return f"TX{timestamp}{random.randint(1000, 9999)}"
+
+def prepare_transfer(store, user_data, recipient, amount, tx_id=None):
+    """
+    Resolve the recipient and build the transaction records for a transfer
+    from `user_data`. Returns (transfer arguments for store.transfer, None)
+    or (None, error response).
+    """
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        return None, {'error': 'Invalid amount', 'success': False}
+    
+    # Resolve the spoken name through the name/phonetic index
+    recipient_id, candidates = get_recipient_directory(store).resolve(recipient, owner_id=user_data['id'])
+    
+    if not candidates:
+        return None, {'error': f'Recipient {recipient} not found', 'success': False}
+    if not recipient_id:
+        names = ', '.join(c['name'] for c in candidates)
+        return None, {'error': f'Could not confirm recipient {recipient}. Did you mean: {names}?',
+                      'success': False, 'candidates': candidates}
+    
+    # Build transaction records
+    timestamp = datetime.now().strftime('%Y-%m-%d')
+    tx_id = tx_id or new_transaction_id()
+    
+    sender_record = {
+        'transaction_id': tx_id,
+        'type': 'transfer_out',
+        'amount': amount,
+        'date': timestamp,
+        'description': f'Transfer to {recipient}',
+        'counterparty': recipient
+    }
+    
+    recipient_record = {
+        'transaction_id': tx_id,
+        'type': 'transfer_in',
+        'amount': amount,
+        'date': timestamp,
+        'description': f'Transfer from {user_data["name"]}',
+        'counterparty': user_data['name']
+    }
+    
+    return {
+        'sender_id': user_data['id'],
+        'recipient_id': recipient_id,
+        'amount': amount,
+        'sender_record': sender_record,
+        'recipient_record': recipient_record
+    }, None
+
+def process_bulk_transfers(user, transfers, atomic=True):
+    """
+    Apply a batch of transfers from one user, e.g. payroll or bill-pay runs.
+    Each item is {'recipient': name, 'amount': number}, handled like the
+    transfer_money intent. All accepted transfers are committed together with
+    one journal write. With atomic=True a single failure rejects the whole
+    batch; otherwise valid items are applied and failures reported per item.
+    """
+    store = get_account_store()
+    user_data = store.get_user(user['id'])
+    
+    if not user_data:
+        return {'error': 'User not found', 'success': False}
+    
+    batch_id = new_transaction_id()
+    results = [None] * len(transfers)
+    prepared = []
+    positions = []
+    
+    for i, item in enumerate(transfers):
+        recipient = str(item.get('recipient') or '')
+        if not recipient:
+            results[i] = {'error': 'Recipient not specified', 'success': False}
+            continue
+        transfer, error = prepare_transfer(store, user_data, recipient, item.get('amount'),
+                                           tx_id=f"{batch_id}-{i + 1}")
+        if error:
+            results[i] = error
+            continue
+        prepared.append(transfer)
+        positions.append(i)
+    
+    if atomic and len(prepared) < len(transfers):
+        prepared = []
+    
+    try:
+        applied = store.transfer_batch(prepared, atomic=atomic) if prepared else []
+    except TransferError as e:
+        return {'error': str(e), 'success': False}
+    
+    for i, result in zip(positions, applied):
+        results[i] = result
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = {'error': 'Batch rolled back', 'success': False}
+        results[i]['recipient'] = transfers[i].get('recipient')
+        results[i]['amount'] = transfers[i].get('amount')
+    
+    succeeded = sum(1 for r in results if r['success'])
+    return {
+        'success': succeeded == len(transfers),
+        'batch_id': batch_id,
+        'succeeded': succeeded,
+        'failed': len(transfers) - succeeded,
+        'results': results
+    }
+
+def iter_transactions(store, user_id, since=None, until=None, page_size=500):
+    """Yield a user's transactions newest first, one page at a time."""
+    cursor = None
+    while True:
+        page, cursor = store.transaction_page(user_id, limit=page_size, before=cursor,
+                                              since=since, until=until)
+        yield from page
+        if cursor is None:
+            break
+
+def export_transactions(user_id, fmt='csv', since=None, until=None):
+    """
+    Stream a statement as CSV or JSON Lines text chunks, newest first.
+    Rows are written as they are read, so memory use does not grow with history.
+    """
+    store = get_account_store()
+    if fmt == 'jsonl':
+        for tx in iter_transactions(store, user_id, since, until):
+            yield json.dumps(tx, ensure_ascii=False) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=STATEMENT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    for i, tx in enumerate(iter_transactions(store, user_id, since, until), 1):
+        writer.writerow(tx)
+        if i % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def process_banking_request(intent_data, user, idempotency_key=None):
     """
     Process banking requests based on the intent.
     This is a simplified version for the POC.
+    A transfer with an idempotency_key runs at most once per key within
+    IDEMPOTENCY_TTL, across all processes sharing the store; repeats get the
+    first transfer's balance with 'replayed': True.
     """
     intent_type = intent_data['intent_type']
     parameters = intent_data['parameters']
     
-    # Load the mock database
-    db = load_mock_db()
-    user_data = db['users'].get(user['id'])
+    store = get_account_store()
+    user_data = store.get_user(user['id'])
     
     if not user_data:
         return {'error': 'User not found'}
@@ -104,9 +920,9 @@ def process_banking_request(intent_data, user):
     }
     
     if intent_type == 'check_balance':
-        response['accounts'] = user_data['accounts']
+        response['accounts'] = store.get_accounts(user_data['id'])
         response['message'] = f"Your current balances are: "
-        for acc_type, acc_data in user_data['accounts'].items():
+        for acc_type, acc_data in response['accounts'].items():
             response['message'] += f"{acc_type}: {acc_data['balance']} {acc_data['currency']}, "
         response['message'] = response['message'].rstrip(', ')
     
@@ -117,67 +933,52 @@ def process_banking_request(intent_data, user):
         amount = parameters['amount']
         recipient = parameters.get('recipient', 'unknown')
         
-        # Find recipient in our mock DB (simplified)
-        recipient_id = None
-        for uid, udata in db['users'].items():
-            if recipient.lower() in udata['name'].lower():
-                recipient_id = uid
-                break
-        
-        if not recipient_id:
-            return {'error': f'Recipient {recipient} not found', 'success': False}
-            
-        # Check if sufficient funds (from first available account)
-        source_account = next(iter(user_data['accounts'].values()))
-        if source_account['balance'] < amount:
-            return {'error': 'Insufficient funds', 'success': False}
-            
-        # Update balances
-        source_account['balance'] -= amount
-        db['users'][recipient_id]['accounts'][next(iter(db['users'][recipient_id]['accounts']))]['balance'] += amount
-        
-        # Add transaction records
-        timestamp = datetime.now().strftime('%Y-%m-%d')
-        tx_id = f"TX{timestamp.replace('-', '')}{random.randint(1000, 9999)}"
-        
-        # Add to sender's transactions
-        user_data['transactions'].insert(0, {
-            'transaction_id': tx_id,
-            'type': 'transfer_out',
-            'amount': amount,
-            'date': timestamp,
-            'description': f'Transfer to {recipient}',
-            'counterparty': recipient
-        })
+        transfer, error = prepare_transfer(store, user_data, recipient, amount)
+        if error:
+            return error
         
-        # Add to recipient's transactions
-        db['users'][recipient_id]['transactions'].insert(0, {
-            'transaction_id': tx_id,
-            'type': 'transfer_in',
-            'amount': amount,
-            'date': timestamp,
-            'description': f'Transfer from {user_data["name"]}',
-            'counterparty': user_data['name']
-        })
-        
-        save_mock_db(db)
-        response['message'] = f"Successfully transferred {amount} to {recipient}"
-        response['new_balance'] = source_account['balance']
+        if idempotency_key:
+            # Only applied transfers are remembered, so a failed one can be
+            # retried. The amount and recipient are part of the key: a short
+            # follow-up that completes a pending transfer must not replay a
+            # different one
+            transfer['idempotency_key'] = hashlib.sha256(json.dumps(
+                [str(user_data['id']), idempotency_key, amount, recipient]).encode('utf-8')).hexdigest()
+        # Checks funds, updates both balances and journals the transfer
+        try:
+            result = store.transfer_batch([transfer])[0]
+        except TransferError as e:
+            result = {'success': False, 'error': str(e)}
+        if not result['success']:
+            return {'error': result['error'], 'success': False}
+        response = dict(response, message=f"Successfully transferred {amount} to {recipient}",
+                        new_balance=result['new_balance'])
+        return dict(response, replayed=True) if result.get('replayed') else response
     
     elif intent_type == 'transaction_history':
         period = parameters.get('period', 'recent')
-        transactions = user_data['transactions']
+        since = None
         
         if period == 'last_week':
-            one_week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-            transactions = [t for t in transactions if t['date'] >= one_week_ago]
+            since = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
         elif period == 'last_month':
-            one_month_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-            transactions = [t for t in transactions if t['date'] >= one_month_ago]
+            since = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
         
-        response['transactions'] = transactions[:5]  # Limit to 5 for demo
+        response['transactions'], response['next_cursor'] = store.transaction_page(
+            user_data['id'], limit=5, since=since)  # Limit to 5 for demo
         response['message'] = f"Here are your recent transactions"
     
+    elif intent_type == 'spending_summary':
+        start, end, label = period_range(parameters.get('period', 'this_month'))
+        summary = store.spending_summary(user_data['id'], start, end)
+        currency = next(iter(user_data['accounts'].values()))['currency'] if user_data['accounts'] else ''
+        
+        response['summary'] = summary
+        response['message'] = f"You spent {summary['spent']:.2f} {currency} {label}"
+        if summary['by_counterparty']:
+            top_name, top_amount = next(iter(summary['by_counterparty'].items()))
+            response['message'] += f", the most to {top_name} ({top_amount:.2f} {currency})"
+    
     else:
         response = {
             'success': False,
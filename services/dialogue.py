@@ -0,0 +1,118 @@
+"""
+Dialogue state for transfers that need another turn.
+
+A transfer without an amount, or whose recipient cannot be resolved, is
+kept per user for DIALOGUE_TTL seconds with the slots it already has.
+The response carries 'awaiting' (the missing slot) and a prompt, and the
+user answers with just that part: "500", "to Jane", "जेन को" or a bare
+name. The follow-up's slots are merged into the pending transfer. Any other
+complete request (a balance check, a new transfer) replaces it.
+
+A follow-up that only fills the pending transfer's slots, from the same
+session token and within DIALOGUE_VERIFIED_WINDOW seconds of the last voice
+authentication, skips biometrics. Anything else (a new complete transfer,
+another intent, a request without a session token) is authenticated as
+usual. The window is not extended by the skipped turns. The state is kept
+per process.
+"""
+
+import os
+import time
+from models.intent_recognition import INTENT_KEYWORDS, extract_transfer_slots, preprocess_text
+from services.metrics import incr
+from services.result_cache import TTLCache
+
+DIALOGUE_TTL = float(os.environ.get('DIALOGUE_TTL', 120))
+DIALOGUE_VERIFIED_WINDOW = float(os.environ.get('DIALOGUE_VERIFIED_WINDOW', 60))
+# Words that may surround a bare recipient name in a follow-up
+FILLER_WORDS = {'to', 'please', 'it', 'send', 'pay', 'transfer', 'रुपये', 'को'}
+# A follow-up of at most this many other words is taken as the recipient's name
+MAX_NAME_WORDS = 3
+
+_pending = TTLCache('dialogue', max_entries=10000, ttl=DIALOGUE_TTL)
+
+def pending_transfer(user_id):
+    """The user's pending transfer: {'parameters', 'awaiting', 'verified_at', 'session'}, or None."""
+    return _pending.get(str(user_id))
+
+def verified_at(user_id, session):
+    """
+    When the user's voice was last verified, if a transfer is pending from
+    this session (session_service.session_key) and that was within
+    DIALOGUE_VERIFIED_WINDOW; otherwise None. Only a follow-up that
+    skips_authentication() may rely on it.
+    """
+    pending = pending_transfer(user_id)
+    if (pending and session is not None and pending['session'] == session
+            and time.monotonic() - pending['verified_at'] <= DIALOGUE_VERIFIED_WINDOW):
+        return pending['verified_at']
+    return None
+
+def skips_authentication(intent_data):
+    """Whether continue_dialogue() took the request as a follow-up filling the pending transfer."""
+    if intent_data.get('matched_by') == 'dialogue':
+        incr('cache_events_total', cache='dialogue_verification', result='hit')
+        return True
+    return False
+
+def continue_dialogue(user_id, intent_data, text, language):
+    """
+    Fill a pending transfer's slots from a follow-up. Returns the intent to
+    act on: the completed transfer, or intent_data when nothing is pending
+    or the user asked for something else.
+    """
+    pending = pending_transfer(user_id)
+    if pending is None:
+        return intent_data
+    slots = extract_transfer_slots(text, language)
+    if intent_data['intent_type'] == 'transfer_money' and 'amount' in slots and 'recipient' in slots:
+        # A whole new transfer
+        return intent_data
+    if intent_data['intent_type'] not in ('unknown', 'transfer_money') and not slots:
+        return intent_data
+    if pending['awaiting'] == 'recipient' and 'recipient' not in slots:
+        name = _bare_name(text, language)
+        if name:
+            slots['recipient'] = name
+    incr('cache_events_total', cache='dialogue', result='hit')
+    return {
+        'intent_type': 'transfer_money',
+        'parameters': dict(pending['parameters'], **slots),
+        'matched_by': 'dialogue'
+    }
+
+def record_outcome(user_id, intent_data, response, verified, text='', language='en-US', session=None):
+    """
+    Keep a transfer that is missing its amount or recipient for the next turn
+    and add 'awaiting' and a prompt to the response; clear the state after
+    any other outcome. `verified` is when this request's voice was verified,
+    `session` the request's session key. Returns the response.
+    """
+    key = str(user_id)
+    if intent_data['intent_type'] != 'transfer_money' or response.get('success', True):
+        _pending.discard(key)
+        return response
+    error = response.get('error', '')
+    parameters = dict(extract_transfer_slots(text, language), **intent_data['parameters'])
+    if error == 'Amount not specified' or 'amount' not in parameters:
+        awaiting = 'amount'
+        parameters.pop('amount', None)
+        prompt = (f"How much should I send to {parameters['recipient']}?" if 'recipient' in parameters
+                  else 'How much should I send, and to whom?')
+    elif error.startswith(('Recipient ', 'Could not confirm recipient')):
+        awaiting = 'recipient'
+        parameters.pop('recipient', None)
+        prompt = f"Who should I send {parameters['amount']:g} to?"
+    else:
+        # Insufficient funds and the like: another turn would not help
+        _pending.discard(key)
+        return response
+    _pending.put(key, {'parameters': parameters, 'awaiting': awaiting, 'verified_at': verified,
+                       'session': session})
+    separator = ' ' if error.endswith('?') else '. '
+    return dict(response, awaiting=awaiting, message=f'{error}{separator}{prompt}')
+
+def _bare_name(text, language):
+    filler = FILLER_WORDS | set(INTENT_KEYWORDS.get(language, INTENT_KEYWORDS['en-US'])['transfer_money'])
+    words = [w for w in preprocess_text(text).lower().split() if w not in filler and not w.replace('.', '').isdigit()]
+    return ' '.join(words) if 0 < len(words) <= MAX_NAME_WORDS else None
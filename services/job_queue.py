@@ -0,0 +1,264 @@
+"""
+Background jobs for voice requests.
+
+In job mode /api/process-voice saves the upload, queues a job and answers
+202 with the job id right away; clients then poll /api/jobs/<id> or follow
+/api/jobs/<id>/events (server-sent events) for the result.
+
+Two queues share one interface (submit, get, wait):
+
+- MemoryJobQueue (VOICE_JOB_QUEUE=memory, the default) runs jobs on a
+  thread pool inside the web process. Jobs are only visible to the process
+  that accepted them, so use a single web worker with it.
+- SQLiteJobQueue (VOICE_JOB_QUEUE=sqlite) keeps jobs in a SQLite database
+  that every web worker can read. The jobs are run by voice_worker.py
+  processes, which can be scaled separately from the web workers.
+
+Job ids are random and unguessable; finished jobs are kept for
+VOICE_JOB_TTL seconds. Once VOICE_JOB_BACKLOG jobs are queued or running,
+submit() raises admission.Overloaded.
+
+A SQLite job claimed by a worker that then dies would stay 'running' for
+good. Each claim is a lease of VOICE_JOB_LEASE seconds: a job still running
+after that is finished with an error (not run again, since a voice job may
+already have moved money), and no longer counts toward the backlog.
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services.admission import Overloaded
+
+JOB_QUEUE_BACKEND = os.environ.get('VOICE_JOB_QUEUE', 'memory').lower()
+JOB_DB_PATH = os.environ.get('VOICE_JOB_DB',
+                             os.path.join(os.path.dirname(__file__), '../data/jobs.db'))
+# Pipeline threads of the in-process queue
+JOB_WORKERS = int(os.environ.get('VOICE_JOB_WORKERS', 2))
+# Seconds a finished job's result stays available
+JOB_TTL = int(os.environ.get('VOICE_JOB_TTL', 600))
+# Unfinished jobs accepted before new ones are turned away
+JOB_BACKLOG = int(os.environ.get('VOICE_JOB_BACKLOG', 32))
+# Seconds a SQLite worker may hold a job before it is given up as crashed
+JOB_LEASE = int(os.environ.get('VOICE_JOB_LEASE', 300))
+# Retry-After (seconds) suggested when the backlog is full
+BACKLOG_RETRY_AFTER = 5
+# How often SQLite queue waiters and workers check for changes
+POLL_INTERVAL = 0.2
+
+def _public(job):
+    """The client-visible fields of a job record."""
+    view = {'job_id': job['id'], 'status': job['status'],
+            'created_at': job['created_at'], 'updated_at': job['updated_at']}
+    if job['status'] == 'done':
+        view['status_code'] = job['status_code']
+        view['result'] = job['result']
+    return view
+
+class MemoryJobQueue:
+    """Jobs run on a thread pool in this process."""
+
+    def __init__(self, handler, workers=JOB_WORKERS, ttl=JOB_TTL):
+        """handler(payload) runs a job and returns (result body, HTTP status)."""
+        self._handler = handler
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='voice-job')
+        self._ttl = ttl
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def submit(self, payload, owner_id=None):
+        """Queue a job and return its id."""
+        now = time.time()
+        job_id = secrets.token_urlsafe(16)
+        with self._changed:
+            self._expire(now)
+            if sum(job['status'] != 'done' for job in self._jobs.values()) >= JOB_BACKLOG:
+                raise Overloaded('voice job', BACKLOG_RETRY_AFTER)
+            self._jobs[job_id] = {'id': job_id, 'status': 'queued', 'owner_id': owner_id,
+                                  'created_at': now, 'updated_at': now,
+                                  'result': None, 'status_code': None}
+        self._executor.submit(self._run, job_id, payload)
+        return job_id
+
+    def get(self, job_id):
+        """Client view of a job, or None if it does not exist (or expired)."""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return _public(job) if job else None
+
+    def owner(self, job_id):
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return job['owner_id'] if job else None
+
+    def wait(self, job_id, after=None, timeout=15):
+        """Wait up to `timeout` seconds for the job's status to differ from `after`."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['status'] != after, timeout)
+            job = self._jobs.get(job_id)
+            return _public(job) if job else None
+
+    def _run(self, job_id, payload):
+        self._update(job_id, status='running')
+        try:
+            body, status_code = self._handler(payload)
+        except Exception as e:
+            body, status_code = {'error': str(e)}, 500
+        self._update(job_id, status='done', result=body, status_code=status_code)
+
+    def _update(self, job_id, **fields):
+        with self._changed:
+            self._jobs[job_id].update(fields, updated_at=time.time())
+            self._changed.notify_all()
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] == 'done' and job['updated_at'] + self._ttl < now]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    owner_id TEXT,
+    payload TEXT NOT NULL,
+    result TEXT,
+    status_code INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+class SQLiteJobQueue:
+    """Jobs stored in SQLite; run by separate worker processes (voice_worker.py)."""
+
+    def __init__(self, path=JOB_DB_PATH, ttl=JOB_TTL, lease=JOB_LEASE):
+        self.path = path
+        self._ttl = ttl
+        self._lease = lease
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(JOBS_SCHEMA)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        if 'claimed_at' not in columns:
+            # Databases created before leases were added
+            conn.execute('ALTER TABLE jobs ADD COLUMN claimed_at REAL')
+
+    def _conn(self):
+        """One connection per thread; sqlite3 connections cannot be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def submit(self, payload, owner_id=None):
+        """Queue a job and return its id."""
+        now = time.time()
+        job_id = secrets.token_urlsafe(16)
+        conn = self._conn()
+        conn.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < ?", (now - self._ttl,))
+        self._expire_leases(conn, now)
+        pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        if pending >= JOB_BACKLOG:
+            raise Overloaded('voice job', BACKLOG_RETRY_AFTER)
+        conn.execute("INSERT INTO jobs (id, status, owner_id, payload, created_at, updated_at) "
+                     "VALUES (?, 'queued', ?, ?, ?, ?)",
+                     (job_id, owner_id, json.dumps(payload), now, now))
+        return job_id
+
+    def get(self, job_id):
+        """Client view of a job, or None if it does not exist (or expired)."""
+        row = self._conn().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return _public(job)
+
+    def owner(self, job_id):
+        row = self._conn().execute('SELECT owner_id FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row['owner_id'] if row else None
+
+    def wait(self, job_id, after=None, timeout=15):
+        """Wait up to `timeout` seconds for the job's status to differ from `after`."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] != after or time.monotonic() >= deadline:
+                return job
+            time.sleep(POLL_INTERVAL)
+
+    def claim(self):
+        """Take the oldest queued job. Returns (job_id, payload) or None."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._expire_leases(conn, now)
+            row = conn.execute("SELECT id, payload FROM jobs WHERE status = 'queued' "
+                               "ORDER BY created_at LIMIT 1").fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'running', updated_at = ?, claimed_at = ? WHERE id = ?",
+                             (now, now, row['id']))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return (row['id'], json.loads(row['payload'])) if row else None
+
+    def _expire_leases(self, conn, now):
+        """Finish jobs whose worker held them past the lease with an error."""
+        conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, status_code = 500, updated_at = ? "
+            "WHERE status = 'running' AND COALESCE(claimed_at, updated_at) < ?",
+            (json.dumps({'error': 'The voice worker stopped before finishing the request'}),
+             now, now - self._lease))
+
+    def complete(self, job_id, body, status_code):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'done', result = ?, status_code = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(body), status_code, time.time(), job_id))
+
+    def run_worker(self, handler, stop=None):
+        """Run queued jobs with handler(payload) -> (body, status) until `stop` is set."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            claimed = self.claim()
+            if claimed is None:
+                stop.wait(POLL_INTERVAL)
+                continue
+            job_id, payload = claimed
+            try:
+                body, status_code = handler(payload)
+            except Exception as e:
+                body, status_code = {'error': str(e)}, 500
+            self.complete(job_id, body, status_code)
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Get the process-wide job queue for the configured backend."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                if JOB_QUEUE_BACKEND == 'sqlite':
+                    _job_queue = SQLiteJobQueue()
+                else:
+                    # Imported here: the pipeline pulls in the speech and biometrics models
+                    from services.voice_pipeline import run_voice_job
+                    _job_queue = MemoryJobQueue(run_voice_job)
+    return _job_queue
@@ -0,0 +1,178 @@
+"""
+Logging for the web app and the voice workers.
+
+configure_logging() routes every log record through a bounded queue to a
+background thread that formats and writes it, so request threads never
+wait on log I/O. When the queue is full, records are dropped and counted
+(log_records_dropped_total) rather than blocking.
+
+- LOG_FORMAT=json (default) writes one JSON object per line, with the
+  request id and the pipeline stage (the innermost metrics span) of the
+  code that logged; LOG_FORMAT=text writes plain lines
+- LOG_LEVEL sets the level (default INFO)
+- LOG_SAMPLE keeps a fraction of the records below WARNING per logger,
+  e.g. LOG_SAMPLE=models.intent_recognition=0.1,models.speech_recognition=0.5
+- transcripts are logged through sensitive(), which shows only their length
+  unless LOG_TRANSCRIPTS=1
+
+Log with %-style arguments (logger.info('Loaded %s', name)) rather than
+f-strings: the message is then only formatted on the logging thread, and
+not at all for records that are filtered out or sampled away.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from services import metrics
+
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_TRANSCRIPTS = os.environ.get('LOG_TRANSCRIPTS', '0') == '1'
+# Records waiting for the logging thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s'
+
+_request_id = contextvars.ContextVar('request_id', default=None)
+_listener = None
+_lock = threading.Lock()
+
+def _parse_sampling(spec):
+    rates = {}
+    for item in spec.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+LOG_SAMPLE = _parse_sampling(os.environ.get('LOG_SAMPLE', ''))
+
+class _Sensitive:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        if LOG_TRANSCRIPTS:
+            return str(self.value)
+        return f'<redacted, {len(str(self.value))} chars>'
+
+    __repr__ = __str__
+
+def sensitive(value):
+    """Wrap a log argument, such as a transcript, that is only written with LOG_TRANSCRIPTS=1."""
+    return _Sensitive(value)
+
+def current_request_id():
+    return _request_id.get()
+
+@contextmanager
+def request_context(request_id):
+    """Tag the records logged in the block (in this thread) with request_id."""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+def bind_request_id(request_id):
+    """Set the request id until reset_request_id(token); for before/after request hooks."""
+    return _request_id.set(request_id)
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+class SamplingFilter(logging.Filter):
+    """Keeps a LOG_SAMPLE fraction of a logger's records below WARNING."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            if name in self.rates:
+                return random.random() < self.rates[name]
+            name = name.rpartition('.')[0]
+        return True
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them. Only the request id and the
+    stage are captured on the calling thread; the message is formatted by
+    the listener.
+    """
+
+    def prepare(self, record):
+        record.request_id = _request_id.get()
+        record.stage = metrics.current_stage()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr('log_records_dropped_total')
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'stage', None):
+            entry['stage'] = record.stage
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        if not getattr(record, 'request_id', None):
+            record.request_id = '-'
+        return super().format(record)
+
+def configure_logging():
+    """
+    Send the root logger's records through the queue to a writer thread on
+    stderr. Safe to call more than once; later calls do nothing.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        target = logging.StreamHandler(sys.stderr)
+        target.setFormatter(JSONFormatter() if LOG_FORMAT == 'json' else TextFormatter(TEXT_FORMAT))
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        handler = ContextQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(LOG_SAMPLE))
+
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+        _listener.start()
+        # Write out what is still queued when the process exits
+        atexit.register(_listener.stop)
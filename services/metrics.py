@@ -0,0 +1,151 @@
+"""
+In-process latency and event metrics, exposed as Prometheus text on /api/metrics.
+
+- span('asr.forward') times a block into the voicebank_stage_duration_seconds
+  histogram and, inside collect_timings(), into that request's breakdown
+- observe() feeds any histogram, incr() counters (cache hits, model loads),
+  set_gauge() point-in-time values (admission queue depths)
+
+Metrics are per process; with several gunicorn workers each one reports its
+own series, so scrape every worker or aggregate by instance.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'voicebank_'
+# Histogram upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HELP = {
+    'stage_duration_seconds': 'Time spent in each voice pipeline stage and sub-step',
+    'http_request_duration_seconds': 'HTTP request latency by endpoint and status',
+    'cache_events_total': 'Cache lookups by cache and result (hit/miss)',
+    'model_loads_total': 'Models loaded, by source (store: memory-mapped from the model store; hf_cache)',
+    'audio_conversions_total': 'Audio conversions by the method that succeeded',
+    'intent_matches_total': 'Intent extractions by the stage that matched (flexible, pattern, keyword or none)',
+    'stage_in_flight': 'Inferences currently running per model stage',
+    'stage_queue_depth': 'Requests waiting for a model stage slot',
+    'admission_rejections_total': 'Requests turned away by admission control',
+    'startup_import_seconds': 'Time taken to import the component at startup',
+    'log_records_dropped_total': 'Log records dropped because the logging queue was full',
+    'asr_decode_budget_exceeded_total': 'Beam searches that ran out of CTC_DECODE_BUDGET and finished greedily',
+}
+
+_lock = threading.Lock()
+# (name, labels) -> [per-bucket counts..., +Inf count, sum]
+_histograms = {}
+_counters = {}
+_gauges = {}
+# Stage timings of the request being processed in this context
+_timings = contextvars.ContextVar('stage_timings', default=None)
+# Innermost span running in this context, for log records
+_stage = contextvars.ContextVar('stage', default=None)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, seconds, **labels):
+    """Add one observation to a latency histogram."""
+    key = _key(name, labels)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(LATENCY_BUCKETS)] += 1
+        series[-1] += seconds
+
+def incr(name, amount=1, **labels):
+    """Increase a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+def record_stage(stage, seconds):
+    """Record time spent in a stage (histogram and current request breakdown)."""
+    observe('stage_duration_seconds', seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def span(stage):
+    """Time a pipeline stage or sub-step, e.g. 'asr' or 'asr.forward'."""
+    token = _stage.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+        _stage.reset(token)
+
+def current_stage():
+    """Name of the innermost span running in this context, or None."""
+    return _stage.get()
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the spans of the enclosed block into a dict of stage -> seconds.
+    An enclosing collect_timings() block receives the same spans as well.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        outer = _timings.get()
+        if outer is not None:
+            for stage, seconds in timings.items():
+                outer[stage] = outer.get(stage, 0.0) + seconds
+
+def timings_ms(timings):
+    """Round a collected breakdown to milliseconds for a JSON response."""
+    return {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: list(series) for key, series in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    for kind, series in (('histogram', histograms), ('counter', counters), ('gauge', gauges)):
+        for name in sorted({name for name, _ in series}):
+            metric = PREFIX + name
+            lines.append(f'# HELP {metric} {HELP.get(name, name)}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for (series_name, labels), value in sorted(series.items()):
+                if series_name != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f'{metric}{_format_labels(labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{metric}_sum{_format_labels(labels)} {value[-1]}')
+                lines.append(f'{metric}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
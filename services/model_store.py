@@ -0,0 +1,173 @@
+"""
+Local artifact store for the Wav2Vec2 speech models.
+
+`python export_models.py` converts each model in LANGUAGE_MODELS once into
+MODEL_STORE_DIR (default data/models), one directory per model:
+
+- model.safetensors: all weights in a single safetensors file
+- the config and processor files (feature extractor and tokenizer)
+- manifest.json: model name, transformers version and the size and
+  SHA-256 of every file
+
+Loading from the store needs no network and no Hugging Face cache. The
+weights are not deserialized: the safetensors file is memory-mapped
+copy-on-write and the model's parameters are views into that mapping.
+Loading is quick, and several worker processes on one machine share the
+same page-cache pages instead of each holding a private copy.
+
+At load the files are checked against the manifest's sizes; set
+MODEL_STORE_VERIFY=1 (or run `python export_models.py --verify`) to check
+the checksums too.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import time
+from services.startup import ModelUnavailable
+
+MODEL_STORE_DIR = os.environ.get('MODEL_STORE_DIR',
+                                 os.path.join(os.path.dirname(__file__), '../data/models'))
+MODEL_STORE_VERIFY = os.environ.get('MODEL_STORE_VERIFY', '0') == '1'
+MANIFEST = 'manifest.json'
+WEIGHTS = 'model.safetensors'
+EXPORT_COMMAND = 'python export_models.py'
+
+# safetensors dtype names -> torch dtype attribute names
+SAFETENSORS_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+
+def artifact_dir(model_name, store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, model_name.replace('/', '--'))
+
+def read_manifest(model_name, store_dir=MODEL_STORE_DIR):
+    """The manifest of an exported model, or None if it has not been exported."""
+    try:
+        with open(os.path.join(artifact_dir(model_name, store_dir), MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def verify(model_name, checksums=False, store_dir=MODEL_STORE_DIR):
+    """Problems with an exported model's files (missing, wrong size or checksum); [] if intact."""
+    manifest = read_manifest(model_name, store_dir)
+    if manifest is None:
+        return ['not exported']
+    directory = artifact_dir(model_name, store_dir)
+    problems = []
+    for name, expected in manifest['files'].items():
+        path = os.path.join(directory, name)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            problems.append(f'{name} is missing')
+            continue
+        if size != expected['size']:
+            problems.append(f"{name} has {size} bytes, expected {expected['size']}")
+        elif checksums and _sha256(path) != expected['sha256']:
+            problems.append(f'{name} does not match its checksum')
+    return problems
+
+def export_model(model_name, store_dir=MODEL_STORE_DIR, overwrite=False):
+    """
+    Convert a model (from the Hugging Face cache, downloading it if needed)
+    into the store. Returns the manifest.
+    """
+    import transformers
+    from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+    target = artifact_dir(model_name, store_dir)
+    if os.path.exists(target) and not overwrite:
+        raise FileExistsError(f'{target} exists, pass overwrite=True to replace it')
+
+    processor = Wav2Vec2Processor.from_pretrained(model_name)
+    model = Wav2Vec2ForCTC.from_pretrained(model_name)
+
+    # Written next to the target and renamed, so a failed export leaves nothing behind
+    os.makedirs(store_dir, exist_ok=True)
+    staging = f'{target}.tmp-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        # One shard: the loader maps a single file
+        model.save_pretrained(staging, safe_serialization=True, max_shard_size='1000GB')
+        processor.save_pretrained(staging)
+        if not os.path.exists(os.path.join(staging, WEIGHTS)):
+            raise RuntimeError(f'save_pretrained did not write {WEIGHTS}')
+        manifest = {
+            'model': model_name,
+            'format': 'safetensors',
+            'transformers': transformers.__version__,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'files': {name: {'size': os.path.getsize(os.path.join(staging, name)),
+                             'sha256': _sha256(os.path.join(staging, name))}
+                      for name in sorted(os.listdir(staging))},
+        }
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+def map_safetensors(path):
+    """
+    A state dict whose tensors are views into a copy-on-write memory
+    mapping of a safetensors file: nothing is read until a tensor is used.
+    """
+    import torch
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = 8 + header_size
+    state = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info['dtype']])
+        begin, end = info['data_offsets']
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        if count == 0:
+            state[name] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        state[name] = torch.frombuffer(mapping, dtype=dtype, count=count,
+                                       offset=data_start + begin).reshape(info['shape'])
+    return state
+
+def load_model(model_name, store_dir=MODEL_STORE_DIR):
+    """
+    Load (processor, model) from the store with the weights memory-mapped.
+    Raises ModelUnavailable when the model is not exported or its files are damaged.
+    """
+    problems = verify(model_name, checksums=MODEL_STORE_VERIFY, store_dir=store_dir)
+    if problems:
+        raise ModelUnavailable(f"{model_name} ({'; '.join(problems)})", EXPORT_COMMAND)
+    import torch
+    from transformers import Wav2Vec2Config, Wav2Vec2ForCTC, Wav2Vec2Processor
+    directory = artifact_dir(model_name, store_dir)
+
+    processor = Wav2Vec2Processor.from_pretrained(directory, local_files_only=True)
+    config = Wav2Vec2Config.from_pretrained(directory, local_files_only=True)
+    # Build the modules without allocating weights, then adopt the mapped tensors
+    with torch.device('meta'):
+        model = Wav2Vec2ForCTC(config)
+    model.load_state_dict(map_safetensors(os.path.join(directory, WEIGHTS)), strict=True, assign=True)
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        raise ModelUnavailable(f'{model_name} (the export does not match this transformers version)',
+                               f'{EXPORT_COMMAND} --force')
+    model.eval()
+    return processor, model
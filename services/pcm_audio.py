@@ -0,0 +1,59 @@
+"""
+Raw PCM uploads, the web client's fast path.
+
+The browser captures mono audio at 16 kHz in an AudioWorklet and uploads the
+samples as little-endian 16-bit PCM (audio_format=pcm_s16le) together with
+their sample_rate. The pipeline then works on the samples directly: no
+temporary file, no pydub/ffmpeg conversion and no audio decoding.
+"""
+
+import os
+import numpy as np
+
+PCM_FORMAT = 'pcm_s16le'
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+# Longest accepted upload
+PCM_MAX_SECONDS = float(os.environ.get('PCM_MAX_SECONDS', 30))
+
+class PCMAudio:
+    """Mono 16-bit PCM samples and their sample rate."""
+
+    def __init__(self, pcm, sample_rate):
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self):
+        return len(self.pcm) / 2 / self.sample_rate
+
+    def samples(self, sample_rate=None):
+        """Float32 samples in [-1, 1], resampled to sample_rate if given."""
+        samples = np.frombuffer(self.pcm, dtype='<i2').astype(np.float32) / 32768.0
+        if sample_rate and sample_rate != self.sample_rate:
+            import librosa
+            samples = librosa.resample(samples, orig_sr=self.sample_rate, target_sr=sample_rate)
+        return samples
+
+def read_pcm(data, sample_rate, channels=1):
+    """
+    Validate an uploaded PCM payload and return it as mono PCMAudio.
+    Raises ValueError with a message for the client.
+    """
+    try:
+        sample_rate = int(sample_rate)
+        channels = int(channels)
+    except (TypeError, ValueError):
+        raise ValueError('sample_rate and channels must be integers')
+    if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        raise ValueError(f'sample_rate must be between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}')
+    if channels not in (1, 2):
+        raise ValueError('Only mono or stereo PCM is supported')
+    if not data or len(data) % (2 * channels):
+        raise ValueError('PCM payload is empty or not whole 16-bit samples')
+    if len(data) / (2 * channels) / sample_rate > PCM_MAX_SECONDS:
+        raise ValueError(f'Recordings are limited to {PCM_MAX_SECONDS:g} seconds')
+    if channels == 2:
+        frames = np.frombuffer(data, dtype='<i2').reshape(-1, 2).astype(np.int32)
+        data = (frames.sum(axis=1) // 2).astype('<i2').tobytes()
+    return PCMAudio(bytes(data), sample_rate)
@@ -0,0 +1,124 @@
+"""
+On-demand cProfile captures of voice requests.
+
+A request is profiled when it carries the admin header
+`X-Profile-Token: <PROFILE_ADMIN_TOKEN>`, or at random with probability
+PROFILE_SAMPLE_RATE (default 0, off). Each capture is stored in
+data/profiles as <id>.prof (pstats format, for snakeviz or pstats) and
+<id>.json (the request's label, duration, stage timings and the top
+functions by cumulative time). Only the newest PROFILE_KEEP captures are
+kept, and the admin endpoints in app.py list and download them.
+
+cProfile only sees the thread it runs in, and one profiler can be active
+per process at a time, so a request that finds the profiler busy simply
+runs unprofiled.
+"""
+
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from services.metrics import collect_timings, timings_ms
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(__file__), '../data/profiles'))
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+# Functions listed in a capture's summary
+SUMMARY_LINES = 40
+
+_profiler_busy = threading.Lock()
+
+def is_admin(headers):
+    """Whether the request carries the profiling admin token."""
+    token = headers.get('X-Profile-Token', '')
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+def should_profile(headers):
+    """Profile this request: requested by an admin or picked by the sample rate."""
+    return is_admin(headers) or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+@contextmanager
+def maybe_profile(enabled, label):
+    """
+    Profile the block if `enabled` and the profiler is free. Yields the
+    capture id, or None when the block is not profiled.
+    """
+    if not enabled or not _profiler_busy.acquire(blocking=False):
+        yield None
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool is active in this process (Python 3.12+)
+        _profiler_busy.release()
+        yield None
+        return
+    profile_id = secrets.token_hex(8)
+    start = time.time()
+    try:
+        with collect_timings() as timings:
+            try:
+                yield profile_id
+            finally:
+                profiler.disable()
+    finally:
+        _profiler_busy.release()
+        _save(profile_id, profiler, {
+            'profile_id': profile_id,
+            'label': label,
+            'started_at': start,
+            'duration_ms': round((time.time() - start) * 1000, 2),
+            'timings': timings_ms(timings),
+        })
+
+def _save(profile_id, profiler, meta):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    meta['summary'] = summary.getvalue()
+    profiler.dump_stats(os.path.join(PROFILE_DIR, f'{profile_id}.prof'))
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    _prune()
+
+def _prune():
+    """Delete all but the newest PROFILE_KEEP captures."""
+    for meta in list_profiles()[PROFILE_KEEP:]:
+        for ext in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{meta['profile_id']}.{ext}"))
+            except FileNotFoundError:
+                pass
+
+def list_profiles():
+    """Metadata of stored captures (without summaries), newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    captures = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta.pop('summary', None)
+        captures.append(meta)
+    return sorted(captures, key=lambda meta: -meta['started_at'])
+
+def profile_path(profile_id, ext='prof'):
+    """Path of a stored capture file, or None if the id is unknown."""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f'{profile_id}.{ext}')
+    return path if os.path.exists(path) else None
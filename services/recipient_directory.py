@@ -0,0 +1,236 @@
+"""
+Recipient directory for money transfers.
+
+Indexes every banking user's name (and each user's saved payees) under three
+keys per name token so a spoken recipient can be resolved with a few dict
+lookups instead of scanning all users:
+
+- the normalized token ("jane")
+- a phonetic key of its Latin transliteration, so the Devanagari "जेन" and
+  the English "jane" both map to "jen"
+- a consonant skeleton of the phonetic key ("jn") for looser matches
+
+Candidates are ranked by how strongly their keys match. A name only
+resolves to a user when the best match is unique and at least phonetic;
+otherwise the caller gets the ranked candidates to offer as suggestions.
+"""
+
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from services.metrics import span, incr
+
+# Scores per key type; an exact token match always beats any phonetic one
+EXACT_SCORE = 4
+PHONETIC_SCORE = 2
+SKELETON_SCORE = 1
+# Extra weight for names the sender saved as payees
+PAYEE_BONUS = 3
+# A recipient is only resolved on at least a phonetic match; skeleton-only
+# matches are returned as suggestions
+MIN_RESOLVE_SCORE = PHONETIC_SCORE
+
+DEVANAGARI_CONSONANTS = {
+    'क': 'k', 'ख': 'kh', 'ग': 'g', 'घ': 'gh', 'ङ': 'n',
+    'च': 'ch', 'छ': 'chh', 'ज': 'j', 'झ': 'jh', 'ञ': 'n',
+    'ट': 't', 'ठ': 'th', 'ड': 'd', 'ढ': 'dh', 'ण': 'n',
+    'त': 't', 'थ': 'th', 'द': 'd', 'ध': 'dh', 'न': 'n',
+    'प': 'p', 'फ': 'ph', 'ब': 'b', 'भ': 'bh', 'म': 'm',
+    'य': 'y', 'र': 'r', 'ल': 'l', 'व': 'v', 'श': 'sh',
+    'ष': 'sh', 'स': 's', 'ह': 'h', 'ळ': 'l'
+}
+DEVANAGARI_VOWELS = {
+    'अ': 'a', 'आ': 'aa', 'इ': 'i', 'ई': 'ee', 'उ': 'u', 'ऊ': 'oo', 'ऋ': 'ri',
+    'ए': 'e', 'ऐ': 'ai', 'ओ': 'o', 'औ': 'au', 'ऑ': 'o', 'ऍ': 'e'
+}
+DEVANAGARI_MATRAS = {
+    'ा': 'aa', 'ि': 'i', 'ी': 'ee', 'ु': 'u', 'ू': 'oo', 'ृ': 'ri',
+    'े': 'e', 'ै': 'ai', 'ो': 'o', 'ौ': 'au', 'ॉ': 'o', 'ॅ': 'e'
+}
+# Nukta forms, after NFD splits them into consonant + nukta
+DEVANAGARI_NUKTA = {'क': 'q', 'ख': 'kh', 'ग': 'g', 'ज': 'z', 'ड': 'r', 'ढ': 'rh', 'फ': 'f'}
+VIRAMA = '्'
+NUKTA = '़'
+NASALS = {'ं': 'n', 'ँ': 'n'}
+VISARGA = 'ः'
+
+# Applied in order to a lowercase Latin token (None: silent-e rule, see phonetic_key)
+PHONETIC_RULES = [
+    (r'([aiou])([^aeiou])e$', None),   # silent final e: "jane" -> "jen", "mike" -> "maik"
+    (r'ph', 'f'),
+    (r'ck', 'k'),
+    (r'q', 'k'),
+    (r'x', 'ks'),
+    (r'c(?=[eiy])', 's'),
+    (r'c(?!h)', 'k'),
+    (r'w', 'v'),
+    (r'z', 'j'),
+    (r'(?<=.)y', 'i'),
+    (r'([bdgjkpt])h', r'\1'),          # drop aspiration: "bh" -> "b"
+    (r'(?<=[aeiou])h(?![aeiou])', ''),  # "john" -> "jon"
+    (r'aa', 'a'),
+    (r'ee', 'i'),
+    (r'oo', 'u'),
+    (r'(.)\1+', r'\1'),
+]
+PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in PHONETIC_RULES]
+MAGIC_E_VOWELS = {'a': 'e', 'i': 'ai', 'o': 'o', 'u': 'u'}
+
+def transliterate(token):
+    """Transliterate a Devanagari token to Latin letters; other scripts pass through."""
+    token = unicodedata.normalize('NFD', token)
+    out = []
+    chars = list(token)
+    i = 0
+    while i < len(chars):
+        ch = chars[i]
+        nxt = chars[i + 1] if i + 1 < len(chars) else ''
+        if ch in DEVANAGARI_CONSONANTS:
+            if nxt == NUKTA:
+                out.append(DEVANAGARI_NUKTA.get(ch, DEVANAGARI_CONSONANTS[ch]))
+                i += 1
+                nxt = chars[i + 1] if i + 1 < len(chars) else ''
+            else:
+                out.append(DEVANAGARI_CONSONANTS[ch])
+            if nxt in DEVANAGARI_MATRAS:
+                out.append(DEVANAGARI_MATRAS[nxt])
+                i += 1
+            elif nxt == VIRAMA:
+                i += 1
+            elif nxt and (nxt in DEVANAGARI_CONSONANTS or nxt in NASALS):
+                # Inherent vowel; dropped at the end of the word (schwa deletion)
+                out.append('a')
+        elif ch in DEVANAGARI_VOWELS:
+            out.append(DEVANAGARI_VOWELS[ch])
+        elif ch in DEVANAGARI_MATRAS:
+            out.append(DEVANAGARI_MATRAS[ch])
+        elif ch in NASALS:
+            out.append(NASALS[ch])
+        elif ch == VISARGA:
+            out.append('h')
+        elif ch != NUKTA:
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+def phonetic_key(token):
+    """Spelling-insensitive key for a Latin token."""
+    key = token.lower()
+    for pattern, replacement in PHONETIC_RULES:
+        if replacement is None:
+            key = pattern.sub(lambda m: MAGIC_E_VOWELS[m.group(1)] + m.group(2), key)
+        else:
+            key = pattern.sub(replacement, key)
+    return key
+
+def skeleton_key(phonetic):
+    """First letter plus the consonants of a phonetic key."""
+    return phonetic[:1] + re.sub(r'[aeiou]', '', phonetic[1:])
+
+def name_tokens(name):
+    """Lowercase word tokens of a name in any script."""
+    name = unicodedata.normalize('NFC', name).lower()
+    return [t for t in re.split(r'[^\wऀ-ॿ]+', name) if t and not t.isdigit()]
+
+@lru_cache(maxsize=65536)
+def token_keys(token):
+    """(exact, phonetic, skeleton) keys for a single name token."""
+    phonetic = phonetic_key(transliterate(token))
+    return token, phonetic, skeleton_key(phonetic)
+
+class RecipientDirectory:
+    """Inverted index from name keys to the users they may refer to."""
+
+    def __init__(self, users, payees=()):
+        """
+        users: iterable of (user_id, record with a 'name').
+        payees: iterable of (owner_id, alias, payee_user_id) saved by users.
+        """
+        self.names = {}
+        self._exact = defaultdict(set)
+        self._phonetic = defaultdict(set)
+        self._skeleton = defaultdict(set)
+        # owner_id -> key -> payee ids, for aliases only the owner can use
+        self._payees = defaultdict(lambda: defaultdict(set))
+        # owner_id -> saved aliases and the payees' names
+        self._payee_names = defaultdict(set)
+
+        for user_id, user in users:
+            self.names[user_id] = user['name']
+            for token in name_tokens(user['name']):
+                exact, phonetic, skeleton = token_keys(token)
+                self._exact[exact].add(user_id)
+                self._phonetic[phonetic].add(user_id)
+                self._skeleton[skeleton].add(user_id)
+
+        for owner_id, alias, payee_id in payees:
+            self._payee_names[owner_id].add(alias)
+            if payee_id in self.names:
+                self._payee_names[owner_id].add(self.names[payee_id])
+            for token in name_tokens(alias):
+                for key in token_keys(token):
+                    self._payees[owner_id][key].add(payee_id)
+
+    def payee_names(self, owner_id):
+        """The aliases a user saved and the names of those payees."""
+        return set(self._payee_names.get(owner_id, ()))
+
+    def lookup(self, spoken_name, owner_id=None, limit=5):
+        """
+        Rank the users a spoken recipient name may refer to.
+        Returns up to `limit` dicts with user_id, name and score, best first.
+        The owner (the sender) is never returned as a candidate.
+        """
+        scores = defaultdict(int)
+        saved = self._payees.get(owner_id, {})
+        for token in name_tokens(spoken_name):
+            exact, phonetic, skeleton = token_keys(token)
+            best = {}
+            for index, key, score in ((self._exact, exact, EXACT_SCORE),
+                                      (self._phonetic, phonetic, PHONETIC_SCORE),
+                                      (self._skeleton, skeleton, SKELETON_SCORE)):
+                for user_id in index.get(key, ()):
+                    best[user_id] = max(best.get(user_id, 0), score)
+            for user_id in set().union(*(saved.get(key, ()) for key in (exact, phonetic, skeleton))):
+                best[user_id] = best.get(user_id, 0) + PAYEE_BONUS
+            for user_id, score in best.items():
+                scores[user_id] += score
+
+        scores.pop(owner_id, None)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [{'user_id': user_id, 'name': self.names.get(user_id, user_id), 'score': score}
+                for user_id, score in ranked]
+
+    def resolve(self, spoken_name, owner_id=None):
+        """
+        Resolve a spoken recipient to one user.
+        Returns (user_id, candidates); user_id is None when nothing matched,
+        the best match is too weak or the best candidates are tied.
+        """
+        candidates = self.lookup(spoken_name, owner_id)
+        if not candidates or candidates[0]['score'] < MIN_RESOLVE_SCORE:
+            return None, candidates
+        if len(candidates) > 1 and candidates[0]['score'] == candidates[1]['score']:
+            return None, candidates
+        return candidates[0]['user_id'], candidates
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+def get_recipient_directory(store):
+    """Get the directory for an account store, rebuilding it only when its users change."""
+    version = store.directory_version()
+    directory = _directories.get(id(store))
+    if directory is None or directory[0] != version:
+        incr('cache_events_total', cache='recipient_directory', result='miss')
+        with _directories_lock:
+            directory = _directories.get(id(store))
+            if directory is None or directory[0] != version:
+                with span('db.build_directory'):
+                    directory = (version, RecipientDirectory(store.iter_users(), store.iter_payees()))
+                _directories[id(store)] = directory
+    else:
+        incr('cache_events_total', cache='recipient_directory', result='hit')
+    return directory[1]
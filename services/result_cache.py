@@ -0,0 +1,86 @@
+"""
+Short-lived caches for resubmitted voice requests.
+
+Client retries after a timeout, double clicks and IVR redeliveries send the
+same audio again. The pipeline keys its expensive results by a hash of the
+audio content, so a repeat skips the work:
+
+- voiceprint_scores: the voice authentication result per audio, user and
+  voiceprint version (re-enrolling starts fresh)
+- transcripts: the recognized text per audio and language
+
+Money transfers are not cached this way. They carry an idempotency key (the
+client's Idempotency-Key, or the audio hash) that the account store records
+with the transfer, so a repeat on any worker returns the first transfer's
+result instead of moving the money again.
+
+Entries expire after RESULT_CACHE_TTL seconds and each cache holds at most
+RESULT_CACHE_SIZE of them, evicting the least recently used. The caches are
+per process.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from services.metrics import incr
+from services.pcm_audio import PCMAudio
+
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', 120))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+
+class TTLCache:
+    """Thread-safe mapping whose entries expire, bounded by evicting the least recently used."""
+
+    def __init__(self, name, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The cached value, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            elif entry is not None:
+                self._entries.move_to_end(key)
+        incr('cache_events_total', cache=self.name, result='miss' if entry is None else 'hit')
+        return None if entry is None else entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+voiceprint_scores = TTLCache('voiceprint_score')
+transcripts = TTLCache('transcript')
+
+def audio_digest(audio):
+    """Hash of an uploaded audio file's bytes, or of PCMAudio's samples and rate."""
+    digest = hashlib.sha256()
+    if isinstance(audio, PCMAudio):
+        digest.update(f'pcm:{audio.sample_rate}:'.encode())
+        digest.update(audio.pcm)
+    else:
+        digest.update(b'file:')
+        with open(audio, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,91 @@
+"""
+Signed, expiring session tokens.
+
+A token is issued at login and carries the user's profile (without the
+password hash), so voice requests are authorized by checking an HMAC
+signature instead of re-reading the user database. Tokens are
+"<payload>.<signature>", both base64url encoded; the payload is JSON with
+the user id ('sub'), expiry time ('exp') and the profile ('user').
+
+The signing key comes from the SESSION_SECRET environment variable. If it
+is not set, a random key is generated once and kept in data/session_secret
+so all workers of one deployment accept each other's tokens.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+SECRET_PATH = os.path.join(os.path.dirname(__file__), '../data/session_secret')
+# Session lifetime in seconds
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 3600))
+
+_secret = None
+
+def _load_secret():
+    """Signing key from the environment, or the deployment's generated key."""
+    global _secret
+    if _secret is None:
+        if os.environ.get('SESSION_SECRET'):
+            _secret = os.environ['SESSION_SECRET'].encode('utf-8')
+        else:
+            _secret = _read_or_create_secret(SECRET_PATH)
+    return _secret
+
+def _read_or_create_secret(path):
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # link() fails if another worker created the key first; theirs wins
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'r') as f:
+        return f.read().strip().encode('utf-8')
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(payload):
+    return _b64encode(hmac.new(_load_secret(), payload.encode('ascii'), hashlib.sha256).digest())
+
+def issue_session_token(user, ttl=None):
+    """Issue a token for an authenticated user. Returns (token, expires_at)."""
+    expires_at = int(time.time()) + (ttl or SESSION_TTL)
+    profile = {k: v for k, v in user.items() if k != 'password_hash'}
+    payload = _b64encode(json.dumps(
+        {'sub': str(user['id']), 'exp': expires_at, 'user': profile},
+        separators=(',', ':')).encode('utf-8'))
+    return f"{payload}.{_sign(payload)}", expires_at
+
+def verify_session_token(token):
+    """Return the user profile carried by a valid, unexpired token, or None."""
+    if not token or token.count('.') != 1:
+        return None
+    payload, signature = token.split('.')
+    try:
+        if not hmac.compare_digest(_sign(payload), signature):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims.get('user')
+
+def session_key(token):
+    """A stable identifier of a token's session that is safe to keep in server state."""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
@@ -0,0 +1,214 @@
+"""
+Node-wide cache shared by every worker process: voiceprints and user records.
+
+Each gunicorn worker otherwise warms its own copy. With the shared cache,
+the first worker to load a voiceprint or user stores it once for the
+whole node, and the other workers read it from there.
+
+Entries are version-stamped in two ways:
+
+- a generation per key: writers call invalidate() after changing the
+  source (enroll_user_voice, update_user_language). store() only succeeds
+  if the generation the reader saw is still current, so a reader that
+  loaded the data before a write cannot put the old value back
+- a source stamp (file mtime and size, or the users.json identity): an
+  entry is ignored when the source changed behind the cache's back, e.g.
+  a script rewrote the file
+
+Backends (SHARED_CACHE):
+
+- shm (default where /dev/shm exists): a SQLite database on tmpfs,
+  shared by all processes on the node
+- memory: a per-process dict, a stand-in for tests and single workers
+- none: disabled
+
+Another node-local service (e.g. Redis) can be plugged in by implementing
+generation/lookup/store/invalidate and registering it in BACKENDS.
+SHARED_CACHE_ENTRIES bounds the cached values; the oldest are dropped first.
+
+Decoding an entry can cost more than reading it (a voiceprint becomes a
+GaussianMixture). read_through() takes an optional per-process cache of
+decoded values in front of the shared one, keyed by the entry's generation
+and stamp, so a repeat read only looks up the generation.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from services.metrics import incr
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SHARED_CACHE = os.environ.get('SHARED_CACHE', 'shm' if os.path.isdir('/dev/shm') else 'memory').lower()
+SHARED_CACHE_ENTRIES = int(os.environ.get('SHARED_CACHE_ENTRIES', 100000))
+# One cache per data directory, so separate checkouts on a node do not mix
+SHARED_CACHE_PATH = os.environ.get('SHARED_CACHE_PATH', os.path.join(SHM_DIR, 'voicebank-{}.db'.format(
+    hashlib.sha1(os.path.abspath(os.path.join(os.path.dirname(__file__), '../data')).encode()).hexdigest()[:12])))
+# Stores between checks of the entry bound
+EVICT_EVERY = 256
+
+class MemorySharedCache:
+    """Per-process stand-in with the same semantics."""
+
+    def __init__(self, max_entries=SHARED_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}
+        # Keys that have a value, oldest store first
+        self._cached = OrderedDict()
+        self._lock = threading.Lock()
+
+    def generation(self, key):
+        with self._lock:
+            return self._entries.get(key, (0,))[0]
+
+    def lookup(self, key):
+        """(generation, stamp, value); value is None on a miss."""
+        with self._lock:
+            return self._entries.get(key, (0, None, None))
+
+    def store(self, key, generation, stamp, value):
+        """Store a value loaded at `generation`; skipped if the key was invalidated since."""
+        with self._lock:
+            if self._entries.get(key, (0,))[0] != generation:
+                return False
+            self._entries[key] = (generation, stamp, value)
+            self._cached.pop(key, None)
+            self._cached[key] = True
+            while len(self._cached) > self.max_entries:
+                old = self._cached.popitem(last=False)[0]
+                self._entries[old] = (self._entries[old][0], None, None)
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries[key] = (self._entries.get(key, (0,))[0] + 1, None, None)
+            self._cached.pop(key, None)
+
+class SQLiteSharedCache:
+    """Entries in a SQLite database on tmpfs, shared by every process on the node."""
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_entries=SHARED_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._stores = 0
+        # User records include password hashes: readable by this account only
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                stamp TEXT,
+                value BLOB,
+                stored_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_stored ON entries (stored_at) WHERE value IS NOT NULL;
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection must not be used across fork (gunicorn --preload)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # A cache in memory: nothing to make durable
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def generation(self, key):
+        row = self._conn().execute('SELECT generation FROM entries WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def lookup(self, key):
+        row = self._conn().execute('SELECT generation, stamp, value FROM entries WHERE key = ?',
+                                   (key,)).fetchone()
+        return row if row else (0, None, None)
+
+    def store(self, key, generation, stamp, value):
+        conn = self._conn()
+        cursor = conn.execute(
+            'INSERT INTO entries (key, generation, stamp, value, stored_at) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET stamp = excluded.stamp, value = excluded.value, '
+            'stored_at = excluded.stored_at WHERE entries.generation = excluded.generation',
+            (key, generation, stamp, value, time.time()))
+        self._stores += 1
+        if self._stores % EVICT_EVERY == 0:
+            # Values are dropped but generations kept, so invalidations are never lost
+            conn.execute(
+                'UPDATE entries SET stamp = NULL, value = NULL WHERE key IN ('
+                'SELECT key FROM entries WHERE value IS NOT NULL ORDER BY stored_at '
+                'LIMIT max((SELECT COUNT(*) FROM entries WHERE value IS NOT NULL) - ?, 0))',
+                (self.max_entries,))
+        return cursor.rowcount > 0
+
+    def invalidate(self, key):
+        self._conn().execute(
+            'INSERT INTO entries (key, generation) VALUES (?, 1) '
+            'ON CONFLICT(key) DO UPDATE SET generation = generation + 1, stamp = NULL, value = NULL',
+            (key,))
+
+BACKENDS = {
+    'shm': SQLiteSharedCache,
+    'memory': MemorySharedCache,
+}
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache():
+    """The configured backend, or None when SHARED_CACHE=none."""
+    global _shared_cache
+    if _shared_cache is None and SHARED_CACHE in BACKENDS:
+        with _shared_cache_lock:
+            if _shared_cache is None:
+                _shared_cache = BACKENDS[SHARED_CACHE]()
+    return _shared_cache
+
+def read_through(namespace, key, stamp, load, encode, decode, local=None):
+    """
+    The value of namespace:key from the shared cache if it is current for
+    `stamp`, otherwise load() it and store it encoded (bytes) for the other
+    workers. None results are not cached. `local` (a result_cache.TTLCache)
+    keeps the decoded values in this process.
+    """
+    cache = get_shared_cache()
+    if cache is None:
+        return load()
+    full_key = f'{namespace}:{key}'
+    try:
+        if local is not None:
+            result = local.get((key, cache.generation(full_key), stamp))
+            if result is not None:
+                return result
+        generation, cached_stamp, value = cache.lookup(full_key)
+    except sqlite3.Error:
+        incr('cache_events_total', cache=f'shared_{namespace}', result='error')
+        return load()
+    if value is not None and cached_stamp == stamp:
+        incr('cache_events_total', cache=f'shared_{namespace}', result='hit')
+        result = decode(value)
+    else:
+        incr('cache_events_total', cache=f'shared_{namespace}', result='miss')
+        result = load()
+        if result is not None:
+            try:
+                cache.store(full_key, generation, stamp, encode(result))
+            except sqlite3.Error:
+                pass
+    if result is not None and local is not None:
+        local.put((key, generation, stamp), result)
+    return result
+
+def invalidate(namespace, key):
+    """Drop namespace:key on every worker; call after changing its source."""
+    cache = get_shared_cache()
+    if cache is not None:
+        try:
+            cache.invalidate(f'{namespace}:{key}')
+        except sqlite3.Error:
+            incr('cache_events_total', cache=f'shared_{namespace}', result='error')
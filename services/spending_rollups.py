@@ -0,0 +1,108 @@
+"""
+Incrementally maintained spending aggregates.
+
+Every recorded transaction is added to a daily and a monthly bucket of its
+user, split by transaction type and (for money going out) by counterparty.
+A summary over any date range then combines at most a few dozen buckets
+(whole months plus the days at either end) instead of scanning the history.
+"""
+
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+# Transaction types that count as spending
+SPENDING_TYPES = ('withdrawal', 'transfer_out', 'payment')
+
+def month_key(tx_date):
+    """Monthly bucket key of a YYYY-MM-DD date; daily buckets use the date itself."""
+    return tx_date[:7]
+
+def period_keys(start, end):
+    """
+    Bucket keys covering start..end (inclusive YYYY-MM-DD strings): daily keys
+    for partial months at either end, monthly keys for the whole months between.
+    """
+    first = datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.strptime(end, '%Y-%m-%d').date()
+    keys = []
+    current = first
+    while current <= last:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        if current.day == 1 and next_month - timedelta(days=1) <= last:
+            keys.append(current.strftime('%Y-%m'))
+            current = next_month
+        else:
+            keys.append(current.strftime('%Y-%m-%d'))
+            current += timedelta(days=1)
+    return keys
+
+def period_range(period, today=None):
+    """
+    Translate a spending_summary period into (start, end, label).
+    Supported: today, last_week (the last 7 days), this_month, last_month.
+    """
+    today = today or date.today()
+    if period == 'today':
+        start, label = today, 'today'
+    elif period == 'last_week':
+        start, label = today - timedelta(days=6), 'in the last week'
+    elif period == 'last_month':
+        end = today.replace(day=1) - timedelta(days=1)
+        return end.replace(day=1).isoformat(), end.isoformat(), 'last month'
+    else:
+        start, label = today.replace(day=1), 'this month'
+    return start.isoformat(), today.isoformat(), label
+
+def empty_summary():
+    return {'spent': 0.0, 'received': 0.0, 'count': 0, 'by_type': {}, 'by_counterparty': {}}
+
+def add_to_summary(summary, tx_type, counterparty, amount, count):
+    """Fold one (type, counterparty) aggregate into a summary dict."""
+    by_type = summary['by_type'].setdefault(tx_type, {'amount': 0.0, 'count': 0})
+    by_type['amount'] += amount
+    by_type['count'] += count
+    summary['count'] += count
+    if tx_type in SPENDING_TYPES:
+        summary['spent'] += amount
+        if counterparty:
+            summary['by_counterparty'][counterparty] = summary['by_counterparty'].get(counterparty, 0.0) + amount
+    else:
+        summary['received'] += amount
+
+def finish_summary(summary, start, end):
+    """Round totals and order counterparties by amount spent."""
+    summary['spent'] = round(summary['spent'], 2)
+    summary['received'] = round(summary['received'], 2)
+    for entry in summary['by_type'].values():
+        entry['amount'] = round(entry['amount'], 2)
+    summary['by_counterparty'] = dict(sorted(
+        ((name, round(amount, 2)) for name, amount in summary['by_counterparty'].items()),
+        key=lambda item: -item[1]))
+    summary['start'] = start
+    summary['end'] = end
+    return summary
+
+class SpendingRollups:
+    """In-memory rollups for the JSON account store."""
+
+    def __init__(self):
+        # user_id -> bucket key -> (type, counterparty) -> [amount, count]
+        self._buckets = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: [0.0, 0])))
+
+    def record(self, user_id, tx):
+        """Add one transaction to its day and month buckets."""
+        counterparty = tx.get('counterparty') if tx['type'] in SPENDING_TYPES else None
+        user_buckets = self._buckets[str(user_id)]
+        for key in (tx['date'], month_key(tx['date'])):
+            aggregate = user_buckets[key][(tx['type'], counterparty)]
+            aggregate[0] += tx['amount']
+            aggregate[1] += 1
+
+    def summary(self, user_id, start, end):
+        """Spending summary for start..end (inclusive YYYY-MM-DD)."""
+        result = empty_summary()
+        user_buckets = self._buckets.get(str(user_id), {})
+        for key in period_keys(start, end):
+            for (tx_type, counterparty), (amount, count) in user_buckets.get(key, {}).items():
+                add_to_summary(result, tx_type, counterparty, amount, count)
+        return finish_summary(result, start, end)
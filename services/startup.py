@@ -0,0 +1,155 @@
+"""
+Startup checks for the model-backed pipeline stages.
+
+The heavy libraries (torch, transformers, librosa, scikit-learn, spaCy) are
+imported by the stage that needs them, so importing the web app takes well
+under a second and text-only or admin workers never load them. Models are
+never downloaded while serving a request; instead check_startup() runs once
+when app.py or voice_worker.py starts and raises StartupError, listing every
+missing model and how to install it.
+
+Settings:
+- REQUIRED_MODELS: comma-separated stages checked at startup (default 'intent';
+  'none' for text-only and admin workers)
+    intent      spaCy models of models/intent_recognition.py
+    asr         local Wav2Vec2 models for ASR_LANGUAGES
+    biometrics  librosa and scikit-learn
+- ASR_LANGUAGES: languages whose speech model is required (default hi-IN,ta-IN)
+- PRELOAD_MODELS=1: also load the required models, so the first request does not wait
+- IMPORT_BUDGET: seconds importing the web app may take before a warning (default 1.0)
+
+check_models.py reports the same checks, downloads missing models and
+measures the import time.
+"""
+
+import importlib.util
+import logging
+import os
+import re
+import sys
+from services import metrics
+
+REQUIRED_MODELS = [stage.strip() for stage in os.environ.get('REQUIRED_MODELS', 'intent').split(',')
+                   if stage.strip() and stage.strip() != 'none']
+ASR_LANGUAGES = [language.strip() for language in os.environ.get('ASR_LANGUAGES', 'hi-IN,ta-IN').split(',')
+                 if language.strip()]
+PRELOAD_MODELS = os.environ.get('PRELOAD_MODELS', '0') == '1'
+IMPORT_BUDGET = float(os.environ.get('IMPORT_BUDGET', 1.0))
+# Modules that should only be imported by the stage that uses them
+HEAVY_MODULES = ('torch', 'transformers', 'librosa', 'sklearn', 'spacy')
+
+logger = logging.getLogger(__name__)
+
+class ModelUnavailable(Exception):
+    """Raised when a model is not installed locally; `install` is the command that installs it."""
+
+    def __init__(self, model, install):
+        super().__init__(f'Model {model} is not installed, install it with: {install}')
+        self.model = model
+        self.install = install
+
+class StartupError(Exception):
+    """Raised by check_startup() with every problem found."""
+
+def _spacy_models():
+    from models.intent_recognition import LANGUAGE_MODELS
+    return sorted(set(LANGUAGE_MODELS.values()))
+
+def _asr_models():
+    from models.speech_recognition import LANGUAGE_MODELS
+    return sorted({LANGUAGE_MODELS.get(language, LANGUAGE_MODELS['default']) for language in ASR_LANGUAGES})
+
+def _hf_cached(model_name):
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        return False
+    return isinstance(try_to_load_from_cache(model_name, 'config.json'), str)
+
+def model_status(stages):
+    """
+    Installation status of the models behind each stage, as a list of
+    {'stage', 'model', 'installed', 'install'} dicts. Does not load anything.
+    """
+    status = []
+    for stage in stages:
+        if stage == 'intent':
+            for name in _spacy_models():
+                status.append({'stage': stage, 'model': name,
+                               'installed': importlib.util.find_spec(name) is not None,
+                               'install': f'python -m spacy download {name}'})
+        elif stage == 'asr':
+            from services.model_store import read_manifest
+            for name in _asr_models():
+                status.append({'stage': stage, 'model': name,
+                               'installed': read_manifest(name) is not None or _hf_cached(name),
+                               'install': 'python export_models.py'})
+        elif stage == 'biometrics':
+            for name in ('librosa', 'sklearn'):
+                status.append({'stage': stage, 'model': name,
+                               'installed': importlib.util.find_spec(name) is not None,
+                               'install': 'pip install -r requirements.txt'})
+        else:
+            raise StartupError(f'Unknown stage in REQUIRED_MODELS: {stage}')
+    return status
+
+def check_intent_patterns():
+    """Problems in config/intent_patterns.json (unreadable file or invalid regexes)."""
+    from models.intent_recognition import get_intent_patterns
+    try:
+        intent_patterns = get_intent_patterns()
+    except (OSError, ValueError) as e:
+        return [f'Cannot read intent patterns: {e}']
+    problems = []
+    for language, intents in intent_patterns.items():
+        for intent, config in intents.items():
+            for pattern in config['patterns']:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    problems.append(f'Invalid {language} pattern for {intent} {pattern!r}: {e}')
+    return problems
+
+def preload(stages):
+    """Load the models behind the stages into this process's caches."""
+    if 'intent' in stages:
+        from models.intent_recognition import LANGUAGE_MODELS, load_nlp_model
+        for language in LANGUAGE_MODELS:
+            load_nlp_model(language)
+    if 'asr' in stages:
+        from models.speech_recognition import get_model_and_processor
+        for language in ASR_LANGUAGES:
+            get_model_and_processor(language)
+    if 'biometrics' in stages:
+        import librosa
+        import sklearn.mixture
+
+def check_startup(stages=None, load=None):
+    """
+    The startup phase: verify (and with PRELOAD_MODELS=1 load) the models of
+    the required stages. Raises StartupError listing everything missing.
+    """
+    stages = REQUIRED_MODELS if stages is None else stages
+    load = PRELOAD_MODELS if load is None else load
+    problems = check_intent_patterns() if 'intent' in stages else []
+    problems += [f"{item['stage']}: model {item['model']} is not installed, install it with: {item['install']}"
+                 for item in model_status(stages) if not item['installed']]
+    if not problems and load:
+        with metrics.span('startup.preload'):
+            try:
+                preload(stages)
+            except (ModelUnavailable, ImportError) as e:
+                problems.append(str(e))
+    if problems:
+        raise StartupError('Startup checks failed:\n  ' + '\n  '.join(problems))
+
+def heavy_modules_loaded():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+def record_import_time(component, seconds):
+    """Report how long a component took to import and warn when it is over IMPORT_BUDGET."""
+    metrics.set_gauge('startup_import_seconds', round(seconds, 4), component=component)
+    heavy = heavy_modules_loaded()
+    if seconds > IMPORT_BUDGET or heavy:
+        logger.warning("Importing %s took %.2fs (budget %.2fs), heavy modules loaded: %s",
+                       component, seconds, IMPORT_BUDGET, ', '.join(heavy) or 'none')
@@ -0,0 +1,453 @@
+"""
+Storage backends for the banking and user services.
+
+The default backend ('json') keeps the original files: data/users.json for
+login profiles and the journaled data/mock_db.json for banking data
+(see banking_service.AccountStore). Setting BANKING_STORAGE=sqlite switches
+both services to a single SQLite database (data/bank.db) with normalized
+tables; migrate_to_sqlite.py imports the existing JSON files into it.
+
+Both banking backends provide the same methods: get_user, get_accounts,
+iter_users, iter_payees, directory_version, transaction_page,
+spending_summary, transfer and transfer_batch.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from services.banking_service import IDEMPOTENCY_TTL, TransferError
+from services.spending_rollups import (SPENDING_TYPES, add_to_summary, empty_summary,
+                                       finish_summary, month_key, period_keys)
+
+# 'json' or 'sqlite'
+STORAGE_BACKEND = os.environ.get('BANKING_STORAGE', 'json').lower()
+
+# Path to the SQLite database
+SQLITE_PATH = os.environ.get('BANKING_SQLITE_PATH',
+                             os.path.join(os.path.dirname(__file__), '../data/bank.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    username TEXT UNIQUE,
+    password_hash TEXT,
+    email TEXT,
+    phone TEXT,
+    language TEXT
+);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users(id),
+    account_type TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    balance REAL NOT NULL,
+    currency TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_accounts_user ON accounts (user_id, position);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id TEXT NOT NULL,
+    user_id TEXT NOT NULL REFERENCES users(id),
+    type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    date TEXT NOT NULL,
+    description TEXT,
+    counterparty TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date);
+
+-- Daily (YYYY-MM-DD) and monthly (YYYY-MM) totals per type and counterparty,
+-- updated with every inserted transaction
+CREATE TABLE IF NOT EXISTS spending_rollups (
+    user_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    type TEXT NOT NULL,
+    counterparty TEXT NOT NULL DEFAULT '',
+    amount REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, period, type, counterparty)
+);
+
+-- Transfers applied with an idempotency key, and the sender's balance after them
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    new_balance REAL NOT NULL,
+    applied_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_applied ON idempotency_keys (applied_at);
+
+CREATE TABLE IF NOT EXISTS payees (
+    owner_id TEXT NOT NULL REFERENCES users(id),
+    alias TEXT NOT NULL,
+    payee_id TEXT NOT NULL,
+    PRIMARY KEY (owner_id, alias)
+);
+"""
+
+PROFILE_FIELDS = ('id', 'username', 'password_hash', 'name', 'email', 'phone', 'language')
+TRANSACTION_FIELDS = ('transaction_id', 'type', 'amount', 'date', 'description', 'counterparty')
+
+class SQLiteStore:
+    """
+    SQLite storage for login profiles, accounts and transactions.
+    Uses WAL mode so readers in other workers are not blocked by a transfer.
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(accounts)')}
+        if 'version' not in columns:
+            # Databases created before account versions were added
+            conn.execute('ALTER TABLE accounts ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+        if not conn.execute('SELECT 1 FROM spending_rollups LIMIT 1').fetchone():
+            # Databases created before rollups were added (a no-op when empty)
+            with self._transaction() as tx_conn:
+                _backfill_rollups(tx_conn)
+
+    def _conn(self):
+        """One connection per thread; sqlite3 connections cannot be shared across threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run the block as one write transaction (BEGIN IMMEDIATE takes the write lock up front)."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    # Banking data
+
+    def get_user(self, user_id):
+        """Return {'id', 'name', 'accounts'} for a user, or None."""
+        conn = self._conn()
+        row = conn.execute('SELECT id, name FROM users WHERE id = ?', (str(user_id),)).fetchone()
+        if not row:
+            return None
+        accounts = {}
+        for acc in conn.execute(
+                'SELECT account_type, account_id, balance, currency FROM accounts '
+                'WHERE user_id = ? ORDER BY position', (row['id'],)):
+            accounts[acc['account_type']] = {
+                'account_id': acc['account_id'],
+                'balance': acc['balance'],
+                'currency': acc['currency']
+            }
+        return {'id': row['id'], 'name': row['name'], 'accounts': accounts}
+
+    def get_accounts(self, user_id):
+        """Return a user's accounts; a single SELECT is already a consistent snapshot."""
+        user = self.get_user(user_id)
+        return user['accounts'] if user else None
+
+    def iter_users(self):
+        """Return a list of (user_id, {'id', 'name'}) pairs."""
+        rows = self._conn().execute('SELECT id, name FROM users ORDER BY rowid')
+        return [(row['id'], {'id': row['id'], 'name': row['name']}) for row in rows]
+
+    def iter_payees(self):
+        """Return (owner_id, alias, payee_id) for every payee users have saved."""
+        rows = self._conn().execute('SELECT owner_id, alias, payee_id FROM payees')
+        return [(row['owner_id'], row['alias'], row['payee_id']) for row in rows]
+
+    def directory_version(self):
+        """Changes whenever users or payees are added."""
+        row = self._conn().execute(
+            'SELECT (SELECT MAX(rowid) FROM users), (SELECT MAX(rowid) FROM payees)').fetchone()
+        return tuple(row)
+
+    def spending_summary(self, user_id, start, end):
+        """Spending totals for start..end (inclusive YYYY-MM-DD) from the rollup table."""
+        keys = period_keys(start, end)
+        placeholders = ', '.join('?' * len(keys))
+        rows = self._conn().execute(
+            f'SELECT type, counterparty, SUM(amount) AS amount, SUM(count) AS count FROM spending_rollups '
+            f'WHERE user_id = ? AND period IN ({placeholders}) GROUP BY type, counterparty',
+            [str(user_id)] + keys)
+        summary = empty_summary()
+        for row in rows:
+            add_to_summary(summary, row['type'], row['counterparty'], row['amount'], row['count'])
+        return finish_summary(summary, start, end)
+
+    def transaction_page(self, user_id, limit=20, before=None, since=None, until=None):
+        """
+        Return (transactions newest first, cursor for the next older page or None).
+        Cursors are "date:seq" of the last row returned, so every page is one
+        range scan of the (user_id, date) index.
+        """
+        query = 'SELECT * FROM transactions WHERE user_id = ?'
+        params = [str(user_id)]
+        if before is not None:
+            date, seq = before.rsplit(':', 1)
+            query += ' AND (date < ? OR (date = ? AND seq < ?))'
+            params += [date, date, int(seq)]
+        if since is not None:
+            query += ' AND date >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND date <= ?'
+            params.append(until)
+        query += ' ORDER BY date DESC, seq DESC LIMIT ?'
+        params.append(limit + 1)
+        rows = self._conn().execute(query, params).fetchall()
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            return [_transaction_from_row(row) for row in rows[:limit]], f"{last['date']}:{last['seq']}"
+        return [_transaction_from_row(row) for row in rows], None
+
+    def transfer(self, sender_id, recipient_id, amount, sender_record, recipient_record, idempotency_key=None):
+        """
+        Move `amount` between the first accounts of two users and record both
+        transaction entries in a single database transaction.
+        Returns the sender's new balance.
+        """
+        result = self.transfer_batch([{
+            'sender_id': sender_id,
+            'recipient_id': recipient_id,
+            'amount': amount,
+            'sender_record': sender_record,
+            'recipient_record': recipient_record,
+            'idempotency_key': idempotency_key
+        }])[0]
+        if not result['success']:
+            raise TransferError(result['error'])
+        return result['new_balance']
+
+    def transfer_batch(self, transfers, atomic=True):
+        """
+        Apply a list of transfers (dicts with the arguments of transfer()) in
+        one database transaction, so the whole batch costs a single commit.
+        With atomic=True one failure rolls back the batch; otherwise failed
+        items are skipped. Returns one result dict per transfer. A transfer
+        whose 'idempotency_key' was already applied is skipped and reported
+        with 'replayed': True.
+        """
+        results = []
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                if any(t.get('idempotency_key') for t in transfers):
+                    conn.execute('DELETE FROM idempotency_keys WHERE applied_at < ?', (now - IDEMPOTENCY_TTL,))
+                for t in transfers:
+                    t = dict(t)
+                    key = t.pop('idempotency_key', None)
+                    applied = key and conn.execute('SELECT new_balance FROM idempotency_keys WHERE key = ?',
+                                                   (key,)).fetchone()
+                    if applied:
+                        # A repeat of a transfer that already moved the money
+                        results.append({'success': True, 'new_balance': applied['new_balance'], 'replayed': True})
+                        continue
+                    try:
+                        new_balance = _apply_transfer(conn, **t)
+                    except TransferError as e:
+                        results.append({'success': False, 'error': str(e)})
+                        if atomic:
+                            raise
+                        continue
+                    if key:
+                        conn.execute('INSERT INTO idempotency_keys (key, new_balance, applied_at) VALUES (?, ?, ?)',
+                                     (key, new_balance, now))
+                    results.append({'success': True, 'new_balance': new_balance})
+        except TransferError:
+            results += [{'success': False, 'error': 'Batch rolled back'}] * (len(transfers) - len(results))
+            # Replayed transfers were applied by an earlier request and stay reported as such
+            return [r if not r['success'] or r.get('replayed') else {'success': False, 'error': 'Batch rolled back'}
+                    for r in results]
+        return results
+
+    def import_banking_user(self, user, transactions):
+        """Insert or replace a banking user with its accounts and oldest-first transactions."""
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO users (id, name) VALUES (?, ?) '
+                         'ON CONFLICT(id) DO UPDATE SET name = excluded.name',
+                         (str(user['id']), user['name']))
+            conn.execute('DELETE FROM accounts WHERE user_id = ?', (str(user['id']),))
+            conn.execute('DELETE FROM transactions WHERE user_id = ?', (str(user['id']),))
+            conn.execute('DELETE FROM spending_rollups WHERE user_id = ?', (str(user['id']),))
+            for position, (acc_type, acc) in enumerate(user['accounts'].items()):
+                conn.execute(
+                    'INSERT INTO accounts (account_id, user_id, account_type, position, balance, currency) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (acc['account_id'], str(user['id']), acc_type, position, acc['balance'], acc['currency']))
+            for tx in transactions:
+                _insert_transaction(conn, user['id'], tx)
+            conn.execute('DELETE FROM payees WHERE owner_id = ?', (str(user['id']),))
+            for alias, payee_id in user.get('payees', {}).items():
+                conn.execute('INSERT INTO payees (owner_id, alias, payee_id) VALUES (?, ?, ?)',
+                             (str(user['id']), alias, str(payee_id)))
+
+    def bulk_import(self, users, profiles=None):
+        """
+        Insert new banking users (with accounts and oldest-first transactions)
+        and their login profiles in one transaction. For bulk loads into a
+        fresh database: ids must not exist yet, and spending rollups are only
+        built by rebuild_rollups() afterwards.
+        """
+        profiles = profiles or {}
+        user_rows, account_rows, transaction_rows = [], [], []
+        for user in users:
+            user_id = str(user['id'])
+            profile = profiles.get(user_id, {})
+            user_rows.append((user_id, user['name'], profile.get('username'), profile.get('password_hash'),
+                              profile.get('email'), profile.get('phone'), profile.get('language')))
+            for position, (acc_type, acc) in enumerate(user['accounts'].items()):
+                account_rows.append((acc['account_id'], user_id, acc_type, position, acc['balance'], acc['currency']))
+            for tx in user['transactions']:
+                transaction_rows.append((tx['transaction_id'], user_id, tx['type'], tx['amount'], tx['date'],
+                                         tx.get('description'), tx.get('counterparty')))
+        with self._transaction() as conn:
+            conn.executemany('INSERT INTO users (id, name, username, password_hash, email, phone, language) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', user_rows)
+            conn.executemany('INSERT INTO accounts (account_id, user_id, account_type, position, balance, currency) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', account_rows)
+            conn.executemany('INSERT INTO transactions (transaction_id, user_id, type, amount, date, description, '
+                             'counterparty) VALUES (?, ?, ?, ?, ?, ?, ?)', transaction_rows)
+
+    def rebuild_rollups(self):
+        """Recompute the spending rollups from the transactions table (after bulk_import)."""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM spending_rollups')
+            _backfill_rollups(conn)
+
+    # Login profiles
+
+    def get_profile(self, user_id):
+        row = self._conn().execute(
+            'SELECT * FROM users WHERE id = ? AND username IS NOT NULL', (str(user_id),)).fetchone()
+        return _profile_from_row(row)
+
+    def get_profile_by_username(self, username):
+        row = self._conn().execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        return _profile_from_row(row)
+
+    def create_profile(self, profile):
+        """
+        Insert a login profile, allocating the next numeric id if it has none.
+        Returns the user id, or None if the username is taken.
+        """
+        with self._transaction() as conn:
+            user_id = profile.get('id')
+            owner = conn.execute('SELECT id FROM users WHERE username = ?', (profile['username'],)).fetchone()
+            if owner and owner['id'] != str(user_id):
+                return None
+            if not user_id:
+                row = conn.execute('SELECT MAX(CAST(id AS INTEGER)) FROM users').fetchone()
+                user_id = str((row[0] or 0) + 1)
+            values = dict(profile, id=str(user_id))
+            conn.execute(
+                'INSERT INTO users (id, username, password_hash, name, email, phone, language) '
+                'VALUES (:id, :username, :password_hash, :name, :email, :phone, :language) '
+                'ON CONFLICT(id) DO UPDATE SET username = excluded.username, '
+                'password_hash = excluded.password_hash, name = excluded.name, email = excluded.email, '
+                'phone = excluded.phone, language = excluded.language',
+                {field: values.get(field) for field in PROFILE_FIELDS})
+            return values['id']
+
+    def update_profile(self, user_id, **fields):
+        """Update profile fields. Returns False if the user does not exist."""
+        assignments = ', '.join(f'{field} = ?' for field in fields if field in PROFILE_FIELDS[1:])
+        with self._transaction() as conn:
+            cursor = conn.execute(f'UPDATE users SET {assignments} WHERE id = ? AND username IS NOT NULL',
+                                  [fields[f] for f in fields if f in PROFILE_FIELDS[1:]] + [str(user_id)])
+            return cursor.rowcount > 0
+
+def _apply_transfer(conn, sender_id, recipient_id, amount, sender_record, recipient_record):
+    """
+    Transfer between first accounts inside an open write transaction.
+
+    SQLite itself serializes writers across processes; the debit only
+    applies if the account still has the version that was read, so a stale
+    balance can never be written back.
+    """
+    source = _first_account_row(conn, sender_id)
+    target = _first_account_row(conn, recipient_id)
+    if source is None or target is None:
+        raise TransferError('No account available for transfer')
+    if source['balance'] < amount:
+        raise TransferError('Insufficient funds')
+    debited = conn.execute(
+        'UPDATE accounts SET balance = balance - ?, version = version + 1 '
+        'WHERE account_id = ? AND version = ?',
+        (amount, source['account_id'], source['version']))
+    if debited.rowcount != 1:
+        raise TransferError('Account changed during transfer, please try again')
+    conn.execute('UPDATE accounts SET balance = balance + ?, version = version + 1 '
+                 'WHERE account_id = ?', (amount, target['account_id']))
+    _insert_transaction(conn, sender_id, sender_record)
+    _insert_transaction(conn, recipient_id, recipient_record)
+    return source['balance'] - amount
+
+def _first_account_row(conn, user_id):
+    return conn.execute('SELECT account_id, balance, version FROM accounts WHERE user_id = ? '
+                        'ORDER BY position LIMIT 1', (str(user_id),)).fetchone()
+
+def _insert_transaction(conn, user_id, tx):
+    conn.execute(
+        'INSERT INTO transactions (transaction_id, user_id, type, amount, date, description, counterparty) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (tx['transaction_id'], str(user_id), tx['type'], tx['amount'], tx['date'],
+         tx.get('description'), tx.get('counterparty')))
+    counterparty = (tx.get('counterparty') or '') if tx['type'] in SPENDING_TYPES else ''
+    for period in (tx['date'], month_key(tx['date'])):
+        conn.execute(
+            'INSERT INTO spending_rollups (user_id, period, type, counterparty, amount, count) '
+            'VALUES (?, ?, ?, ?, ?, 1) ON CONFLICT (user_id, period, type, counterparty) '
+            'DO UPDATE SET amount = amount + excluded.amount, count = count + 1',
+            (str(user_id), period, tx['type'], counterparty, tx['amount']))
+
+def _backfill_rollups(conn):
+    """Build the rollup table from existing transactions."""
+    spending_types = ', '.join(f"'{t}'" for t in SPENDING_TYPES)
+    counterparty = f"CASE WHEN type IN ({spending_types}) THEN COALESCE(counterparty, '') ELSE '' END"
+    for period in ('date', 'substr(date, 1, 7)'):
+        conn.execute(
+            f'INSERT INTO spending_rollups (user_id, period, type, counterparty, amount, count) '
+            f'SELECT user_id, {period}, type, {counterparty}, SUM(amount), COUNT(*) FROM transactions '
+            f'GROUP BY user_id, {period}, type, {counterparty}')
+
+def _transaction_from_row(row):
+    """Rebuild the JSON transaction layout (counterparty only when set)."""
+    tx = {field: row[field] for field in TRANSACTION_FIELDS}
+    if tx['counterparty'] is None:
+        del tx['counterparty']
+    return tx
+
+def _profile_from_row(row):
+    if row is None or row['username'] is None:
+        return None
+    return {field: row[field] for field in PROFILE_FIELDS}
+
+_sqlite_store = None
+_sqlite_store_lock = threading.Lock()
+
+def get_sqlite_store():
+    """Get the process-wide SQLite store, creating the schema on first use."""
+    global _sqlite_store
+    if _sqlite_store is None:
+        with _sqlite_store_lock:
+            if _sqlite_store is None:
+                _sqlite_store = SQLiteStore()
+    return _sqlite_store
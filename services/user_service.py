@@ -1,15 +1,35 @@
 import json
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
+from services.storage import STORAGE_BACKEND, get_sqlite_store
+from services.metrics import span, incr
+from services import shared_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized within a process
+    fcntl = None
 
 # Path to users database file
 USERS_DB_PATH = os.path.join(os.path.dirname(__file__), '../data/users.json')
+USERS_LOCK_PATH = USERS_DB_PATH + '.lock'
+# Processes that run password hashing off the request threads
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# Hash jobs allowed to be running or waiting before login requests are turned away
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+
+class PasswordHashBusy(Exception):
+    """Raised when the password hashing queue is full."""
 
-def load_users_db():
+def load_users_db(path=USERS_DB_PATH):
     """Load user database or create if it doesn't exist."""
-    if not os.path.exists(USERS_DB_PATH):
+    if not os.path.exists(path):
         # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(USERS_DB_PATH), exist_ok=True)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         
         # Create sample users
         users = {
@@ -33,24 +53,193 @@ def load_users_db():
             }
         }
         
-        with open(USERS_DB_PATH, 'w') as f:
+        with open(path, 'w') as f:
             json.dump(users, f, indent=2)
     
-    with open(USERS_DB_PATH, 'r') as f:
+    with open(path, 'r') as f:
         return json.load(f)
 
+class UserRepository:
+    """
+    In-memory view of users.json with a primary-key map, a unique username
+    index and a monotonic id allocator.
+
+    The file is only re-read when its identity (inode, size, mtime) changes,
+    so edits by other workers or scripts are still picked up. Writes hold an
+    exclusive lock file, re-check the file and replace it atomically.
+    Profiles are returned as copies so callers cannot modify the cache.
+    """
+
+    def __init__(self, path=USERS_DB_PATH, lock_path=USERS_LOCK_PATH):
+        self.path = path
+        self.lock_path = lock_path
+        self._lock = threading.RLock()
+        self._identity = None
+        self._by_id = {}
+        self._by_username = {}
+        self._next_id = 1
+
+    def get_profile(self, user_id):
+        with self._lock:
+            self._refresh()
+            user = self._by_id.get(str(user_id))
+            return dict(user) if user else None
+
+    def get_profile_by_username(self, username):
+        with self._lock:
+            self._refresh()
+            user_id = self._by_username.get(username)
+            return dict(self._by_id[user_id]) if user_id else None
+
+    def is_current(self):
+        """Whether the in-memory copy matches users.json as it is on disk."""
+        with self._lock:
+            return self._identity is not None and self._identity == _file_identity(self.path)
+
+    def create_profile(self, profile):
+        """
+        Add a login profile, allocating the next numeric id if it has none.
+        Returns the user id, or None if the username is taken.
+        """
+        with self._writing():
+            user_id = str(profile.get('id') or '')
+            owner = self._by_username.get(profile['username'])
+            if owner and owner != user_id:
+                return None
+            if not user_id:
+                user_id = str(self._next_id)
+            self._put(dict(profile, id=user_id))
+            self._save()
+            return user_id
+
+    def update_profile(self, user_id, **fields):
+        """Update profile fields. Returns False if the user does not exist."""
+        with self._writing():
+            user = self._by_id.get(str(user_id))
+            if user is None:
+                return False
+            if 'username' in fields:
+                self._by_username.pop(user['username'], None)
+            self._put(dict(user, **fields))
+            self._save()
+            return True
+
+    def _refresh(self):
+        """Reload the file if it changed since it was last read or written."""
+        identity = _file_identity(self.path)
+        if identity is not None and identity == self._identity:
+            incr('cache_events_total', cache='users', result='hit')
+            return
+        incr('cache_events_total', cache='users', result='miss')
+        # Identity is taken before reading, so a write that races the read
+        # is seen as a change on the next call
+        with span('db.load_users'):
+            users = load_users_db(self.path)
+        self._by_id = {}
+        self._by_username = {}
+        self._next_id = 1
+        for user in users.values():
+            self._put(user)
+        self._identity = identity or _file_identity(self.path)
+
+    def _put(self, user):
+        self._by_id[user['id']] = user
+        self._by_username[user['username']] = user['id']
+        if user['id'].isdigit():
+            self._next_id = max(self._next_id, int(user['id']) + 1)
+
+    def _save(self):
+        data = json.dumps(self._by_id, indent=2).encode('utf-8')
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._identity = _file_identity(self.path)
+
+    @contextmanager
+    def _writing(self):
+        """Hold the write lock (across processes where supported) on fresh data."""
+        with self._lock:
+            lock_file = open(self.lock_path, 'a') if fcntl else None
+            try:
+                if lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._refresh()
+                yield
+            finally:
+                if lock_file:
+                    lock_file.close()
+
+def _file_identity(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+_user_repository = None
+_user_repository_lock = threading.Lock()
+
+def get_user_repository():
+    """Get the login profile store for the configured storage backend."""
+    global _user_repository
+    if STORAGE_BACKEND == 'sqlite':
+        return get_sqlite_store()
+    if _user_repository is None:
+        with _user_repository_lock:
+            if _user_repository is None:
+                _user_repository = UserRepository()
+    return _user_repository
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+def _run_password_hash(func, *args):
+    """
+    Run a PBKDF2 hash function in the password process pool so a burst of
+    logins does not hold the GIL on request threads. Falls back to the
+    calling thread if the pool is disabled or cannot start.
+    """
+    global _hash_pool
+    if PASSWORD_HASH_WORKERS <= 0:
+        return func(*args)
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHashBusy('Too many login attempts in progress, please retry shortly')
+    try:
+        if _hash_pool is None:
+            with _hash_pool_lock:
+                if _hash_pool is None:
+                    _hash_pool = ProcessPoolExecutor(PASSWORD_HASH_WORKERS)
+        return _hash_pool.submit(func, *args).result()
+    except (BrokenProcessPool, OSError):
+        with _hash_pool_lock:
+            _hash_pool = None
+        return func(*args)
+    finally:
+        _hash_slots.release()
+
 def get_user_by_id(user_id):
-    """Get user by ID."""
-    users = load_users_db()
-    return users.get(str(user_id))
+    """
+    Get user by ID. When users.json changed and this worker's copy is
+    stale, the record is taken from the node's shared cache if another
+    worker already loaded it from the new file, instead of re-reading it.
+    """
+    repository = get_user_repository()
+    if STORAGE_BACKEND == 'sqlite' or repository.is_current():
+        return repository.get_profile(user_id)
+    identity = _file_identity(repository.path)
+    if identity is None:
+        return repository.get_profile(user_id)
+    return shared_cache.read_through('user', user_id, ':'.join(map(str, identity)),
+                                     lambda: repository.get_profile(user_id),
+                                     lambda user: json.dumps(user).encode('utf-8'), json.loads)
 
 def get_user_by_username(username):
     """Get user by username."""
-    users = load_users_db()
-    for user in users.values():
-        if user['username'] == username:
-            return user
-    return None
+    return get_user_repository().get_profile_by_username(username)
 
 def authenticate_user(username, password):
     """Authenticate a user with username and password."""
@@ -58,47 +247,31 @@ def authenticate_user(username, password):
     if not user:
         return None
     
-    if check_password_hash(user['password_hash'], password):
+    if _run_password_hash(check_password_hash, user['password_hash'], password):
         return user
     
     return None
 
 def create_user(username, password, name, email, phone, language='en-US'):
     """Create a new user."""
-    users = load_users_db()
-    
-    # Check if username exists
-    for user in users.values():
-        if user['username'] == username:
-            return {'success': False, 'message': 'Username already exists'}
-    
-    # Create new user
-    new_user_id = str(max(int(uid) for uid in users.keys()) + 1) if users else '1'
-    users[new_user_id] = {
-        'id': new_user_id,
+    if get_user_by_username(username):
+        return {'success': False, 'message': 'Username already exists'}
+    new_user_id = get_user_repository().create_profile({
         'username': username,
-        'password_hash': generate_password_hash(password),
+        'password_hash': _run_password_hash(generate_password_hash, password),
         'name': name,
         'email': email,
         'phone': phone,
         'language': language
-    }
-    
-    # Save to file
-    with open(USERS_DB_PATH, 'w') as f:
-        json.dump(users, f, indent=2)
-    
+    })
+    if new_user_id is None:
+        return {'success': False, 'message': 'Username already exists'}
+    shared_cache.invalidate('user', new_user_id)
     return {'success': True, 'user_id': new_user_id}
 
 def update_user_language(user_id, language):
     """Update user's preferred language."""
-    users = load_users_db()
-    if str(user_id) not in users:
+    if not get_user_repository().update_profile(user_id, language=language):
         return {'success': False, 'message': 'User not found'}
-    
-    users[str(user_id)]['language'] = language
-    
-    with open(USERS_DB_PATH, 'w') as f:
-        json.dump(users, f, indent=2)
-    
+    shared_cache.invalidate('user', user_id)
     return {'success': True}
@@ -0,0 +1,160 @@
+"""
+The voice request pipeline: voice authentication, speech recognition,
+intent extraction and the banking action. /api/process-voice runs it
+directly; in job mode the job queue workers run it.
+"""
+
+import logging
+import os
+import time
+from contextlib import nullcontext
+from models.speech_recognition import SERVICE_UNAVAILABLE, recognize_speech, uses_local_model
+from models.intent_recognition import extract_intent, intent_hotwords, preprocess_text
+from models.voice_biometrics import authenticate_voice, get_voice_print_path
+from services.banking_service import get_account_store, process_banking_request
+from services.recipient_directory import get_recipient_directory
+from services.dialogue import continue_dialogue, record_outcome, skips_authentication, verified_at
+from services.admission import admit
+from services.metrics import span, collect_timings, timings_ms
+from services.profiling import maybe_profile
+from services.logs import request_context
+from services.pcm_audio import PCM_FORMAT, PCMAudio
+from services.result_cache import audio_digest, voiceprint_scores, transcripts
+
+logger = logging.getLogger(__name__)
+
+def process_voice_file(audio, user, language, block=False, timings=False, idempotency_key=None, session=None):
+    """
+    Run the pipeline on a saved audio file or on uploaded PCMAudio.
+    Returns (response body, HTTP status). `session` is the request's
+    session_service.session_key, None without a session token.
+    Raises admission.Overloaded when a model stage is saturated, unless block=True.
+    With timings=True the body includes a per-stage breakdown in milliseconds.
+    Resubmitted audio reuses the cached voiceprint score and transcript; a
+    transfer runs once per idempotency_key (by default the audio's hash).
+    """
+    with collect_timings() as stage_timings:
+        body, status = _run_pipeline(audio, user, language, block, idempotency_key, session)
+    if timings:
+        body['timings'] = timings_ms(stage_timings)
+    return body, status
+
+def authenticate_cached(audio, user_id, digest, block=False):
+    """authenticate_voice, cached per audio hash and voiceprint version."""
+    try:
+        voiceprint_version = os.stat(get_voice_print_path(user_id)).st_mtime_ns
+    except OSError:
+        voiceprint_version = None
+    key = (digest, str(user_id), voiceprint_version)
+    auth_result = voiceprint_scores.get(key) if voiceprint_version else None
+    if auth_result is None:
+        with admit('biometrics', block), span('biometrics'):
+            auth_result = authenticate_voice(audio, user_id)
+        # Enrollments and feature errors are not scores
+        if voiceprint_version and 'confidence' in auth_result:
+            voiceprint_scores.put(key, auth_result)
+    return auth_result
+
+def decoding_hotwords(user, language):
+    """
+    Words the speech decoder should favour for this user: the language's
+    intent keywords and number words, and the user's payees.
+    """
+    if not uses_local_model(language):
+        return frozenset()
+    payees = get_recipient_directory(get_account_store()).payee_names(str(user['id']))
+    return frozenset(intent_hotwords(language) | payees)
+
+def recognize_cached(audio, language, digest, block=False, hotwords=frozenset()):
+    """recognize_speech, cached per audio hash, language and hotwords."""
+    key = (digest, language, hotwords)
+    text = transcripts.get(key)
+    if text is None:
+        with admit('asr', block) if uses_local_model(language) else nullcontext(), span('asr'):
+            text = recognize_speech(audio, language, hotwords)
+        # Errors and unreachable services are worth retrying
+        if text and not text.startswith('Error processing speech:') and text != SERVICE_UNAVAILABLE:
+            transcripts.put(key, text)
+    return text
+
+def _run_pipeline(audio, user, language, block, idempotency_key, session):
+    with span('audio_hash'):
+        digest = audio_digest(audio)
+
+    # Step 1: Authenticate voice. A follow-up to this session's pending
+    # transfer shortly after the voice was verified is only authenticated
+    # below if it turns out to be more than an answer to its question
+    verified = verified_at(user['id'], session)
+    follow_up = verified is not None
+    if not follow_up:
+        if not authenticate_cached(audio, user['id'], digest, block)['authenticated']:
+            return {'error': 'Voice authentication failed'}, 401
+        verified = time.monotonic()
+
+    # Step 2: Speech recognition
+    text = recognize_cached(audio, language, digest, block, decoding_hotwords(user, language))
+
+    # Check if there was a speech recognition error
+    if text and text.startswith('Error processing speech:'):
+        return {'error': text}, 500
+
+    # Preprocess text for display
+    preprocessed_text = preprocess_text(text)
+
+    # Step 3: Intent recognition
+    with span('intent'):
+        intent_data = extract_intent(text, language)
+        intent_data = continue_dialogue(user['id'], intent_data, text, language)
+    if follow_up and not skips_authentication(intent_data):
+        # A new request rather than an answer: it needs its own voice check
+        if not authenticate_cached(audio, user['id'], digest, block)['authenticated']:
+            return {'error': 'Voice authentication failed'}, 401
+        verified = time.monotonic()
+
+    # Step 4: Process banking request
+    with span('banking'):
+        response = process_banking_request(intent_data, user, idempotency_key or digest)
+    response = record_outcome(user['id'], intent_data, response, verified, text, language, session)
+
+    return {
+        'recognized_text': text,
+        'preprocessed_text': preprocessed_text,
+        'intent': intent_data,
+        'response': response
+    }, 200
+
+def run_voice_job(payload):
+    """
+    Job queue handler: process an uploaded file and delete it afterwards.
+    payload: {'audio_path', 'user', 'language'}, the optional 'timings' and 'profile'
+    flags, 'idempotency_key', the 'request_id' for log records, the
+    'session' key, and 'audio_format' and 'sample_rate' when the file holds
+    raw PCM.
+    """
+    with request_context(payload.get('request_id')):
+        return _run_job(payload)
+
+def _run_job(payload):
+    filepath = payload['audio_path']
+    try:
+        audio = filepath
+        if payload.get('audio_format') == PCM_FORMAT:
+            with open(filepath, 'rb') as f:
+                audio = PCMAudio(f.read(), payload['sample_rate'])
+        with maybe_profile(payload.get('profile', False), 'voice-job') as profile_id:
+            # Jobs wait for a model slot; the job queue bounds how many are pending
+            body, status = process_voice_file(audio, payload['user'], payload['language'], block=True,
+                                              timings=payload.get('timings', False),
+                                              idempotency_key=payload.get('idempotency_key'),
+                                              session=payload.get('session'))
+        if profile_id:
+            body['profile_id'] = profile_id
+        return body, status
+    except Exception as e:
+        return {'error': str(e)}, 500
+    finally:
+        if os.path.exists(filepath):
+            try:
+                os.remove(filepath)
+            except OSError as e:
+                logger.error("Failed to remove temporary file %s: %s", filepath, e)
@@ -0,0 +1,300 @@
+"""
+Streaming voice requests: /api/stream-voice receives the audio over a
+WebSocket while the user speaks.
+
+The client sends 16-bit little-endian mono PCM frames. As they arrive a
+worker thread scores the voice once enough audio is buffered and, for the
+languages recognized by a local Wav2Vec2 model, transcribes the audio in
+chunks of STREAM_CHUNK_SECONDS. Every new chunk yields a partial transcript
+and an early intent. When the client signals the end of speech only the
+last chunk is left to recognize before the banking step runs.
+
+Each open stream counts toward the 'stream' admission stage, and a user may
+have at most STREAM_PER_USER streams open per process.
+
+Google-recognized languages (en-US) have no partials: the API takes a whole
+utterance, so they are recognized once at the end. Biometrics still run
+early.
+
+The early voice score only covers the first STREAM_AUTH_SECONDS. The
+request is authorized on the whole utterance: if more audio arrived after
+the early check, the complete recording is scored again before the banking
+step.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from models.speech_recognition import transcribe_samples, uses_local_model
+from models.intent_recognition import extract_intent, preprocess_text
+from models.voice_biometrics import get_voice_print_path
+from services.banking_service import process_banking_request
+from services.admission import Overloaded, admit
+from services.metrics import span, incr, collect_timings, timings_ms
+from services.logs import current_request_id, request_context
+from services.pcm_audio import MIN_SAMPLE_RATE, MAX_SAMPLE_RATE, PCM_MAX_SECONDS, PCMAudio
+from services.result_cache import audio_digest
+from services.voice_pipeline import authenticate_cached, decoding_hotwords, recognize_cached
+from services.dialogue import continue_dialogue, record_outcome, skips_authentication, verified_at
+
+logger = logging.getLogger(__name__)
+
+# Audio recognized per partial transcript
+STREAM_CHUNK_SECONDS = float(os.environ.get('STREAM_CHUNK_SECONDS', 2.0))
+# Audio buffered before the early voice authentication
+STREAM_AUTH_SECONDS = float(os.environ.get('STREAM_AUTH_SECONDS', 2.0))
+# A chunk ends at the quietest 20 ms frame within its last half second,
+# so words are rarely cut in two
+SPLIT_SEARCH_SECONDS = 0.5
+SPLIT_FRAME_SECONDS = 0.02
+# Shorter leftovers at the end of speech are not worth a model call
+MIN_TAIL_SECONDS = 0.25
+# Streams one user may have open at once
+STREAM_PER_USER = int(os.environ.get('STREAM_PER_USER', 2))
+
+# User id -> open streams
+_open_streams = {}
+_open_streams_lock = threading.Lock()
+
+@contextmanager
+def user_stream_slot(user_id):
+    """Count an open stream for the user during the block. Yields False if the user already has STREAM_PER_USER."""
+    key = str(user_id)
+    with _open_streams_lock:
+        admitted = _open_streams.get(key, 0) < STREAM_PER_USER
+        if admitted:
+            _open_streams[key] = _open_streams.get(key, 0) + 1
+    try:
+        yield admitted
+    finally:
+        if admitted:
+            with _open_streams_lock:
+                _open_streams[key] -= 1
+                if not _open_streams[key]:
+                    del _open_streams[key]
+
+class VoiceStream:
+    """
+    One streaming voice request. feed() and finish() are called by the
+    connection; recognition runs on a worker thread so that frames keep
+    arriving while a chunk is processed.
+    """
+
+    def __init__(self, user, language, sample_rate=16000, timings=False, idempotency_key=None, session=None):
+        try:
+            sample_rate = int(sample_rate)
+        except (TypeError, ValueError):
+            raise ValueError('sample_rate must be an integer')
+        if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+            raise ValueError(f'sample_rate must be between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}')
+        self.user = user
+        self.language = language
+        self.sample_rate = sample_rate
+        self.timings = timings
+        self.idempotency_key = idempotency_key
+        self.session = session
+        self.request_id = current_request_id()
+        self.streaming = uses_local_model(language)
+        self.hotwords = decoding_hotwords(user, language)
+        self.result = None
+        self._audio = bytearray()
+        self._lock = threading.Lock()
+        self._work = queue.Queue()
+        self._events = queue.Queue()
+        # Bytes of audio already recognized, and their transcripts
+        self._transcribed = 0
+        self._chunks = []
+        self._auth = None
+        # Bytes of audio the voice score covers
+        self._auth_bytes = 0
+        # Set when this session has a transfer pending within the verified
+        # window; the request may then skip biometrics if it only answers it
+        self.verified = verified_at(user['id'], session)
+        # (text, intent) of the latest partial transcript
+        self._partial = None
+        self._worker = threading.Thread(target=self._run, name='voice-stream', daemon=True)
+
+    def start(self):
+        self._worker.start()
+        return self
+
+    @property
+    def done(self):
+        """Whether the result is ready (after finish(), or early after an error)."""
+        return self.result is not None
+
+    def feed(self, pcm):
+        """Append a frame of samples. Raises ValueError for a bad frame or an over-long stream."""
+        if len(pcm) % 2:
+            raise ValueError('Frames must hold whole 16-bit samples')
+        with self._lock:
+            if (len(self._audio) + len(pcm)) / 2 / self.sample_rate > PCM_MAX_SECONDS:
+                raise ValueError(f'Recordings are limited to {PCM_MAX_SECONDS:g} seconds')
+            self._audio.extend(pcm)
+        self._work.put('audio')
+
+    def events(self):
+        """Partial transcripts produced since the last call."""
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def finish(self, drop_samples=0, timeout=None):
+        """
+        End of speech: recognize the rest and run the banking step.
+        drop_samples trailing samples (silence the client already sent) are
+        discarded first. Returns (response body, HTTP status).
+        """
+        self._work.put(('end', max(int(drop_samples or 0), 0)))
+        self._worker.join(timeout)
+        if self.result is None:
+            return {'error': 'Timed out processing the voice stream'}, 504
+        return self.result
+
+    def cancel(self):
+        """Stop the worker without a result, e.g. when the client disconnects."""
+        self._work.put('cancel')
+
+    def _run(self):
+        with request_context(self.request_id), collect_timings() as stage_timings:
+            try:
+                while True:
+                    item = self._work.get()
+                    if item == 'cancel':
+                        return
+                    if item == 'audio':
+                        self._advance(final=False)
+                        continue
+                    with span('stream.final'):
+                        self._drop(item[1])
+                        self._advance(final=True)
+                        body, status = self._complete()
+                    break
+            except Overloaded as e:
+                body, status = {'error': str(e), 'retry_after': e.retry_after}, 503
+            except Exception as e:
+                logger.error("Error in voice stream: %s", e)
+                body, status = {'error': f'Error processing speech: {str(e)}'}, 500
+        if self.timings:
+            body['timings'] = timings_ms(stage_timings)
+        self.result = body, status
+
+    def _drop(self, samples):
+        with self._lock:
+            keep = max(len(self._audio) - 2 * samples, self._transcribed)
+            del self._audio[keep:]
+
+    def _pcm_audio(self):
+        with self._lock:
+            return PCMAudio(bytes(self._audio), self.sample_rate)
+
+    def _advance(self, final):
+        """Authenticate and recognize whatever the buffered audio allows."""
+        with self._lock:
+            buffered = len(self._audio)
+        if (self._auth is None and self.verified is None and buffered / 2 / self.sample_rate >= STREAM_AUTH_SECONDS
+                and os.path.exists(get_voice_print_path(self.user['id']))):
+            # Users without a voiceprint are enrolled from the complete recording instead
+            self._authenticate()
+        if not self.streaming:
+            return
+        chunk = int(STREAM_CHUNK_SECONDS * self.sample_rate) * 2
+        new_text = False
+        while True:
+            with self._lock:
+                pending = bytes(self._audio[self._transcribed:])
+            if len(pending) >= chunk:
+                pending = pending[:self._split_point(pending, chunk)]
+            elif not final or len(pending) / 2 / self.sample_rate < MIN_TAIL_SECONDS:
+                break
+            with admit('asr'), span('asr'):
+                text = transcribe_samples(PCMAudio(pending, self.sample_rate).samples(16000), self.language,
+                                          self.hotwords)
+            self._transcribed += len(pending)
+            if text.strip():
+                self._chunks.append(text.strip())
+                new_text = True
+        if new_text and not final:
+            text = ' '.join(self._chunks)
+            with span('intent'):
+                intent_data = extract_intent(text, self.language)
+            self._partial = text, intent_data
+            self._events.put({'type': 'partial', 'text': text, 'intent': intent_data['intent_type'],
+                              'parameters': intent_data['parameters']})
+
+    def _split_point(self, pending, chunk):
+        """Byte offset near chunk at the quietest frame of the search window."""
+        frame = int(SPLIT_FRAME_SECONDS * self.sample_rate)
+        end = chunk // 2
+        window = min(int(SPLIT_SEARCH_SECONDS * self.sample_rate), end) // frame * frame
+        if not window:
+            return chunk
+        samples = np.frombuffer(pending[2 * (end - window):2 * end], dtype='<i2').astype(np.float32)
+        energy = (samples.reshape(-1, frame) ** 2).mean(axis=1)
+        return 2 * (end - window + int(np.argmin(energy)) * frame + frame // 2)
+
+    def _authenticate(self):
+        audio = self._pcm_audio()
+        self._auth = authenticate_cached(audio, self.user['id'], audio_digest(audio))
+        self._auth_bytes = len(audio.pcm)
+
+    def _authorize(self):
+        """Whether the whole utterance matches the user's voice; sets self.verified if so."""
+        if self._auth is None or self._auth_bytes != len(self._audio):
+            # The early check saw only part of the recording, or there was too little audio for it
+            self._authenticate()
+        if not self._auth.get('authenticated'):
+            return False
+        self.verified = time.monotonic()
+        return True
+
+    def _complete(self):
+        """The response once all audio is in, in the shape of process_voice_file's."""
+        if not self._audio:
+            return {'error': 'No audio received'}, 400
+        follow_up = self.verified is not None
+        if not follow_up and not self._authorize():
+            return {'error': 'Voice authentication failed'}, 401
+
+        if self.streaming:
+            text = ' '.join(self._chunks)
+        else:
+            audio = self._pcm_audio()
+            text = recognize_cached(audio, self.language, audio_digest(audio), hotwords=self.hotwords)
+            if text and text.startswith('Error processing speech:'):
+                return {'error': text}, 500
+
+        if self._partial and self._partial[0] == text:
+            incr('cache_events_total', cache='stream_intent', result='hit')
+            intent_data = self._partial[1]
+        else:
+            incr('cache_events_total', cache='stream_intent', result='miss')
+            with span('intent'):
+                intent_data = extract_intent(text, self.language)
+        intent_data = continue_dialogue(self.user['id'], intent_data, text, self.language)
+        if follow_up and not skips_authentication(intent_data):
+            # A new request rather than an answer: it needs its own voice check
+            if not self._authorize():
+                return {'error': 'Voice authentication failed'}, 401
+
+        # The audio hash matches an upload of the same recording, which the
+        # client falls back to when the stream breaks
+        with span('banking'):
+            response = process_banking_request(intent_data, self.user,
+                                               self.idempotency_key or audio_digest(self._pcm_audio()))
+        response = record_outcome(self.user['id'], intent_data, response, self.verified, text, self.language,
+                                  self.session)
+
+        return {
+            'recognized_text': text,
+            'preprocessed_text': preprocess_text(text),
+            'intent': intent_data,
+            'response': response
+        }, 200
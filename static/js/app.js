@@ -34,7 +34,14 @@ document.addEventListener('DOMContentLoaded', function() {
     let isRecording = false;
     let mediaRecorder;
     let audioChunks = [];
+    let capture = null; // PCM capture in progress (AudioWorklet path)
     let currentUser = JSON.parse(localStorage.getItem('user'));
+    let sessionToken = localStorage.getItem('sessionToken');
+    
+    // Authorization header for the current session
+    function authHeaders() {
+        return sessionToken ? { 'Authorization': `Bearer ${sessionToken}` } : {};
+    }
     let isProcessing = false; // Track if we're currently processing a request
     
     // Debounce function to prevent multiple rapid button clicks
@@ -153,7 +160,9 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(data => {
             if (data.success) {
                 currentUser = data.user;
+                sessionToken = data.token;
                 localStorage.setItem('user', JSON.stringify(currentUser));
+                localStorage.setItem('sessionToken', sessionToken);
                 showBankingInterface();
                 loginForm.reset();
                 showToast(`Welcome back, ${currentUser.name}!`);
@@ -241,7 +250,9 @@ document.addEventListener('DOMContentLoaded', function() {
         
         this.disabled = true;
         localStorage.removeItem('user');
+        localStorage.removeItem('sessionToken');
         currentUser = null;
+        sessionToken = null;
         showToast('You have been logged out successfully');
         showLoginInterface();
         setTimeout(() => {
@@ -263,6 +274,27 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Raw PCM capture: 16 kHz mono 16-bit samples, uploaded without encoding
+    const PCM_SAMPLE_RATE = 16000;
+    const FRAME_MS = 20;
+    // End-of-speech detection on the frame levels
+    const VAD = {
+        calibrationFrames: 15,  // first 300 ms estimate the background noise
+        minLevel: 0.01,         // RMS always counted as silence
+        maxLevel: 0.05,         // RMS always counted as speech
+        noiseFactor: 3,         // speech is this much louder than the noise
+        silenceMs: 800,         // stop after this much silence following speech
+        paddingMs: 300,         // audio kept before and after the speech
+        noSpeechMs: 5000,       // give up when nobody speaks
+        maxMs: 10000            // longest recording
+    };
+    
+    // One key per recording: the server never repeats a transfer for a retried key
+    function newIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    }
+    
     function startRecording() {
         // Reset previous results
         resultSection.classList.add('hidden');
@@ -271,31 +303,22 @@ document.addEventListener('DOMContentLoaded', function() {
         if (isProcessing) return;
         isProcessing = true;
         
-        navigator.mediaDevices.getUserMedia({ audio: true })
+        navigator.mediaDevices.getUserMedia({ audio: { channelCount: 1, echoCancellation: true, noiseSuppression: true } })
             .then(stream => {
-                isRecording = true;
-                recordBtn.classList.add('recording');
-                recordText.textContent = 'Stop Recording';
-                recordingIndicator.classList.remove('hidden');
-                
-                mediaRecorder = new MediaRecorder(stream);
-                audioChunks = [];
-                
-                mediaRecorder.ondataavailable = event => {
-                    audioChunks.push(event.data);
-                };
-                
-                mediaRecorder.onstop = processRecording;
-                
-                mediaRecorder.start();
-                isProcessing = false;
-                
-                // Auto stop after 10 seconds
-                setTimeout(() => {
-                    if (isRecording) {
-                        stopRecording();
-                    }
-                }, 10000);
+                // Fall back to compressed MediaRecorder audio where AudioWorklet is unavailable
+                const started = window.AudioWorkletNode
+                    ? startPcmCapture(stream).catch(error => {
+                        console.warn('PCM capture unavailable, recording compressed audio:', error);
+                        return startMediaRecorder(stream);
+                    })
+                    : startMediaRecorder(stream);
+                return started.then(() => {
+                    isRecording = true;
+                    recordBtn.classList.add('recording');
+                    recordText.textContent = 'Stop Recording';
+                    recordingIndicator.classList.remove('hidden');
+                    isProcessing = false;
+                });
             })
             .catch(error => {
                 console.error('Error accessing microphone:', error);
@@ -304,48 +327,264 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    function startMediaRecorder(stream) {
+        mediaRecorder = new MediaRecorder(stream);
+        audioChunks = [];
+        
+        mediaRecorder.ondataavailable = event => {
+            audioChunks.push(event.data);
+        };
+        
+        mediaRecorder.onstop = processRecording;
+        
+        mediaRecorder.start();
+        
+        // Auto stop after 10 seconds
+        setTimeout(() => {
+            if (isRecording && !capture) {
+                stopRecording();
+            }
+        }, VAD.maxMs);
+        return Promise.resolve();
+    }
+    
+    function startPcmCapture(stream) {
+        const context = new AudioContext();
+        return context.audioWorklet.addModule('/static/js/pcm-capture-worklet.js')
+            .then(() => {
+                const source = context.createMediaStreamSource(stream);
+                const node = new AudioWorkletNode(context, 'pcm-capture', {
+                    processorOptions: { targetRate: PCM_SAMPLE_RATE }
+                });
+                const sampleRate = Math.min(PCM_SAMPLE_RATE, context.sampleRate);
+                const idempotencyKey = newIdempotencyKey();
+                capture = {
+                    context, stream, source, node, sampleRate, idempotencyKey,
+                    frames: [], noise: 0, speechStart: -1, lastSpeech: -1,
+                    voiceStream: openVoiceStream(sampleRate, idempotencyKey)
+                };
+                node.port.onmessage = event => onPcmFrame(event.data);
+                source.connect(node);
+                // The node writes no output; connecting it keeps it processing
+                node.connect(context.destination);
+                return context.resume();
+            })
+            .catch(error => {
+                capture = null;
+                context.close();
+                throw error;
+            });
+    }
+    
+    function onPcmFrame({ pcm, rms }) {
+        if (!capture || !isRecording) return;
+        const index = capture.frames.length;
+        capture.frames.push(new Int16Array(pcm));
+        if (index < VAD.calibrationFrames) {
+            capture.noise += rms / VAD.calibrationFrames;
+            return;
+        }
+        const threshold = Math.min(Math.max(VAD.minLevel, capture.noise * VAD.noiseFactor), VAD.maxLevel);
+        if (rms > threshold) {
+            if (capture.speechStart < 0) capture.speechStart = index;
+            capture.lastSpeech = index;
+        }
+        sendFrames(capture);
+        const elapsedMs = (index + 1) * FRAME_MS;
+        if ((capture.speechStart >= 0 && (index - capture.lastSpeech) * FRAME_MS >= VAD.silenceMs)
+                || (capture.speechStart < 0 && elapsedMs >= VAD.noSpeechMs)
+                || elapsedMs >= VAD.maxMs) {
+            stopRecording();
+        }
+    }
+    
+    // Streaming: frames go to /api/stream-voice while the user speaks, so the
+    // server recognizes the audio and detects the intent during the recording
+    function openVoiceStream(sampleRate, idempotencyKey) {
+        if (!window.WebSocket) return null;
+        const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const socket = new WebSocket(`${scheme}//${location.host}/api/stream-voice`);
+        socket.binaryType = 'arraybuffer';
+        const voiceStream = { socket, sent: -1, failed: false };
+        // Resolves with the server's result message, rejects if the connection fails first
+        voiceStream.result = new Promise((resolve, reject) => {
+            socket.onopen = () => {
+                socket.send(JSON.stringify({
+                    type: 'start',
+                    user_id: currentUser.id,
+                    token: sessionToken,
+                    language: languageSelect.value,
+                    sample_rate: sampleRate,
+                    idempotency_key: idempotencyKey
+                }));
+                if (capture && capture.voiceStream === voiceStream) sendFrames(capture);
+            };
+            socket.onmessage = event => {
+                const message = JSON.parse(event.data);
+                if (message.type === 'partial') {
+                    showPartialResult(message);
+                } else if (message.type === 'result') {
+                    resolve(message);
+                }
+            };
+            socket.onclose = () => reject(new Error('The streaming connection closed'));
+        });
+        voiceStream.result.catch(() => { voiceStream.failed = true; });
+        return voiceStream;
+    }
+    
+    // Send the frames captured since the last call, from just before the speech onwards
+    function sendFrames(current) {
+        const voiceStream = current.voiceStream;
+        if (!voiceStream || voiceStream.failed || current.speechStart < 0
+                || voiceStream.socket.readyState !== WebSocket.OPEN) return;
+        if (voiceStream.sent < 0) {
+            voiceStream.sent = Math.max(current.speechStart - Math.round(VAD.paddingMs / FRAME_MS), 0);
+        }
+        while (voiceStream.sent < current.frames.length) {
+            voiceStream.socket.send(current.frames[voiceStream.sent++].buffer);
+        }
+    }
+    
+    function showPartialResult(partial) {
+        resultSection.classList.remove('hidden');
+        recognizedText.textContent = partial.text;
+        detectedIntent.textContent = formatIntentName(partial.intent);
+    }
+    
+    function finishPcmCapture() {
+        const finished = capture;
+        capture = null;
+        finished.node.port.onmessage = null;
+        finished.source.disconnect();
+        finished.node.disconnect();
+        finished.stream.getTracks().forEach(track => track.stop());
+        finished.context.close();
+        
+        const voiceStream = finished.voiceStream;
+        if (finished.speechStart < 0) {
+            if (voiceStream) voiceStream.socket.close();
+            showToast('No speech detected. Please try again.', 'error');
+            return;
+        }
+        // Keep the speech plus a little padding on either side
+        const padding = Math.round(VAD.paddingMs / FRAME_MS);
+        const keepEnd = Math.min(finished.lastSpeech + padding + 1, finished.frames.length);
+        const frames = finished.frames.slice(Math.max(finished.speechStart - padding, 0), keepEnd);
+        const pcm = new Int16Array(frames.reduce((total, frame) => total + frame.length, 0));
+        let offset = 0;
+        frames.forEach(frame => {
+            pcm.set(frame, offset);
+            offset += frame.length;
+        });
+        // Typed arrays use the platform byte order, little-endian on every browser platform
+        // The upload shares the stream's idempotency key, so a transfer the
+        // stream already made is not made twice
+        const upload = () => sendRecording(new Blob([pcm.buffer], { type: 'application/octet-stream' }),
+                                           'recording.pcm', {
+            audio_format: 'pcm_s16le',
+            sample_rate: finished.sampleRate,
+            idempotency_key: finished.idempotencyKey
+        });
+        
+        if (!voiceStream || voiceStream.failed) {
+            if (voiceStream) voiceStream.socket.close();
+            trackRequest(upload());
+            return;
+        }
+        if (voiceStream.socket.readyState === WebSocket.OPEN) {
+            sendFrames(finished);
+            // The trailing silence was streamed already; the server drops it
+            const dropSamples = finished.frames.slice(keepEnd, Math.max(voiceStream.sent, keepEnd))
+                .reduce((total, frame) => total + frame.length, 0);
+            voiceStream.socket.send(JSON.stringify({ type: 'end', drop_samples: dropSamples }));
+        } else {
+            // Still connecting: give up on it, which falls back to the upload
+            voiceStream.socket.close();
+        }
+        // Upload the recording instead if the stream breaks before its result
+        trackRequest(voiceStream.result.then(message => {
+            voiceStream.socket.close();
+            if (message.status === 503 || message.status === 429) {
+                // No stream slot free: the upload is admitted on its own
+                return upload();
+            }
+            if (message.status >= 400) {
+                throw new Error(message.error || 'Server error');
+            }
+            return message;
+        }, error => {
+            console.warn('Streaming failed, uploading the recording:', error);
+            return upload();
+        }));
+    }
+    
     function stopRecording() {
-        if (mediaRecorder && isRecording) {
+        if (!isRecording) return;
+        isRecording = false;
+        recordBtn.classList.remove('recording');
+        recordText.textContent = 'Start Recording';
+        recordingIndicator.classList.add('hidden');
+        
+        if (capture) {
+            finishPcmCapture();
+        } else if (mediaRecorder) {
             mediaRecorder.stop();
-            isRecording = false;
-            recordBtn.classList.remove('recording');
-            recordText.textContent = 'Start Recording';
-            recordingIndicator.classList.add('hidden');
             
             // Stop all audio tracks
             mediaRecorder.stream.getTracks().forEach(track => track.stop());
         }
     }
     
+    // Follow a queued voice job until its result arrives
+    function waitForJob(job) {
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(job.events_url);
+            events.addEventListener('result', event => {
+                events.close();
+                const finished = JSON.parse(event.data);
+                if (finished.status_code >= 400) {
+                    reject(new Error(finished.result.error || 'Server error'));
+                } else {
+                    resolve(finished.result);
+                }
+            });
+            events.addEventListener('error', () => {
+                events.close();
+                reject(new Error('Lost connection while waiting for the result'));
+            });
+        });
+    }
+    
     function processRecording() {
         if (audioChunks.length === 0) {
             showToast('No audio recorded. Please try again.', 'error');
             return;
         }
         
-        isProcessing = true;
-        
-        const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
-        
-        // Add visual feedback
-        recordBtn.disabled = true;
-        const processingIndicator = document.createElement('div');
-        processingIndicator.textContent = 'Processing your audio...';
-        processingIndicator.className = 'processing-indicator';
-        recordBtn.parentNode.insertBefore(processingIndicator, recordBtn.nextSibling);
-        
+        trackRequest(sendRecording(new Blob(audioChunks, { type: 'audio/wav' }), 'recording.wav',
+                                   { idempotency_key: newIdempotencyKey() }));
+    }
+    
+    // Upload a recording; extraFields describe raw PCM uploads and carry the idempotency key.
+    // Resolves with the result.
+    function sendRecording(audioBlob, filename, extraFields) {
         // Create form data
         const formData = new FormData();
-        formData.append('audio', audioBlob, 'recording.wav');
+        formData.append('audio', audioBlob, filename);
+        Object.entries(extraFields).forEach(([name, value]) => formData.append(name, value));
         formData.append('user_id', currentUser.id);
         formData.append('language', languageSelect.value);
+        // Job mode: the server answers once the upload is queued, the result follows as an event
+        formData.append('async', '1');
         
-        // Send to server with timeout handling
+        // Send to server with timeout handling (the timeout covers the upload only)
         const controller = new AbortController();
         const timeoutId = setTimeout(() => controller.abort(), 30000);
         
-        fetch('/api/process-voice', {
+        return fetch('/api/process-voice', {
             method: 'POST',
+            headers: authHeaders(),
             body: formData,
             signal: controller.signal
         })
@@ -356,8 +595,25 @@ document.addEventListener('DOMContentLoaded', function() {
                     throw new Error(data.error || 'Server error');
                 });
             }
+            if (response.status === 202) {
+                return response.json().then(waitForJob);
+            }
             return response.json();
-        })
+        });
+    }
+    
+    // Show a processing indicator until a voice request settles, then its result or error
+    function trackRequest(request) {
+        isProcessing = true;
+        
+        // Add visual feedback
+        recordBtn.disabled = true;
+        const processingIndicator = document.createElement('div');
+        processingIndicator.textContent = 'Processing your audio...';
+        processingIndicator.className = 'processing-indicator';
+        recordBtn.parentNode.insertBefore(processingIndicator, recordBtn.nextSibling);
+        
+        request
         .then(data => {
             processingIndicator.remove();
             displayResults(data);
@@ -418,7 +674,10 @@ document.addEventListener('DOMContentLoaded', function() {
         detectedIntent.textContent = formatIntentName(data.intent.intent_type);
         
         // Update response message
-        if (data.response.success === false) {
+        if (data.response.awaiting) {
+            // A transfer waits for its amount or recipient: the next recording answers the prompt
+            responseMessage.textContent = data.response.message;
+        } else if (data.response.success === false) {
             responseMessage.innerHTML = `
                 <div class="error-message">
                     <p>${data.response.message || 'Could not complete your request'}</p>
@@ -534,6 +793,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    ...authHeaders()
                 },
                 body: JSON.stringify({ 
                     user_id: currentUser.id,
@@ -547,6 +807,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     // Update user object in local storage
                     currentUser.language = language;
                     localStorage.setItem('user', JSON.stringify(currentUser));
+                    if (data.token) {
+                        sessionToken = data.token;
+                        localStorage.setItem('sessionToken', sessionToken);
+                    }
                 }
             })
             .catch(error => {
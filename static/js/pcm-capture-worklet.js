@@ -0,0 +1,59 @@
+// Downmixes the microphone to mono, downsamples it to the target rate
+// (16 kHz) and posts 20 ms frames of 16-bit PCM with their RMS level, which
+// the page uses to detect the end of speech.
+class PCMCaptureProcessor extends AudioWorkletProcessor {
+    constructor(options) {
+        super();
+        const targetRate = options.processorOptions.targetRate;
+        // Input samples per output sample; below 1 the input is passed through
+        this.step = Math.max(sampleRate / targetRate, 1);
+        this.frameSize = Math.round(Math.min(sampleRate, targetRate) * 0.02);
+        this.frame = new Int16Array(this.frameSize);
+        this.frameLength = 0;
+        this.energy = 0;
+        // Averaging the input samples behind each output sample filters out
+        // most of what would alias when downsampling
+        this.sum = 0;
+        this.count = 0;
+        this.position = 0;
+    }
+
+    process(inputs) {
+        const input = inputs[0];
+        if (!input || input.length === 0) {
+            return true;
+        }
+        const channels = input.length;
+        for (let i = 0; i < input[0].length; i++) {
+            let sample = 0;
+            for (let c = 0; c < channels; c++) {
+                sample += input[c][i];
+            }
+            this.sum += sample / channels;
+            this.count++;
+            this.position++;
+            if (this.position >= this.step) {
+                this.position -= this.step;
+                this.push(this.sum / this.count);
+                this.sum = 0;
+                this.count = 0;
+            }
+        }
+        return true;
+    }
+
+    push(value) {
+        const sample = Math.max(-1, Math.min(1, value));
+        this.frame[this.frameLength++] = sample < 0 ? sample * 0x8000 : sample * 0x7fff;
+        this.energy += sample * sample;
+        if (this.frameLength === this.frameSize) {
+            const rms = Math.sqrt(this.energy / this.frameSize);
+            this.port.postMessage({ pcm: this.frame.buffer, rms }, [this.frame.buffer]);
+            this.frame = new Int16Array(this.frameSize);
+            this.frameLength = 0;
+            this.energy = 0;
+        }
+    }
+}
+
+registerProcessor('pcm-capture', PCMCaptureProcessor);
@@ -0,0 +1,314 @@
+"""
+Test script for the journaled account store
+
+Runs the store on a scratch copy of the mock database and checks that
+transfers survive a restart after an interrupted compaction, that
+lock-free balance reads never see a transfer half-applied, that a batch
+is applied all-or-nothing or per item and journaled once, that both
+stores' transaction cursors page through a history without gaps or
+repeats, and that a transfer resubmitted with the same idempotency key
+moves the money once, whichever store instance (process) receives it.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from services import banking_service
+from services.banking_service import AccountStore, load_mock_db, process_banking_request
+from services.storage import SQLiteStore
+
+def scratch_store(directory, **kwargs):
+    """An AccountStore on the mock database in `directory`."""
+    return AccountStore(db_path=os.path.join(directory, 'mock_db.json'),
+                        journal_path=os.path.join(directory, 'mock_db.journal'),
+                        lock_path=os.path.join(directory, 'mock_db.lock'), fsync=False, **kwargs)
+
+def transfer(store, amount, idempotency_key=None):
+    record = {'transaction_id': 'T', 'amount': amount, 'date': '2024-01-01', 'counterparty': 'x'}
+    return store.transfer('1', '2', amount, dict(record, type='transfer_out'), dict(record, type='transfer_in'),
+                          idempotency_key=idempotency_key)
+
+def batch_item(amount, date='2024-01-01', **fields):
+    """One transfer from user 1 to user 2 for transfer_batch."""
+    record = {'transaction_id': 'T', 'amount': amount, 'date': date, 'counterparty': 'x'}
+    return dict({'sender_id': '1', 'recipient_id': '2', 'amount': amount,
+                 'sender_record': dict(record, type='transfer_out'),
+                 'recipient_record': dict(record, type='transfer_in')}, **fields)
+
+def keyed_transfer(store, amount, key):
+    """transfer_batch's result for one transfer with an idempotency key."""
+    return store.transfer_batch([batch_item(amount, idempotency_key=key)])[0]
+
+def journal_lines(directory):
+    with open(os.path.join(directory, 'mock_db.journal')) as f:
+        return sum(1 for _ in f)
+
+def savings_balance(store, user_id='1'):
+    return store.get_accounts(user_id)['savings']['balance']
+
+def test_compaction_crash_recovery():
+    """A crash between the snapshot and the journal header must not lose later transfers."""
+    print("\n=== Testing recovery from an interrupted compaction ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        store = scratch_store(directory)
+        start = savings_balance(store)
+        transfer(store, 10)
+        store.close()
+
+        # The compaction wrote its snapshot, then the process died before the header
+        store = scratch_store(directory)
+        db = {'snapshot_id': 'crashed', 'transaction_order': 'append', 'users': store._users}
+        store._write_snapshot(db)
+        store.close()
+
+        store = scratch_store(directory)
+        print(f"Balance after the crash: {savings_balance(store)}")
+        assert savings_balance(store) == start - 10
+        transfer(store, 5)
+        store.close()
+
+        store = scratch_store(directory)
+        print(f"Balance after restarting: {savings_balance(store)}")
+        assert savings_balance(store) == start - 15, 'a transfer after the crash was lost'
+        with open(os.path.join(directory, 'mock_db.journal')) as f:
+            header = json.loads(f.readline())
+        assert header['snapshot_id'] == store._snapshot_id
+        store.close()
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def test_read_waits_for_transfer_in_progress():
+    """A balance read during a transfer returns only once the transfer is complete."""
+    print("\n=== Testing lock-free reads during a transfer ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        store = scratch_store(directory)
+        source = store._users['1']['accounts']['savings']
+        start = source['balance']
+        seen = []
+
+        # A writer stopped halfway: version odd, balance changed
+        store._bump_version(source)
+        source['balance'] -= 1
+        reader = threading.Thread(target=lambda: seen.append(savings_balance(store)))
+        reader.start()
+        reader.join(0.2)
+        assert reader.is_alive() and not seen, 'read returned a balance mid-transfer'
+        source['balance'] -= 1
+        store._bump_version(source)
+        reader.join(5)
+        print(f"Balance read after the transfer: {seen}")
+        assert seen == [start - 2]
+        store.close()
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def test_concurrent_transfers_and_reads():
+    """Concurrent transfers keep the total, and reads see the balance only ever fall."""
+    print("\n=== Testing concurrent transfers and reads ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        store = scratch_store(directory)
+        start = savings_balance(store)
+        total = start + savings_balance(store, '2')
+        done = threading.Event()
+        torn = []
+
+        def read():
+            # Transfers only take money from this account, so reads never go up
+            previous = start
+            while not done.is_set():
+                balance = savings_balance(store)
+                if balance > previous or balance < start - 200:
+                    torn.append(balance)
+                previous = balance
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        writers = [threading.Thread(target=lambda: [transfer(store, 1) for _ in range(50)]) for _ in range(4)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+
+        print(f"Balances: {savings_balance(store)} and {savings_balance(store, '2')}")
+        assert not torn
+        assert savings_balance(store) == start - 200
+        assert savings_balance(store) + savings_balance(store, '2') == total
+        store.close()
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def test_batch_group_commit():
+    """A batch is validated in order and its accepted transfers are journaled as one entry."""
+    print("\n=== Testing batched transfers ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        store = scratch_store(directory)
+        transfer(store, 1)
+        start = savings_balance(store)
+        lines = journal_lines(directory)
+        batch = [batch_item(100), batch_item(start), batch_item(200)]
+
+        results = store.transfer_batch(batch)
+        print(f"Atomic batch with an overdraft: {results}")
+        assert not any(r['success'] for r in results)
+        assert results[1]['error'] == 'Insufficient funds'
+        assert savings_balance(store) == start and journal_lines(directory) == lines
+
+        results = store.transfer_batch(batch, atomic=False)
+        print(f"Non-atomic batch: {results}")
+        assert [r['success'] for r in results] == [True, False, True]
+        assert results[2]['new_balance'] == start - 300
+        assert journal_lines(directory) == lines + 1, 'accepted transfers were not journaled together'
+        store.close()
+
+        store = scratch_store(directory)
+        assert savings_balance(store) == start - 300
+        store.close()
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def read_pages(store, limit, **bounds):
+    """All of user 1's transactions, following the cursors `limit` at a time."""
+    transactions, cursor = store.transaction_page('1', limit=limit, **bounds)
+    while cursor is not None:
+        page, cursor = store.transaction_page('1', limit=limit, before=cursor, **bounds)
+        assert page, 'a cursor led to an empty page'
+        transactions += page
+    return transactions
+
+def check_pages(store):
+    """Pages of any size join up to the full history, without gaps or repeats."""
+    # Same-date transfers put page boundaries inside one date
+    today = datetime.now().strftime('%Y-%m-%d')
+    store.transfer_batch([batch_item(1, date=today) for _ in range(5)])
+    everything = store.transaction_page('1', limit=1000)[0]
+    assert store.transaction_page('1', limit=1000)[1] is None
+    dates = [tx['date'] for tx in everything]
+    assert dates == sorted(dates, reverse=True)
+    for limit in (1, 2, 3, 7, len(everything)):
+        assert read_pages(store, limit) == everything, f'pages of {limit} do not match the full history'
+    since, until = dates[-3], dates[1]
+    bounded = [tx for tx in everything if since <= tx['date'] <= until]
+    assert read_pages(store, 2, since=since, until=until) == bounded
+    print(f"{len(everything)} transactions, pages of 1 to {len(everything)} agree")
+
+def test_transaction_pages():
+    """Cursors of both stores walk the history newest first."""
+    print("\n=== Testing transaction cursors on the journaled store ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        store = scratch_store(directory)
+        check_pages(store)
+        store.close()
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+    print("\n=== Testing transaction cursors on the SQLite store ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        store = SQLiteStore(os.path.join(directory, 'bank.db'))
+        for user in load_mock_db(os.path.join(directory, 'mock_db.json'))['users'].values():
+            store.import_banking_user(user, user['transactions'])
+        check_pages(store)
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def check_replay(first, second, reopen):
+    """The same key sent to two stores on the same data is applied once."""
+    start = savings_balance(first)
+    result = keyed_transfer(first, 10, 'retry-1')
+    print(f"First submission: {result}")
+    assert result['success'] and not result.get('replayed')
+    result = keyed_transfer(second, 10, 'retry-1')
+    print(f"Resubmission to the other store: {result}")
+    assert result == {'success': True, 'new_balance': start - 10, 'replayed': True}
+    assert savings_balance(second) == start - 10
+    assert not keyed_transfer(second, 10, 'retry-2').get('replayed')
+    assert savings_balance(first) == start - 20
+    # After a restart (and for the JSON store a compaction) the key is still known
+    third = reopen()
+    assert keyed_transfer(third, 10, 'retry-1').get('replayed')
+    assert savings_balance(third) == start - 20
+
+def test_idempotent_transfer_across_stores():
+    """A resubmitted transfer moves the money once across processes and restarts."""
+    print("\n=== Testing idempotent transfers on the journaled store ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        stores = [scratch_store(directory), scratch_store(directory)]
+
+        def reopen():
+            stores[0].compact()
+            stores.append(scratch_store(directory))
+            return stores[-1]
+
+        check_replay(stores[0], stores[1], reopen)
+        for store in stores:
+            store.close()
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+    print("\n=== Testing idempotent transfers on the SQLite store ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'bank.db')
+        first = SQLiteStore(path)
+        for user in load_mock_db(os.path.join(directory, 'mock_db.json'))['users'].values():
+            first.import_banking_user(user, user['transactions'])
+        check_replay(first, SQLiteStore(path), lambda: SQLiteStore(path))
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def test_replayed_transfer_request():
+    """A retried voice transfer replays; the same key with another amount is a new transfer."""
+    print("\n=== Testing idempotent transfer requests ===\n")
+    directory = tempfile.mkdtemp()
+    saved = banking_service._account_store
+    try:
+        banking_service._account_store = store = scratch_store(directory)
+        start = savings_balance(store)
+        user = {'id': '1', 'name': 'John Doe'}
+
+        def request(amount, key):
+            intent = {'intent_type': 'transfer_money', 'parameters': {'amount': amount, 'recipient': 'Jane Smith'}}
+            return process_banking_request(intent, user, idempotency_key=key)
+
+        first = request(25, 'audio-1')
+        retry = request(25, 'audio-1')
+        print(f"First: {first['new_balance']}, retry: {retry}")
+        assert first['success'] and 'replayed' not in first
+        assert retry['replayed'] and retry['new_balance'] == first['new_balance']
+        assert savings_balance(store) == start - 25
+        assert not request(30, 'audio-1').get('replayed')
+        assert not request(25, None).get('replayed')
+        assert savings_balance(store) == start - 80
+        store.close()
+        print("OK")
+    finally:
+        banking_service._account_store = saved
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_compaction_crash_recovery()
+    test_read_waits_for_transfer_in_progress()
+    test_concurrent_transfers_and_reads()
+    test_batch_group_commit()
+    test_transaction_pages()
+    test_idempotent_transfer_across_stores()
+    test_replayed_transfer_request()
@@ -0,0 +1,119 @@
+"""
+Test script for the authorization of the account endpoints
+
+Endpoints that move money or return account history without a voice check
+must reject requests that only name a user_id, and serve only the session
+user's records. Malformed bulk transfers are rejected before any money
+moves. The app runs on a scratch account store and session key.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# The checks below need no models
+os.environ.setdefault('REQUIRED_MODELS', '')
+
+from app import app
+from services import banking_service, session_service
+from services.banking_service import AccountStore, get_account_store
+from services.session_service import issue_session_token
+
+@contextmanager
+def scratch_data():
+    """Point the account store and the session key at a temporary directory."""
+    directory = tempfile.mkdtemp()
+    saved = banking_service._account_store, session_service.SECRET_PATH, session_service._secret
+    banking_service._account_store = AccountStore(db_path=os.path.join(directory, 'mock_db.json'),
+                                                  journal_path=os.path.join(directory, 'mock_db.journal'),
+                                                  lock_path=os.path.join(directory, 'mock_db.lock'), fsync=False)
+    session_service.SECRET_PATH = os.path.join(directory, 'session_secret')
+    session_service._secret = None
+    try:
+        yield
+    finally:
+        banking_service._account_store, session_service.SECRET_PATH, session_service._secret = saved
+        shutil.rmtree(directory)
+
+def test_bulk_transfer_requires_session():
+    """/api/bulk-transfer without a valid session token changes nothing."""
+    with scratch_data():
+        print("\n=== Testing bulk transfer authorization ===\n")
+        client = app.test_client()
+        store = get_account_store()
+        before = store.get_accounts('1')
+        body = {'user_id': '1', 'transfers': [{'recipient': 'Jane Smith', 'amount': 1}]}
+
+        response = client.post('/api/bulk-transfer', json=body)
+        print(f"Without a token: {response.status_code} {response.get_json()}")
+        assert response.status_code == 401
+
+        response = client.post('/api/bulk-transfer', json=body, headers={'Authorization': 'Bearer forged.token'})
+        print(f"With a forged token: {response.status_code} {response.get_json()}")
+        assert response.status_code == 401
+
+        token, _ = issue_session_token({'id': '2', 'name': 'Jane Smith'})
+        response = client.post('/api/bulk-transfer', json=body, headers={'Authorization': f'Bearer {token}'})
+        print(f"With another user's token: {response.status_code} {response.get_json()}")
+        assert response.status_code == 403
+        assert store.get_accounts('1') == before
+        print("OK")
+
+def test_bulk_transfer_validation():
+    """Malformed batches are rejected; a valid one reports each transfer."""
+    with scratch_data():
+        print("\n=== Testing bulk transfer validation ===\n")
+        client = app.test_client()
+        token, _ = issue_session_token({'id': '1', 'name': 'John Doe'})
+        headers = {'Authorization': f'Bearer {token}'}
+        store = get_account_store()
+        start = store.get_accounts('1')['savings']['balance']
+
+        for transfers in ([], 'Jane Smith', ['Jane Smith'], [{}] * (app.config['BULK_TRANSFER_LIMIT'] + 1)):
+            response = client.post('/api/bulk-transfer', json={'transfers': transfers}, headers=headers)
+            print(f"{str(transfers)[:40]}: {response.status_code} {response.get_json()['message']}")
+            assert response.status_code == 400
+
+        transfers = [{'recipient': 'Jane Smith', 'amount': 10}, {'recipient': 'Nobody', 'amount': 10},
+                     {'recipient': 'Jane Smith', 'amount': 'ten'}, {'recipient': 'Jane Smith', 'amount': 20}]
+        response = client.post('/api/bulk-transfer', json={'transfers': transfers}, headers=headers)
+        result = response.get_json()
+        print(f"Atomic batch with invalid items: {result['succeeded']} succeeded, {result['failed']} failed")
+        assert result['succeeded'] == 0 and store.get_accounts('1')['savings']['balance'] == start
+
+        response = client.post('/api/bulk-transfer', json={'transfers': transfers, 'atomic': False}, headers=headers)
+        result = response.get_json()
+        print(f"Non-atomic batch: {[r['success'] for r in result['results']]}")
+        assert [r['success'] for r in result['results']] == [True, False, False, True]
+        assert store.get_accounts('1')['savings']['balance'] == start - 30
+        print("OK")
+
+def test_history_is_limited_to_the_session_user():
+    """Transactions and statements need a token and only return its owner's records."""
+    with scratch_data():
+        print("\n=== Testing transaction history authorization ===\n")
+        client = app.test_client()
+        token, _ = issue_session_token({'id': '2', 'name': 'Jane Smith'})
+        headers = {'Authorization': f'Bearer {token}'}
+
+        for url in ('/api/transactions?user_id=1', '/api/transactions/export?user_id=1'):
+            response = client.get(url)
+            print(f"{url} without a token: {response.status_code}")
+            assert response.status_code == 401
+            response = client.get(url, headers=headers)
+            print(f"{url} with another user's token: {response.status_code}")
+            assert response.status_code == 403
+
+        response = client.get('/api/transactions', headers=headers)
+        own = get_account_store().transaction_page('2', limit=20)[0]
+        print(f"Own transactions: {response.status_code}, {len(response.get_json()['transactions'])} records")
+        assert response.status_code == 200 and response.get_json()['transactions'] == own
+        response = client.get('/api/transactions/export', headers=headers)
+        assert response.status_code == 200 and 'statement_2.csv' in response.headers['Content-Disposition']
+        print("OK")
+
+if __name__ == "__main__":
+    test_bulk_transfer_requires_session()
+    test_bulk_transfer_validation()
+    test_history_is_limited_to_the_session_user()
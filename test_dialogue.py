@@ -0,0 +1,68 @@
+"""
+Test script for transfers completed over several turns
+
+Checks which follow-ups to a pending transfer may skip voice
+authentication: only an answer to its question, from the session that
+started it. A new complete transfer or any other request is authenticated.
+"""
+
+import time
+from models.intent_recognition import extract_intent
+from services.dialogue import continue_dialogue, record_outcome, skips_authentication, verified_at
+
+USER_ID = '1'
+SESSION = 'session-a'
+
+def start_transfer(text="Transfer money to Jane"):
+    """A transfer without an amount, left pending after a verified request."""
+    intent_data = extract_intent(text, 'en-US')
+    response = record_outcome(USER_ID, intent_data, {'success': False, 'error': 'Amount not specified'},
+                              verified=time.monotonic(), text=text, session=SESSION)
+    assert response['awaiting'] == 'amount', response
+    return response
+
+def follow_up(text, session=SESSION):
+    """Whether the request may skip biometrics, and the intent it acts on."""
+    verified = verified_at(USER_ID, session)
+    intent_data = continue_dialogue(USER_ID, extract_intent(text, 'en-US'), text, 'en-US')
+    return verified is not None and skips_authentication(intent_data), intent_data
+
+def test_answer_skips_authentication():
+    """Answering the pending question from the same session skips biometrics."""
+    print("\n=== Testing an answer to a pending transfer ===\n")
+    start_transfer()
+    skips, intent_data = follow_up("500")
+    print(f"'500': skips authentication {skips}, {intent_data['parameters']}")
+    assert skips
+    assert intent_data['parameters'].get('amount') == 500
+    print("OK")
+
+def test_new_transfer_requires_authentication():
+    """A new complete transfer during a pending dialogue is authenticated."""
+    print("\n=== Testing a new transfer during a pending transfer ===\n")
+    start_transfer()
+    skips, intent_data = follow_up("Transfer 900 to John")
+    print(f"'Transfer 900 to John': skips authentication {skips}, {intent_data}")
+    assert not skips
+    assert intent_data['matched_by'] != 'dialogue'
+
+    start_transfer()
+    skips, intent_data = follow_up("What is my balance")
+    print(f"'What is my balance': skips authentication {skips}, {intent_data['intent_type']}")
+    assert not skips
+    print("OK")
+
+def test_other_session_requires_authentication():
+    """The verified window belongs to the session token that started the transfer."""
+    print("\n=== Testing a follow-up from another session ===\n")
+    start_transfer()
+    for session in ('session-b', None):
+        skips, _ = follow_up("500", session)
+        print(f"Session {session}: skips authentication {skips}")
+        assert not skips
+    print("OK")
+
+if __name__ == "__main__":
+    test_answer_skips_authentication()
+    test_new_transfer_requires_authentication()
+    test_other_session_requires_authentication()
@@ -0,0 +1,71 @@
+"""
+Test script for the SQLite voice job queue
+
+Runs the queue on a scratch database and checks that workers complete
+jobs, and that a job held by a worker past its lease is finished with an
+error instead of staying 'running' and filling the backlog.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from services.admission import Overloaded
+from services.job_queue import JOB_BACKLOG, SQLiteJobQueue
+
+def test_worker_completes_jobs():
+    """A worker thread runs a queued job and the result is visible to waiters."""
+    print("\n=== Testing a job run by a worker ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        queue = SQLiteJobQueue(os.path.join(directory, 'jobs.db'))
+        job_id = queue.submit({'text': 'check my balance'}, owner_id='1')
+        stop = threading.Event()
+        worker = threading.Thread(target=queue.run_worker,
+                                  args=(lambda payload: ({'echo': payload['text']}, 200), stop))
+        worker.start()
+        job = queue.wait(job_id, after='queued', timeout=5)
+        if job['status'] == 'running':
+            job = queue.wait(job_id, after='running', timeout=5)
+        stop.set()
+        worker.join()
+        print(f"Job: {job['status']} {job.get('status_code')} {job.get('result')}")
+        assert job['status'] == 'done' and job['status_code'] == 200
+        assert job['result'] == {'echo': 'check my balance'}
+        assert queue.owner(job_id) == '1'
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+def test_expired_lease():
+    """A job whose worker died is finished with a 500 and frees its backlog slot."""
+    print("\n=== Testing job lease expiry ===\n")
+    directory = tempfile.mkdtemp()
+    try:
+        queue = SQLiteJobQueue(os.path.join(directory, 'jobs.db'), lease=0.2)
+        first = queue.submit({'n': 0})
+        for n in range(1, JOB_BACKLOG):
+            queue.submit({'n': n})
+        claimed_id, payload = queue.claim()
+        assert claimed_id == first and payload == {'n': 0}
+        try:
+            queue.submit({'n': JOB_BACKLOG})
+            assert False, 'the backlog should be full'
+        except Overloaded:
+            pass
+
+        # The worker holding the job never completes it
+        time.sleep(0.3)
+        queue.submit({'n': JOB_BACKLOG})
+        job = queue.get(first)
+        print(f"Abandoned job: {job['status']} {job['status_code']} {job['result']}")
+        assert job['status'] == 'done' and job['status_code'] == 500
+        assert queue.claim()[1] == {'n': 1}, 'the abandoned job was handed out again'
+        print("OK")
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_worker_completes_jobs()
+    test_expired_lease()
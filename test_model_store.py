@@ -0,0 +1,86 @@
+"""
+Test script for the model store's manifest checks
+
+Builds a fake exported model in a scratch store and checks that verify()
+reports missing, truncated and altered files, and that load_model()
+refuses a damaged export before loading anything.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from services.model_store import MANIFEST, WEIGHTS, _sha256, artifact_dir, load_model, read_manifest, verify
+from services.startup import ModelUnavailable
+
+MODEL = 'example/wav2vec2-test'
+
+def fake_export(store_dir):
+    """An export of MODEL with made-up files and a matching manifest."""
+    directory = artifact_dir(MODEL, store_dir)
+    os.makedirs(directory)
+    for name, content in ((WEIGHTS, b'\0' * 64), ('config.json', b'{}')):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(content)
+    manifest = {'model': MODEL, 'format': 'safetensors',
+                'files': {name: {'size': os.path.getsize(os.path.join(directory, name)),
+                                 'sha256': _sha256(os.path.join(directory, name))}
+                          for name in sorted(os.listdir(directory))}}
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    return directory
+
+def test_verify():
+    """verify() finds each kind of damage; checksums only when asked."""
+    print("\n=== Testing the manifest check ===\n")
+    store_dir = tempfile.mkdtemp()
+    try:
+        assert read_manifest(MODEL, store_dir) is None
+        assert verify(MODEL, store_dir=store_dir) == ['not exported']
+
+        directory = fake_export(store_dir)
+        assert read_manifest(MODEL, store_dir)['model'] == MODEL
+        assert verify(MODEL, checksums=True, store_dir=store_dir) == []
+
+        # Same size, other bytes: only the checksum tells
+        with open(os.path.join(directory, WEIGHTS), 'r+b') as f:
+            f.write(b'\1')
+        print(f"Altered weights: {verify(MODEL, checksums=True, store_dir=store_dir)}")
+        assert verify(MODEL, store_dir=store_dir) == []
+        assert verify(MODEL, checksums=True, store_dir=store_dir) == [f'{WEIGHTS} does not match its checksum']
+
+        with open(os.path.join(directory, WEIGHTS), 'ab') as f:
+            f.write(b'\0')
+        os.remove(os.path.join(directory, 'config.json'))
+        problems = verify(MODEL, store_dir=store_dir)
+        print(f"Truncated and missing files: {problems}")
+        assert problems == ['config.json is missing', f'{WEIGHTS} has 65 bytes, expected 64']
+
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            f.write('{not json')
+        assert verify(MODEL, store_dir=store_dir) == ['not exported']
+        print("OK")
+    finally:
+        shutil.rmtree(store_dir)
+
+def test_damaged_export_is_not_loaded():
+    """load_model() raises ModelUnavailable with the problems and the export command."""
+    print("\n=== Testing loading a damaged export ===\n")
+    store_dir = tempfile.mkdtemp()
+    try:
+        directory = fake_export(store_dir)
+        os.remove(os.path.join(directory, WEIGHTS))
+        try:
+            load_model(MODEL, store_dir=store_dir)
+            assert False, 'a damaged export was loaded'
+        except ModelUnavailable as e:
+            print(f"Error: {e}")
+            assert f'{WEIGHTS} is missing' in str(e)
+            assert e.install == 'python export_models.py'
+        print("OK")
+    finally:
+        shutil.rmtree(store_dir)
+
+if __name__ == "__main__":
+    test_verify()
+    test_damaged_export_is_not_loaded()
@@ -0,0 +1,61 @@
+"""
+Test script for spending summary intent recognition
+
+Checks that spending questions are recognized in English and Hindi, and
+that transfers and other requests using similar words are not taken for
+spending summaries.
+"""
+
+from models.intent_recognition import extract_intent
+from services import metrics
+
+def check(cases):
+    for phrase, language, expected in cases:
+        intent_type = extract_intent(phrase, language)['intent_type']
+        print(f"{language} \"{phrase}\": {intent_type}")
+        assert intent_type == expected, f'{phrase!r}: expected {expected}, got {intent_type}'
+
+def test_spending_questions():
+    """Spending questions in their common forms."""
+    print("\n=== Testing spending summary phrases ===\n")
+    check([
+        ("show my expenses", 'en-US', 'spending_summary'),
+        ("how much did I spend last month", 'en-US', 'spending_summary'),
+        ("what are my expenses", 'en-US', 'spending_summary'),
+        ("इस महीने का खर्चा दिखाओ", 'hi-IN', 'spending_summary'),
+        ("मैंने कितना खर्च किया", 'hi-IN', 'spending_summary'),
+        ("पिछले महीने कितना खर्चा हुआ", 'hi-IN', 'spending_summary'),
+    ])
+    print("OK")
+
+def test_spending_words_in_other_requests():
+    """Requests that mention expenses or amounts keep their own intent."""
+    print("\n=== Testing requests that resemble spending questions ===\n")
+    check([
+        ("pay 20 to my expenses account", 'en-US', 'transfer_money'),
+        ("transfer 100 to my expenses fund", 'en-US', 'transfer_money'),
+        ("what is my balance", 'en-US', 'check_balance'),
+        ("मेरा बैलेंस दिखाओ", 'hi-IN', 'check_balance'),
+        ("बैलेंस दिखाओ", 'hi-IN', 'check_balance'),
+        ("मेरे खाते में कितना पैसा है", 'hi-IN', 'check_balance'),
+    ])
+    intent_type = extract_intent("मैंने कितना पैसा भेजा", 'hi-IN')['intent_type']
+    print(f"hi-IN \"मैंने कितना पैसा भेजा\": {intent_type}")
+    assert intent_type != 'spending_summary'
+    print("OK")
+
+def test_unknown_language_label():
+    """Languages the client makes up are counted as 'other' in intent metrics."""
+    print("\n=== Testing the language label of intent metrics ===\n")
+    extract_intent("show my expenses", 'xx-made-up')
+    languages = {dict(labels).get('language') for name, labels in metrics._counters
+                 if name == 'intent_matches_total'}
+    print(f"Language labels: {sorted(languages)}")
+    assert 'other' in languages
+    assert 'xx-made-up' not in languages
+    print("OK")
+
+if __name__ == "__main__":
+    test_spending_questions()
+    test_spending_words_in_other_requests()
+    test_unknown_language_label()
@@ -0,0 +1,55 @@
+"""
+This script runs voice pipeline workers for VOICE_JOB_QUEUE=sqlite: it takes
+the jobs queued by the web app from the shared job database, processes
+them and stores the results for the web app to return.
+
+Start as many worker processes as the machine has room for model inference;
+they scale independently of the web workers.
+
+Usage:
+    python voice_worker.py [--threads N] [--db PATH]
+"""
+
+import argparse
+import sys
+import threading
+from services.job_queue import SQLiteJobQueue, JOB_DB_PATH
+from services.logs import configure_logging
+from services.startup import StartupError, check_startup
+from services.voice_pipeline import run_voice_job
+
+def main():
+    """Main function to process queued voice jobs until interrupted."""
+    parser = argparse.ArgumentParser(description='Process queued voice requests')
+    parser.add_argument('--threads', type=int, default=1, help='Jobs to process concurrently')
+    parser.add_argument('--db', default=JOB_DB_PATH, help='Path of the job database')
+    args = parser.parse_args()
+
+    configure_logging()
+    try:
+        check_startup()
+    except StartupError as e:
+        print(f"Error: {e}")
+        return 1
+
+    queue = SQLiteJobQueue(args.db)
+    stop = threading.Event()
+    workers = [threading.Thread(target=queue.run_worker, args=(run_voice_job, stop), daemon=True)
+               for _ in range(max(args.threads, 1))]
+    for worker in workers:
+        worker.start()
+    print(f"Processing voice jobs from {args.db} with {len(workers)} thread(s), Ctrl+C to stop")
+
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=1)
+    except KeyboardInterrupt:
+        print("Stopping after the current jobs...")
+        stop.set()
+        for worker in workers:
+            worker.join()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())